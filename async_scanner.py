@@ -0,0 +1,268 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# Python Imports
+
+import asyncio
+import functools
+import json
+import sys
+import time
+
+# Tools Imports
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Project Imports
+
+from b2_connector import make_fileinfo
+from library import RETRY_STATUS_CODES
+from library import backoff_delay
+from library import decode_list_page
+from report_writers import TextReportWriter
+
+
+class AsyncBucketScanner:
+    '''
+    Scans every bucket in the account concurrently. Each bucket is paged
+    through serially (every page needs the previous page's cursor), but the
+    pages of many buckets are in flight at the same time, up to a global
+    limit.
+
+    Requests go through aiohttp when it is installed. Without it, each
+    request is handed to the connector's blocking list_file_versions on a
+    thread, which still shares the connector's connection pool.
+    '''
+
+    def __init__(self, connector, max_in_flight=16):
+        '''
+        :param connector: An authorized B2Connector. Its token is used for
+        every request, so the account is only authorized once.
+        :param max_in_flight: Maximum number of b2_list_file_versions
+        requests outstanding across all buckets.
+        '''
+
+        self.connector = connector
+        self.max_in_flight = max_in_flight
+
+    def run(self, bucket_names=None, writer=None):
+        '''
+        Scans the buckets and prints one version report per bucket, in the
+        order the buckets finish.
+        :param bucket_names: Only scan these buckets (optional, default all)
+        :param writer: ReportWriter (optional, default text to stdout)
+        :return: None
+        '''
+
+        writer = writer or TextReportWriter(sys.stdout)
+
+        buckets = self.connector.list_buckets()
+        if bucket_names:
+            buckets = [b for b in buckets if b['bucketName'] in bucket_names]
+
+        asyncio.run(self._scan_buckets(buckets, writer))
+
+    async def _scan_buckets(self, buckets, writer):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        if aiohttp is not None:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                await self._gather(buckets, semaphore, session, writer)
+        else:
+            await self._gather(buckets, semaphore, None, writer)
+
+    async def _gather(self, buckets, semaphore, session, writer):
+        tasks = [self._scan_bucket(b, semaphore, session) for b in buckets]
+        for task in asyncio.as_completed(tasks):
+            bucket_name, groups, total_files, total_file_versions = \
+                await task
+            self.connector.print_report(groups, total_files,
+                                        total_file_versions, writer,
+                                        bucket_name)
+
+    async def _list_page(self, bucket_id, next_file_name, next_file_id,
+                         semaphore, session):
+        '''
+        Fetches one page of b2_list_file_versions. On the aiohttp path,
+        retryable failures are retried with backoff, an expired token is
+        replaced and every attempt holds a slot of the connector's limiter,
+        like B2Connector._call_api does on the blocking path.
+        :return: result in dictionary form, HTTP status code
+        '''
+
+        if session is None:
+            async with semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    None, functools.partial(
+                        self.connector.list_file_versions, bucket_id, 10000,
+                        next_file_name, next_file_id,
+                        decoder=decode_list_page))
+
+        connector = self.connector
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            token = connector.authToken
+            async with semaphore:
+                # The limiter blocks, so it is waited for on a thread; the
+                # semaphore keeps those threads to max_in_flight.
+                await loop.run_in_executor(None, connector.limiter.acquire)
+                throttled = False
+                try:
+                    result, status_code = await self._post_list_page(
+                        session, bucket_id, next_file_name, next_file_id,
+                        token)
+                    throttled = status_code in (429, 503)
+                finally:
+                    connector.limiter.release(throttled)
+
+            if attempt >= connector.max_retries:
+                return result, status_code
+
+            error_code = result.get('code') if isinstance(result, dict) \
+                else None
+            if status_code == 401 and error_code in ('expired_auth_token',
+                                                     'bad_auth_token'):
+                await loop.run_in_executor(None, connector._reauthorize,
+                                           token)
+            elif status_code in RETRY_STATUS_CODES:
+                await asyncio.sleep(backoff_delay(attempt))
+            else:
+                return result, status_code
+
+            attempt = attempt + 1
+
+    async def _post_list_page(self, session, bucket_id, next_file_name,
+                              next_file_id, token):
+        '''
+        Makes a single b2_list_file_versions request through aiohttp.
+        :return: result in dictionary form, HTTP status code
+        '''
+
+        connector = self.connector
+        url = connector.apiUrl + connector.api_version + \
+            'b2_list_file_versions'
+
+        data = {}
+        data['bucketId'] = bucket_id
+        data['maxFileCount'] = 10000
+        if next_file_name:
+            data['startFileName'] = next_file_name
+            if next_file_id:
+                data['startFileId'] = next_file_id
+
+        headers = {}
+        headers['Authorization'] = token
+
+        # These requests don't go through the connector's HttpTransport, so
+        # they are recorded in its metrics here.
+
+        metrics = connector.metrics
+        start_time = time.time()
+        try:
+            async with session.post(url, json=data,
+                                    headers=headers) as response:
+                body = await response.read()
+                metrics.observe('b2_list_file_versions',
+                                time.time() - start_time, response.status,
+                                0, len(body))
+                if response.status == 200:
+                    result = decode_list_page(body)
+                else:
+                    result = json.loads(body)
+                return result, response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            metrics.observe('b2_list_file_versions',
+                            time.time() - start_time, 900)
+            print('HTTP POST Request failed', file=sys.stderr)
+            print(url, file=sys.stderr)
+            print(e, file=sys.stderr)
+            return [], 900
+
+    async def _scan_bucket(self, bucket, semaphore, session):
+        '''
+        Pages through one bucket, grouping versions by file name the same way
+        B2Connector's streaming scan does.
+        :return: bucket name, list of (file name, versions) for files with
+        more than one version, total_files, total_file_versions
+        '''
+
+        multi_version_groups = []
+        total_files = 0
+        total_file_versions = 0
+
+        key = None
+        versions = []
+        next_file_name = ''
+        next_file_id = ''
+        first_run = True
+
+        while ((next_file_name and next_file_id) or first_run):
+            first_run = False
+            result, status_code = await self._list_page(
+                bucket['bucketId'], next_file_name, next_file_id, semaphore,
+                session)
+            if status_code != 200:
+                print('Non 200 status code issued for bucket ' +
+                      bucket['bucketName'] + '.')
+                sys.exit()
+
+            next_file_name = result['nextFileName']
+            next_file_id = result['nextFileId']
+
+            metrics = self.connector.metrics
+            metrics.count('pages')
+            metrics.count('versions', len(result['files']))
+
+            for item in result['files']:
+                total_file_versions = total_file_versions + 1
+                if item.fileName != key:
+                    if len(versions) > 1:
+                        multi_version_groups.append((key, versions))
+                    elif versions:
+                        total_files = total_files + 1
+                    key = item.fileName
+                    versions = []
+                versions.append(make_fileinfo(item))
+
+        if len(versions) > 1:
+            multi_version_groups.append((key, versions))
+        elif versions:
+            total_files = total_files + 1
+
+        return bucket['bucketName'], multi_version_groups, total_files, \
+            total_file_versions
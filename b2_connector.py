@@ -36,147 +36,503 @@ from __future__ import print_function
 
 import base64
 import hashlib
+import json
+import math
+import mmap
+import os
+import random
 import sys
-import datetime
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import quote
 
 # Tools Imports
 
+import requests
 import yaml
 
 # Project Imports
 
 from library import fetchUrl
-from library import postUrlPyCurl
+from library import postData
+from library import HashingReader
+from library import UploadTargetPool
+from library import HttpTransport
+from library import AdaptiveLimiter
+from library import RETRY_STATUS_CODES
+from library import backoff_delay
+from library import load_checkpoint
+from library import save_checkpoint
+from library import write_file_atomically
+from library import decode_list_page
+from library import RateLimiter
+from library import prefetch
+from duplicates import describe_key
+from duplicates import find_duplicates
+from duplicates import write_spill
+from estimate import Alphabets
+from estimate import Stratum
+from estimate import successor_probes
+from estimate import combine_strata
+from prune import PRUNE_POLICIES
+from prune import PruneJournal
+from metrics import Metrics
+from network_probe import probe_endpoints
+from network_probe import slow_endpoints
+from report_writers import TextReportWriter
+from version_store import VersionStore
+from version_stats import GAP_BUCKETS
+from version_stats import GAP_PERCENTILES
+from version_stats import version_stats
+from verify import ContentHasher
+from verify import DOWNLOAD_CHUNK_SIZE
+from verify import RANGES_AHEAD
+from verify import VERIFIED
+from verify import MISMATCH
+from verify import UNHASHED
+from verify import FAILED
+from verify import check_version
+from verify import split_ranges
+
+def make_fileinfo(item):
+    '''
+    Keeps the fields of a b2_list_file_versions entry the report uses.
+    :param item: ListEntry from decode_list_page
+    :return: fileinfo dictionary
+    '''
+
+    fileinfo = {}
+    fileinfo['md5'] = item.contentMd5
+    fileinfo['sha1'] = item.contentSha1
+    fileinfo['uploadtimestamp'] = item.uploadTimestamp
+    fileinfo['fileId'] = item.fileId
+    return fileinfo
+
+def _prefix_end(prefix):
+    '''
+    Returns the first name that sorts after every name starting with
+    prefix, or None for the empty prefix.
+    '''
+
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _content_range_start(content_range):
+    '''
+    Returns the first byte of a "bytes first-last/length" Content-Range
+    header, or None if there isn't one.
+    '''
+
+    if not content_range or not content_range.startswith('bytes '):
+        return None
+    try:
+        return int(content_range[6:].split('-', 1)[0])
+    except ValueError:
+        return None
+
+def _name_between(low, high):
+    '''
+    Returns a file name that sorts strictly between low and high, or None if
+    there is no convenient one. A high of None means the end of the keyspace.
+    Names are compared by code point, which matches the UTF-8 byte order B2
+    lists in.
+    '''
+
+    if high is not None and low >= high:
+        return None
+
+    prefix = ''
+    i = 0
+    while True:
+        # B2 doesn't allow control characters in names, so anything below a
+        # space stands for "low has run out of characters here".
+
+        low_c = ord(low[i]) if i < len(low) else 0x1f
+        if high is None:
+            high_c = max(0x7f, low_c + 2)
+        else:
+            high_c = ord(high[i]) if i < len(high) else 0x1f
+
+        if high_c - low_c >= 2:
+            return prefix + chr((low_c + high_c) // 2)
+        if low_c < 0x20:
+            return None
+        if high_c == low_c + 1:
+            # Anything starting with low's character is already below high.
+            high = None
+        prefix = prefix + chr(low_c)
+        i = i + 1
+
+
+# Account authorization tokens are valid for 24 hours. Cached tokens are
+# dropped a little earlier so a run doesn't start with one about to expire.
+
+AUTH_TOKEN_LIFETIME = 23 * 60 * 60
+
+# The "prefix" shard strategy looks at one page of this many entries per
+# folder level; a larger level is sampled instead of listed.
+
+DISCOVERY_PAGE_SIZE = 1000
 
 class B2Connector:
 
-    def __init__(self):
+    def __init__(self, settings_file='config.yaml', cassette=None):
         '''
         Initiliaze & load configuration from settings file. Also -
         calls authentication method during initialization so object is ready
         to make requests to B2.
+        :param settings_file: YAML configuration file (optional)
+        :param cassette: PageRecorder to record the listing pages to, or
+        PageReplayer to replay them from instead of calling B2 (optional).
+        See cassette.py.
         :return: None
         '''
 
-        settings_file = 'config.yaml'
         with open(settings_file, 'r') as stream:
             settings = yaml.safe_load(stream)
+        self.settings_file = os.path.abspath(settings_file)
 
         self.key_id = settings['keyid']
         self.app_key = settings['appkey']
         self.bucket_name = settings['bucketName']
         self.api_version = settings['apiVersion']
 
+        # authUrl only needs changing to point the connector at a stand-in
+        # server such as fake_b2_server.py.
+
+        self.auth_url = settings.get('authUrl', 'https://api.backblaze.com')
+
+        # All B2 calls share one pool of keep-alive connections. poolSize
+        # should be at least the number of workers used for a scan. Every
+        # call is recorded in self.metrics.
+
+        self.metrics = Metrics()
+        self.transport = HttpTransport(
+            pool_size=settings.get('poolSize', 16),
+            connect_timeout=settings.get('connectTimeout', 10),
+            read_timeout=settings.get('readTimeout', 120),
+            metrics=self.metrics)
+
+        # Requests that fail with a retryable status are retried with
+        # exponential backoff, and the number of concurrent requests adapts to
+        # how often B2 says it is busy.
+
+        self.max_retries = settings.get('maxRetries', 5)
+        self.limiter = AdaptiveLimiter(settings.get('poolSize', 16))
+
+        # Listing pages fetched ahead of the one being processed. 0 turns
+        # prefetching off.
+
+        self.prefetch_pages = settings.get('prefetchPages', 1)
+        self._auth_lock = threading.RLock()
+
+        # Files larger than the part size are uploaded as large files, with
+        # uploadWorkers parts in flight. Without uploadPartSize, B2's
+        # recommended part size is used.
+
+        self.upload_part_size = settings.get('uploadPartSize')
+        self.upload_workers = settings.get('uploadWorkers', 4)
+
+        # Upload urls and their tokens are reused from one upload to the
+        # next, so a small file only takes one request.
+
+        self.upload_targets = UploadTargetPool(self.getUploadFileUrl)
+
+        # Workers of a coordinated scan on other machines authenticate to
+        # the coordinator with coordinatorKey (see scan_coordinator.py).
+
+        self.coordinator_key = settings.get('coordinatorKey')
+
+        # Authorization results and bucket ids are cached on disk so short
+        # runs can skip b2_authorize_account and b2_list_buckets. An empty
+        # authCacheFile turns the cache off.
+
+        self.auth_cache_file = os.path.expanduser(
+            settings.get('authCacheFile', '~/.b2_count_versions_auth.json'))
+        self.auth_from_cache = False
+        self.auth_seconds = 0
+
         self.apiUrl = ''
         self.authToken = ''
         self.downloadUrl = ''
         self.accountId = ''
 
-        self.authB2()
+        # Replayed listings need no authorization, only the bucket they were
+        # recorded from.
 
-    def authB2(self):
+        self.cassette = cassette
+        if cassette is not None and cassette.replaying:
+            self.bucket_id = cassette.bucket_id
+            self.bucket_name = cassette.bucket_name
+        else:
+            self.authB2()
+            if cassette is not None:
+                cassette.start(self.bucket_id, self.bucket_name)
+
+    def _read_auth_cache(self):
         '''
-        Authentication against B2 using the credentials stored in the
-        configuration file. If successful, the return token will be stored in
-        the instance of the class for future references.
+        :return: the whole auth cache, keyed by key id. Empty if there is no
+        cache or it can't be read.
+        '''
+
+        if not self.auth_cache_file:
+            return {}
+        try:
+            with open(self.auth_cache_file, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_auth_cache(self, entry):
+        '''
+        Stores the cache entry for this key id. The file holds live
+        authorization tokens, so it is only readable by its owner.
+        :param entry: dictionary to store
         :return: None
         '''
 
-        # TODO: Instead of fetching a new auth token each time this class is
-        # instantiated, persist the token somewhere (on disk?) and try using
-        # it. If it fails, fetch another one.
+        if not self.auth_cache_file:
+            return
 
-        auth_string = self.key_id + ':' + self.app_key
-        basic_auth_string = 'Basic ' + base64.b64encode(auth_string.encode(
-            'ascii')).decode('ascii')
+        cache = self._read_auth_cache()
+        cache[self.key_id] = entry
 
-        baseUrl = "https://api.backblaze.com" + self.api_version
-        authCmd = "b2_authorize_account"
+        try:
+            write_file_atomically(self.auth_cache_file,
+                                  json.dumps(cache).encode('utf-8'))
+        except (IOError, OSError) as e:
+            print('Could not write auth cache: ' + str(e), file=sys.stderr)
 
-        url = baseUrl + authCmd
+    def authB2(self, use_cache=True):
+        '''
+        Authentication against B2 using the credentials stored in the
+        configuration file. If successful, the return token will be stored in
+        the instance of the class for future references. Unless use_cache is
+        False, a token cached on disk by an earlier run is used while it is
+        still valid; _call_api calls this with use_cache=False when B2 rejects
+        the token, which also replaces the cached one.
+        :param use_cache: try the on-disk token cache first
+        :return: None
+        '''
 
-        headers = {}
-        headers['Authorization'] = basic_auth_string
+        start_time = time.time()
 
-        result, elapsed_time, status_code = fetchUrl(url, 'GET',
-                                                     headers=headers)
-        self.apiUrl = result['apiUrl']
-        self.authToken = result['authorizationToken']
-        self.downloadUrl = result['downloadUrl']
-        self.accountId = result['accountId']
+        cached = self._read_auth_cache().get(self.key_id)
+        if use_cache and cached and cached['expires'] > time.time():
+            self.auth_from_cache = True
+            entry = cached
+        else:
+            self.auth_from_cache = False
+            result = self._authorize_account()
+
+            # Bucket ids don't change when the token does, keep them.
+
+            entry = {}
+            entry['expires'] = time.time() + AUTH_TOKEN_LIFETIME
+            entry['apiUrl'] = result['apiUrl']
+            entry['authorizationToken'] = result['authorizationToken']
+            entry['downloadUrl'] = result['downloadUrl']
+            entry['accountId'] = result['accountId']
+            entry['allowed'] = result['allowed']
+            entry['recommendedPartSize'] = result['recommendedPartSize']
+            entry['absoluteMinimumPartSize'] = \
+                result['absoluteMinimumPartSize']
+            entry['bucketIds'] = cached['bucketIds'] if cached else {}
+            self._write_auth_cache(entry)
+
+        self.apiUrl = entry['apiUrl']
+        self.authToken = entry['authorizationToken']
+        self.downloadUrl = entry['downloadUrl']
+        self.accountId = entry['accountId']
+
+        # Entries cached before part sizes were kept get B2's defaults.
+
+        self.part_size = self.upload_part_size or \
+            entry.get('recommendedPartSize', 100 * 1000 * 1000)
+        self.minimum_part_size = entry.get('absoluteMinimumPartSize',
+                                           5 * 1000 * 1000)
 
         # if the application key is bound to only one bucket, the bucketId
         # is actually in the result. In this case, just use the bucketId if
         # it matches the name in config.yaml. If not, error out.
 
-        if result['allowed']['bucketId']:
-            if result['allowed']['bucketName'] == self.bucket_name:
-                self.bucket_id = result['allowed']['bucketId']
+        allowed = entry['allowed']
+        if allowed['bucketId']:
+            if allowed['bucketName'] == self.bucket_name:
+                self.bucket_id = allowed['bucketId']
             else:
                 print('Bucket authorized in key does not match config.yaml. '
                       'Exiting.')
                 sys.exit()
+        elif self.bucket_name in entry['bucketIds']:
+            self.bucket_id = entry['bucketIds'][self.bucket_name]
         else:
             self.bucket_id = self.getBucketIdFromName(self.bucket_name)
+            entry['bucketIds'][self.bucket_name] = self.bucket_id
+            self._write_auth_cache(entry)
 
-    def getBucketIdFromName(self, bucket_name):
+        self.auth_seconds = time.time() - start_time
+
+    def _authorize_account(self):
         '''
-        Returns a bucket ID from a bucket_name.
-        :param bucket_name: bucket_name
-        :return: bucketId
+        Calls b2_authorize_account, retrying transient failures.
+        :return: result in dictionary form
         '''
 
-        cmd = "b2_list_buckets"
-        url = self.apiUrl + self.api_version + cmd
+        auth_string = self.key_id + ':' + self.app_key
+        basic_auth_string = 'Basic ' + base64.b64encode(auth_string.encode(
+            'ascii')).decode('ascii')
+
+        baseUrl = self.auth_url + self.api_version
+        authCmd = "b2_authorize_account"
+
+        url = baseUrl + authCmd
 
         headers = {}
-        headers['Authorization'] = self.authToken
+        headers['Authorization'] = basic_auth_string
+
+        attempt = 0
+        while True:
+            result, elapsed_time, status_code = fetchUrl(
+                url, 'GET', headers=headers, transport=self.transport)
+            if status_code in RETRY_STATUS_CODES and \
+                    attempt < self.max_retries:
+                time.sleep(backoff_delay(attempt))
+                attempt = attempt + 1
+            else:
+                break
+
+        if status_code != 200:
+            print('Authorization failed: status code ' + str(status_code),
+                  file=sys.stderr)
+            print(result, file=sys.stderr)
+            sys.exit(1)
+
+        return result
+
+    def _reauthorize(self, expired_token):
+        '''
+        Fetches a new account authorization token, unless another thread
+        already replaced expired_token while this one was waiting.
+        :param expired_token: the token B2 rejected
+        :return: None
+        '''
+
+        with self._auth_lock:
+            if self.authToken == expired_token:
+                self.authB2(use_cache=False)
+
+    def _call_api(self, cmd, http_verb, params={}, data="", decoder=None):
+        '''
+        Calls a B2 API with the account authorization token. Retryable
+        failures (see RETRY_STATUS_CODES) are retried with exponential backoff
+        and jitter, and an expired or rejected token is replaced via authB2
+        before trying again. Every attempt holds a slot of self.limiter, which
+        shrinks when B2 answers 429 or 503 and grows back as requests succeed.
+        :param cmd: API name, e.g. b2_list_buckets
+        :param http_verb: The http verb, GET or POST
+        :param params: dictionary of parameters to pass with the request
+        :param data: data to be posted with the request
+        :param decoder: decodes successful responses, see fetchUrl (optional)
+        :return: result in dictionary form, HTTP status code of the last
+        attempt
+        '''
+
+        attempt = 0
+        while True:
+            url = self.apiUrl + self.api_version + cmd
+            token = self.authToken
+
+            headers = {}
+            headers['Authorization'] = token
+
+            self.limiter.acquire()
+            throttled = False
+            try:
+                result, elapsed_time, status_code = fetchUrl(
+                    url, http_verb, headers=headers, params=params, data=data,
+                    transport=self.transport, decoder=decoder)
+                throttled = status_code in (429, 503)
+            finally:
+                self.limiter.release(throttled)
+
+            if attempt >= self.max_retries:
+                return result, status_code
+
+            error_code = result.get('code') if isinstance(result, dict) \
+                else None
+            if status_code == 401 and error_code in ('expired_auth_token',
+                                                     'bad_auth_token'):
+                self._reauthorize(token)
+            elif status_code in RETRY_STATUS_CODES:
+                time.sleep(backoff_delay(attempt))
+            else:
+                return result, status_code
+
+            attempt = attempt + 1
+
+    def list_buckets(self):
+        '''
+        Lists every bucket in the account.
+        :return: list of bucket dictionaries, as returned by b2_list_buckets
+        '''
+
+        cmd = "b2_list_buckets"
 
         params = {}
         params['accountId'] = self.accountId
 
-        result, elapsed_time, status_code = fetchUrl(url, "GET",
-                                                     headers=headers,
-                                                     params=params)
-        for r in result['buckets']:
+        result, status_code = self._call_api(cmd, "GET", params=params)
+        if status_code != 200:
+            print('List buckets: status code ' + str(status_code),
+                  file=sys.stderr)
+            print(result, file=sys.stderr)
+            sys.exit(1)
+
+        return result['buckets']
+
+    def getBucketIdFromName(self, bucket_name):
+        '''
+        Returns a bucket ID from a bucket_name.
+        :param bucket_name: bucket_name
+        :return: bucketId
+        '''
+
+        for r in self.list_buckets():
             if r['bucketName'] == bucket_name:
                 return r['bucketId']
 
-    def getUploadFileUrl(self, retry_count):
+    def getUploadFileUrl(self, retry_count=0):
         '''
         When uploading a file to B2, you first need to ask the central
         authority for a specific pod to upload the file to. You also need an
         upload authToken to upload a file. This method makes that request and
-        returns the uploadUrl and authToken.
+        returns the uploadUrl and authToken. uploadFile reuses them through
+        self.upload_targets instead of calling this for every file.
+        :param retry_count: attempts that already failed (optional)
         :return: A tuple with uploadUrl used to upload a file to B2 and the
         authToken needed to do an upload.
         '''
 
-        # Start the status code at something. 800 is failure. If success,
-        # it will change to 200. If not, it will change to something else
-        # that will be caught in the error handling.
-
-        status_code = 800
-
         getUploadUrlCmd = "b2_get_upload_url"
-        url = self.apiUrl + self.api_version + getUploadUrlCmd
         params = {}
 
         params['bucketId'] = self.bucket_id
 
-        headers = {}
-        headers['Authorization'] = self.authToken
-
-        result, elapsed_time, status_code = fetchUrl(url, "GET", params=params,
-                                                     headers=headers)
-        if status_code == 200:
-            return result['uploadUrl'], result['authorizationToken']
+        while True:
+            result, status_code = self._call_api(getUploadUrlCmd, "GET",
+                                                 params=params)
+            if status_code == 200:
+                return result['uploadUrl'], result['authorizationToken']
 
-        else:
             print('Get Upload URL: status code ' + str(status_code),
                   file=sys.stderr)
             print('Retry count: ' + str(retry_count), file=sys.stderr)
-            print(url, file=sys.stderr)
+            print(getUploadUrlCmd, file=sys.stderr)
             print(params, file=sys.stderr)
             print(result, file=sys.stderr)
 
@@ -184,146 +540,1859 @@ class B2Connector:
             # that, bail.
 
             retry_count = retry_count + 1
-
-            if retry_count < 4:
-                self.getUploadFileUrl(retry_count)
-            else:
+            if retry_count >= 4:
                 sys.exit(1)
 
-    def uploadFile(self, filename, runfrom):
+    def uploadFile(self, filename, file_name=None,
+                   content_type='b2/x-auto', part_size=None, workers=None):
         '''
-        Upload a file to the B2 service using b2_upload_file.
-        :param filename: filename
-        :return:
+        Upload a file to the B2 service. The file is streamed from disk and
+        hashed on the way, never held in memory. Files larger than part_size
+        are uploaded as large files, part_size bytes per part, with workers
+        parts in flight at once.
+        :param filename: local file to upload
+        :param file_name: name in the bucket (optional, default filename)
+        :param content_type: content type (optional, B2 guesses by default)
+        :param part_size: largest file uploaded in one request, and the size
+        of the parts of larger ones (optional, default uploadPartSize from
+        config.yaml or B2's recommended part size)
+        :param workers: parts uploaded in parallel (optional, default
+        uploadWorkers from config.yaml)
+        :return: B2's description of the uploaded file, in dictionary form
         '''
 
-        payload = b""
-        payload_sha1_hash = hashlib.sha1()
+        file_name = file_name or filename
+        part_size = part_size or self.part_size
+        workers = workers or self.upload_workers
 
-        with open(filename, 'rb') as file:
-            for block in iter(lambda: file.read(65536), b''):
-                payload_sha1_hash.update(block)
-                payload = payload + block
-        payload_sha1_hash = payload_sha1_hash.hexdigest()
-        file.close()
+        size = os.path.getsize(filename)
+        if size > part_size:
+            return self._upload_large_file(filename, file_name, content_type,
+                                           size, part_size, workers)
 
-        uploadUrl, authToken = self.getUploadFileUrl(0)
-        size = len(payload)
         headers = {}
+        headers['X-Bz-File-Name'] = quote(file_name.encode('utf-8'), safe='/')
+        headers['Content-Type'] = content_type
+        headers['X-Bz-Content-Sha1'] = 'hex_digits_at_end'
+
+        # The upload url and token are checked out of the pool for the
+        # duration of the upload, B2 only takes one upload at a time on each.
 
-        headers['X-Bz-File-Name'] = filename
-        headers['Content-Type'] = 'b2/x-auto'
-        headers['X-Bz-Content-Sha1'] = payload_sha1_hash
-        headers['Authorization'] = authToken
+        with open(filename, 'rb') as f:
+            body = HashingReader(f, size)
+            result, status_code, target = self._post_upload(
+                self.upload_targets.fetch, body, headers,
+                self.upload_targets.acquire())
 
-        timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        if status_code == 200:
+            self.upload_targets.release(target)
+        else:
+            print('Upload ' + filename + ': status code ' + str(status_code),
+                  file=sys.stderr)
+            print(result, file=sys.stderr)
+            sys.exit(1)
 
-        result, data = postUrlPyCurl(uploadUrl, headers, payload)
-        self.db.save_performance_stats(timestamp, data, uploadUrl,
-                                       self.cluster, 'upload', size, runfrom)
+        return result
+
+    def upload_files(self, filenames, workers=None):
+        '''
+        Uploads many files in parallel, each under its own name. Every thread
+        keeps reusing an upload url from self.upload_targets, so after the
+        first few uploads each small file takes a single request.
+        :param filenames: local files to upload
+        :param workers: files uploaded at once (optional, default
+        uploadWorkers from config.yaml)
+        :return: list of B2's descriptions of the uploaded files, in the
+        order of filenames
+        '''
+
+        workers = workers or self.upload_workers
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.uploadFile, filenames))
+
+    def _post_upload(self, get_target, body, headers, target=None):
+        '''
+        Posts to an upload url (b2_upload_file or b2_upload_part), retrying
+        like _call_api. An upload url takes one upload at a time, and B2 may
+        turn one away with a 503 or let its token expire; either way the
+        upload is retried on a new one.
+        :param get_target: returns a new target, a tuple starting with the
+        upload url and authorization token
+        :param body: bytes-like body, or a HashingReader which is rewound
+        before every attempt
+        :param headers: headers besides Authorization
+        :param target: target to try first (optional)
+        :return: result in dictionary form, HTTP status code of the last
+        attempt, the target it used
+        '''
+
+        attempt = 0
+        while True:
+            if target is None:
+                target = get_target()
+            upload_url, token = target[:2]
+
+            request_headers = dict(headers)
+            request_headers['Authorization'] = token
+            if isinstance(body, HashingReader):
+                body.seek(0)
+
+            self.limiter.acquire()
+            throttled = False
+            try:
+                result, elapsed_time, status_code = postData(
+                    upload_url, request_headers, body,
+                    transport=self.transport)
+                throttled = status_code in (429, 503)
+            finally:
+                self.limiter.release(throttled)
+
+            if status_code == 200 or attempt >= self.max_retries:
+                return result, status_code, target
+
+            if status_code == 401 or status_code in RETRY_STATUS_CODES:
+                target = None
+                if status_code != 401:
+                    time.sleep(backoff_delay(attempt))
+            else:
+                return result, status_code, target
+
+            attempt = attempt + 1
+
+    def _call_large_file_api(self, cmd, data):
+        '''
+        Calls one of the large file APIs, exiting if it fails.
+        :return: result in dictionary form
+        '''
+
+        result, status_code = self._call_api(cmd, "POST", data=data)
+        if status_code != 200:
+            print(cmd + ': status code ' + str(status_code), file=sys.stderr)
+            print(result, file=sys.stderr)
+            sys.exit(1)
+        return result
+
+    def _upload_large_file(self, filename, file_name, content_type, size,
+                           part_size, workers):
+        '''
+        Uploads a file with b2_start_large_file, b2_upload_part and
+        b2_finish_large_file. The file is memory-mapped, and each worker
+        thread hashes and sends the parts it takes straight from the mapping
+        (hashlib releases the GIL, so hashing runs in parallel too), using
+        its own part upload url. The large file is cancelled if a part
+        can't be uploaded.
+        :return: B2's description of the uploaded file, in dictionary form
+        '''
+
+        if part_size < self.minimum_part_size:
+            print('Part size must be at least ' +
+                  str(self.minimum_part_size) + ' bytes.', file=sys.stderr)
+            sys.exit(1)
+
+        data = {}
+        data['bucketId'] = self.bucket_id
+        data['fileName'] = file_name
+        data['contentType'] = content_type
+        file_id = self._call_large_file_api('b2_start_large_file',
+                                            data)['fileId']
+
+        def get_part_url():
+            data = {}
+            data['fileId'] = file_id
+            result = self._call_large_file_api('b2_get_upload_part_url', data)
+            return result['uploadUrl'], result['authorizationToken']
+
+        part_count = (size + part_size - 1) // part_size
+        part_sha1s = [None] * part_count
+        lock = threading.Lock()
+        pending = iter(range(part_count))
+
+        def upload_parts(view):
+            target = None
+            while True:
+                with lock:
+                    part = next(pending, None)
+                if part is None:
+                    return
+
+                # The slice has to be released even when the upload raises,
+                # or the mmap can't be closed.
+
+                body = view[part * part_size:(part + 1) * part_size]
+                try:
+                    sha1 = hashlib.sha1(body).hexdigest()
+
+                    headers = {}
+                    headers['X-Bz-Part-Number'] = str(part + 1)
+                    headers['X-Bz-Content-Sha1'] = sha1
+
+                    result, status_code, target = self._post_upload(
+                        get_part_url, body, headers, target)
+                finally:
+                    body.release()
+                if status_code != 200:
+                    print('Upload part ' + str(part + 1) + ' of ' + filename +
+                          ': status code ' + str(status_code),
+                          file=sys.stderr)
+                    print(result, file=sys.stderr)
+                    sys.exit(1)
+                part_sha1s[part] = sha1
+
+        try:
+            with open(filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), size,
+                               access=mmap.ACCESS_READ) as mapped:
+                    with memoryview(mapped) as view:
+                        with ThreadPoolExecutor(max_workers=workers) as \
+                                executor:
+                            futures = [executor.submit(upload_parts, view)
+                                       for i in range(min(workers,
+                                                          part_count))]
+                            for future in futures:
+                                future.result()
+        except BaseException:
+            data = {}
+            data['fileId'] = file_id
+            self._call_api('b2_cancel_large_file', "POST", data=data)
+            raise
+
+        data = {}
+        data['fileId'] = file_id
+        data['partSha1Array'] = part_sha1s
+        return self._call_large_file_api('b2_finish_large_file', data)
 
     def list_file_versions(self, bucket_id, max_file_count,
-                           next_file, next_file_id):
+                           next_file, next_file_id, prefix='', delimiter='',
+                           decoder=None):
         '''
         This method calls list_files_versions.
         :param bucket_id: The bucket's id.
         :param max_file_count: The number of file versions to return
-        :param next_file: The next file name, if continuing
+        :param next_file: The next file name, if continuing. May be given
+        without next_file_id to start listing at (or after) that name.
         :param next_file_id: The next file version, if continuing
+        :param prefix: Only return names starting with this prefix (optional)
+        :param delimiter: Roll names up into "folders" at this character
+        (optional)
+        :param decoder: decodes the page instead of json.loads, e.g.
+        decode_list_page to get ListEntry tuples instead of the full
+        dictionaries (optional)
         :return: result in dictionary form
         '''
 
         list_file_versions_api = "b2_list_file_versions"
-        url = self.apiUrl + self.api_version + list_file_versions_api
         data = {}
 
         data['bucketId'] = bucket_id
         data['maxFileCount'] = max_file_count
 
-        if (next_file != '' and next_file_id != ''):
+        if next_file:
             data['startFileName'] = next_file
-            data['startFileId'] = next_file_id
+            if next_file_id:
+                data['startFileId'] = next_file_id
 
-        headers = {}
-        headers['Authorization'] = self.authToken
+        if prefix:
+            data['prefix'] = prefix
+        if delimiter:
+            data['delimiter'] = delimiter
 
-        result, elapsed_time, status_code = fetchUrl(url, "POST", data=data,
-                                                     headers=headers)
-        return result, status_code
+        if self.cassette is not None:
+            return self.cassette.list_file_versions(
+                data, decoder,
+                lambda page_decoder: self._call_api(
+                    list_file_versions_api, "POST", data=data,
+                    decoder=page_decoder))
 
-    def output_files_with_multiple_versions(self):
+        return self._call_api(list_file_versions_api, "POST", data=data,
+                              decoder=decoder)
+
+    def delete_file_version(self, file_name, file_id):
         '''
-        This function spiders through a bucket looking for all the files in
-        the bucket that contain more than one version. It then outputs that
-        file and the number of versions.
-        :return:
+        Deletes one version of a file with b2_delete_file_version.
+        :param file_name: The file's name
+        :param file_id: The version's id
+        :return: result in dictionary form, HTTP status code
         '''
 
-        files_map = {}
-        total_file_versions = 0
-        next_file_name = ''
+        delete_file_version_api = "b2_delete_file_version"
+        data = {}
+
+        data['fileName'] = file_name
+        data['fileId'] = file_id
+
+        return self._call_api(delete_file_version_api, "POST", data=data)
+
+    def probe_network(self, sample_count=10, deadline=5.0):
+        '''
+        Measures TCP connect time and HTTP time to first byte to the API,
+        download and upload endpoints this connector uses, all at once. See
+        network_probe.py.
+        :param sample_count: samples per endpoint and probe
+        :param deadline: seconds the probing may take
+        :return: list of ProbeStats
+        '''
+
+        target = self.upload_targets.acquire()
+        self.upload_targets.release(target)
+
+        urls = [self.apiUrl, self.downloadUrl, target[0]]
+        return probe_endpoints(urls, self.transport, sample_count, deadline)
+
+    def output_network_probe(self, sample_count=10, deadline=5.0,
+                             slow_threshold=0.5):
+        '''
+        Prints the results of probe_network, flagging the endpoints whose
+        p99 is above slow_threshold seconds or that had failures.
+        '''
+
+        stats = self.probe_network(sample_count, deadline)
+        slow = slow_endpoints(stats, slow_threshold)
+
+        def ms(seconds):
+            return 'n/a' if seconds is None else '%.1f' % (seconds * 1000)
+
+        print('Endpoint latency (ms): ')
+        print('\tprobe, min, avg, p99, samples and failures per endpoint')
+        for s in stats:
+            print('%s, %s, min: %s, avg: %s, p99: %s, samples: %d, '
+                  'failed: %d%s' % (s.url, s.probe, ms(s.min), ms(s.avg),
+                                    ms(s.p99), s.samples, s.failures,
+                                    ' (slow)' if s in slow else ''))
+
+        print('\nSlow endpoints: ', str(len(slow)))
+
+    def get_shard_boundaries(self, shard_count, strategy='prefix', prefix=''):
+        '''
+        Splits the file name keyspace of the bucket (or of the names under
+        prefix) into at most shard_count key ranges that can be listed
+        independently. The "prefix" strategy lists the top-level folders with
+        a delimiter (descending while there is only a single folder, e.g.
+        "Veeam/") and spreads the boundaries over them; a level that is
+        mostly files, or that doesn't fit in one page, is split the "sample"
+        way instead. The "sample" strategy bisects the keyspace and probes
+        each midpoint with a one-entry listing to snap it to a real file
+        name.
+        :param shard_count: The maximum number of ranges to return
+        :param strategy: "prefix" or "sample"
+        :param prefix: Only split the names under this prefix (optional)
+        :return: list of key ranges, in order. A key range is a
+        (start_file_name, end_file_name, prefix, delimiter) tuple; the first
+        range starts at prefix and the last one ends at None.
+        '''
+
+        if strategy == 'prefix':
+            names = self._discover_prefix_boundaries(prefix)
+            if names is None:
+                names = self._sample_boundaries(shard_count, prefix)
+        elif strategy == 'sample':
+            names = self._sample_boundaries(shard_count, prefix)
+        else:
+            raise ValueError('Unknown shard strategy: ' + str(strategy))
+
+        # Boundaries must start at the beginning of the keyspace so nothing
+        # sorting before the first discovered name is missed.
+
+        names = sorted(set(n for n in names if n > prefix))
+        if len(names) >= shard_count:
+            step = len(names) / float(shard_count)
+            names = [names[int(i * step)] for i in range(1, shard_count)]
+
+        starts = [prefix] + names
+        ends = names + [None]
+        return [(start, end, prefix, '') for start, end in zip(starts, ends)]
+
+    def _list_level(self, prefix, delimiter='/'):
+        '''
+        Lists one level of the bucket under prefix.
+        :return: list of (name, is_folder) in listing order, one per file or
+        folder name
+        '''
+
+        entries = []
+        next_file_name = prefix
         next_file_id = ''
         first_run = True
 
-        while ((next_file_name and next_file_id) or first_run):
+        while next_file_name or first_run:
             first_run = False
-            result, status_code = self.list_file_versions(self.bucket_id, 10000,
-                                            next_file_name, next_file_id)
-            if status_code == 200:
-                next_file_name = result['nextFileName']
-                next_file_id = result['nextFileId']
-
-                for item in result['files']:
-                    total_file_versions = total_file_versions + 1
-                    key = item['fileName']
-                    fileinfo = {}
-                    fileinfo['md5'] = item['contentMd5']
-                    fileinfo['sha1'] = item['contentSha1']
-                    fileinfo['uploadtimestamp'] = item['uploadTimestamp']
-                    fileinfo['fileId'] = item['fileId']
-
-                    if key in files_map:
-                        files_map[key][0] = files_map[key][0] + 1
-                    else:
-                        files_map[key] = [1]
-                    files_map[key].append(fileinfo)
+            result, status_code = self.list_file_versions(
+                self.bucket_id, 10000, next_file_name, next_file_id,
+                prefix=prefix, delimiter=delimiter,
+                decoder=decode_list_page)
+            if status_code != 200:
+                print('Non 200 status code issued.')
+                sys.exit()
+
+            next_file_name = result['nextFileName']
+            next_file_id = result['nextFileId']
+
+            for item in result['files']:
+                if not entries or entries[-1][0] != item.fileName:
+                    entries.append((item.fileName, item.action == 'folder'))
+
+        return entries
+
+    def _discover_prefix_boundaries(self, prefix=''):
+        '''
+        Lists the bucket with a '/' delimiter, one page per level, and
+        returns the names of the first level under prefix that actually fans
+        out into more than one entry. Only a level of folders is worth
+        splitting on: a level of files would take a serial listing of its own
+        before the scan could start.
+        :return: list of file and folder names, or None if the level doesn't
+        fit in one page or is mostly files
+        '''
+
+        while True:
+            result, status_code = self.list_file_versions(
+                self.bucket_id, DISCOVERY_PAGE_SIZE, prefix, '',
+                prefix=prefix, delimiter='/', decoder=decode_list_page)
+            if status_code != 200:
+                print('Non 200 status code issued.')
+                sys.exit()
+
+            entries = []
+            for item in result['files']:
+                if not entries or entries[-1][0] != item.fileName:
+                    entries.append((item.fileName, item.action == 'folder'))
+
+            if result['nextFileName']:
+                return None
+            if len(entries) == 1 and entries[0][1]:
+                prefix = entries[0][0]
+                continue
+
+            folder_count = sum(1 for name, is_folder in entries if is_folder)
+            if folder_count * 2 <= len(entries):
+                return None
+            return [name for name, is_folder in entries]
+
+    def _fan_out_ranges(self, prefix, delimiter):
+        '''
+        Splits the names under prefix into one key range per first-level
+        folder, listed with the folder as its prefix, plus one range for each
+        run of files sitting directly at that level.
+        :return: list of key ranges, in order
+        '''
+
+        entries = self._list_level(prefix, delimiter)
+        key_ranges = []
+        for i, (name, is_folder) in enumerate(entries):
+            if is_folder:
+                key_ranges.append((name, None, name, ''))
+            elif i == 0 or entries[i - 1][1]:
+                end = None
+                for next_name, next_is_folder in entries[i + 1:]:
+                    if next_is_folder:
+                        end = next_name
+                        break
+                key_ranges.append((name, end, prefix, delimiter))
+        return key_ranges
+
+    def _plan_key_ranges(self, prefixes=None, delimiter='', workers=1,
+                         shard_strategy='prefix', fan_out=False):
+        '''
+        Works out the key ranges a scan has to list. Prefixes nested in
+        another requested prefix are dropped so no version is counted twice.
+        :param prefixes: Only scan names under these prefixes (optional,
+        default the whole bucket)
+        :param delimiter: Only scan the files directly under each prefix,
+        not the ones in "folders" below it (optional)
+        :param workers: Shard each prefix for this many workers
+        :param shard_strategy: See get_shard_boundaries
+        :param fan_out: Scan each first-level folder under each prefix as its
+        own key range instead of sharding. A delimiter leaves out the
+        folders, so there is nothing to fan out and each prefix stays one
+        range.
+        :return: list of disjoint key ranges, in keyspace order
+        '''
+
+        scoped = []
+        for prefix in sorted(set(prefixes or [''])):
+            if scoped and prefix.startswith(scoped[-1]):
+                continue
+            scoped.append(prefix)
+
+        key_ranges = []
+        for prefix in scoped:
+            if fan_out and not delimiter:
+                key_ranges.extend(self._fan_out_ranges(prefix, '/'))
+            elif workers > 1 and not delimiter:
+                # Use a few more ranges than workers so a thread that drew a
+                # small range picks up another one instead of idling.
+
+                key_ranges.extend(self.get_shard_boundaries(
+                    workers * 4, shard_strategy, prefix))
             else:
+                key_ranges.append((prefix, None, prefix, delimiter))
+        return key_ranges
+
+    def _first_file_name_from(self, file_name, prefix=''):
+        '''
+        Returns the first file name in the bucket (under prefix) that sorts
+        at or after file_name, or None if there isn't one.
+        '''
+
+        result, status_code = self.list_file_versions(self.bucket_id, 1,
+                                                      file_name, '',
+                                                      prefix=prefix)
+        if status_code != 200:
+            print('Non 200 status code issued.')
+            sys.exit()
+
+        if result['files']:
+            return result['files'][0]['fileName']
+        return None
+
+    def _sample_boundaries(self, shard_count, prefix=''):
+        '''
+        Bisects the keyspace under prefix breadth first until
+        shard_count - 1 real file names have been found to split on. The
+        midpoints of a round are probed in parallel, so planning takes a few
+        round trips rather than one per boundary. The number of probes is
+        capped so sparse keyspaces don't turn into a long walk.
+        :return: list of file names
+        '''
+
+        names = []
+        gaps = [(prefix, _prefix_end(prefix))]
+        probes_left = shard_count * 8
+
+        with ThreadPoolExecutor(max_workers=min(shard_count, 16)) as executor:
+            while gaps and len(names) < shard_count - 1 and probes_left > 0:
+                probes = []
+                waiting = []
+                for low, high in gaps:
+                    if len(probes) >= min(probes_left,
+                                          shard_count - 1 - len(names)):
+                        waiting.append((low, high))
+                        continue
+                    middle = _name_between(low, high)
+                    if middle is not None:
+                        probes.append((low, middle, high))
+
+                probes_left = probes_left - len(probes)
+                found_names = executor.map(
+                    lambda probe: self._first_file_name_from(probe[1],
+                                                             prefix),
+                    probes)
+
+                gaps = waiting
+                for (low, middle, high), found in zip(probes, found_names):
+                    if found is None or (high is not None and found >= high):
+                        # Nothing between the midpoint and high, keep looking
+                        # in the lower half.
+                        gaps.append((low, middle))
+                    else:
+                        names.append(found)
+                        gaps.append((low, found))
+                        gaps.append((found, high))
+
+        return names
+
+    def _iter_pages(self, start_file_name='', end_file_name=None, prefix='',
+                    delimiter='', next_file_id=''):
+        '''
+        Pages through the key range [start_file_name, end_file_name) under
+        prefix. "folder" entries a delimiter listing rolls up are dropped.
+        Every page carries the cursor of the next one, so the next pages are
+        fetched on a background thread (up to prefetchPages ahead) while the
+        caller works through the current one. Pages still come in order, and
+        a listing error is raised in the caller once it reaches that page.
+        See _fetch_pages for the parameters.
+        :return: generator of (page entries, nextFileName, nextFileId). The
+        cursor is None once the range is exhausted.
+        '''
+
+        return prefetch(self._fetch_pages(start_file_name, end_file_name,
+                                          prefix, delimiter, next_file_id),
+                        self.prefetch_pages)
+
+    def _fetch_pages(self, start_file_name='', end_file_name=None, prefix='',
+                     delimiter='', next_file_id=''):
+        '''
+        Lists the pages _iter_pages hands out, one request at a time.
+        :param start_file_name: First file name of the range
+        :param end_file_name: First file name past the range (None for the
+        end of the bucket or prefix)
+        :param prefix: Only list names under this prefix
+        :param delimiter: Only list the files directly under prefix
+        :param next_file_id: File id to continue from within
+        start_file_name, when resuming from a cursor
+        :return: generator of (page entries, nextFileName, nextFileId). The
+        cursor is None once the range is exhausted.
+        '''
+
+        next_file_name = start_file_name
+        first_run = True
+
+        # With a delimiter, B2 may return a nextFileName without a
+        # nextFileId, which still continues the listing.
+
+        while next_file_name or first_run:
+            first_run = False
+            result, status_code = self.list_file_versions(
+                self.bucket_id, 10000, next_file_name, next_file_id,
+                prefix=prefix, delimiter=delimiter,
+                decoder=decode_list_page)
+            if status_code != 200:
                 print('Non 200 status code issued.')
                 sys.exit()
 
+            next_file_name = result['nextFileName']
+            next_file_id = result['nextFileId']
+
+            items = []
+            for item in result['files']:
+                if end_file_name is not None and \
+                        item.fileName >= end_file_name:
+                    next_file_name = None
+                    next_file_id = None
+                    break
+                if item.action != 'folder':
+                    items.append(item)
+
+            self.metrics.count('pages')
+            self.metrics.count('versions', len(items))
+
+            yield items, next_file_name, next_file_id
+
+    def _iter_file_versions(self, start_file_name='', end_file_name=None,
+                            prefix='', delimiter=''):
+        '''
+        Yields the raw entries of every file version in a key range, in
+        listing order. See _iter_pages for the parameters.
+        :return: generator of ListEntry
+        '''
+
+        for items, next_file_name, next_file_id in self._iter_pages(
+                start_file_name, end_file_name, prefix, delimiter):
+            for item in items:
+                yield item
+
+    def _iter_file_groups(self, start_file_name='', end_file_name=None,
+                          prefix='', delimiter=''):
+        '''
+        Groups the versions in a key range by file name.
+        b2_list_file_versions returns versions sorted by file name, so a group
+        is complete as soon as the name changes and only one group is held in
+        memory at a time, even when it straddles a page boundary.
+        :return: generator of (file name, list of fileinfo dictionaries)
+        '''
+
+        key = None
+        versions = []
+        for item in self._iter_file_versions(start_file_name, end_file_name,
+                                             prefix, delimiter):
+            if item.fileName != key:
+                if versions:
+                    yield key, versions
+                key = item.fileName
+                versions = []
+
+            versions.append(make_fileinfo(item))
+
+        if versions:
+            yield key, versions
+
+    def _scan_range(self, start_file_name='', end_file_name=None, prefix='',
+                    delimiter=''):
+        '''
+        Keeps every file version in a key range. See _iter_pages for the
+        parameters.
+        :return: VersionStore
+        '''
+
+        store = VersionStore()
+        for items, next_file_name, next_file_id in self._iter_pages(
+                start_file_name, end_file_name, prefix, delimiter):
+            store.add_entries(items)
+        return store
+
+    def _scan_range_streaming(self, start_file_name='', end_file_name=None,
+                              prefix='', delimiter=''):
+        '''
+        Like _scan_range, but only keeps the groups with more than one
+        version, which are the only ones the report prints.
+        :return: list of (file name, versions), total_files,
+        total_file_versions
+        '''
+
+        multi_version_groups = []
+        total_files = 0
+        total_file_versions = 0
+
+        for key, versions in self._iter_file_groups(
+                start_file_name, end_file_name, prefix, delimiter):
+            total_file_versions = total_file_versions + len(versions)
+            if len(versions) > 1:
+                multi_version_groups.append((key, versions))
+            else:
+                total_files = total_files + 1
+
+        return multi_version_groups, total_files, total_file_versions
+
+    def _map_key_ranges(self, scan, key_ranges, workers):
+        '''
+        Runs scan over every key range, on a thread pool when workers > 1.
+        :return: generator of scan results, in key range order
+        '''
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for result in executor.map(lambda r: scan(*r), key_ranges):
+                    yield result
+        else:
+            for key_range in key_ranges:
+                yield scan(*key_range)
+
+    def print_report(self, multi_version_groups, total_files,
+                     total_file_versions, writer=None, bucket_name=None):
+        '''
+        Prints a complete version report from already aggregated results.
+        :param multi_version_groups: list of (file name, versions) for the
+        files with more than one version, in file name order
+        :param total_files: number of files with a single version
+        :param total_file_versions: number of versions seen
+        :param writer: ReportWriter (optional, default text to stdout)
+        :param bucket_name: name the report with this bucket (optional)
+        '''
+
+        writer = writer or TextReportWriter(sys.stdout)
+        writer.write_header(bucket_name)
+        for key, versions in multi_version_groups:
+            writer.write_group(key, versions)
+        writer.write_totals(len(multi_version_groups), total_files,
+                            total_file_versions)
+
+    def scan_versions(self, key_ranges=None, workers=1):
+        '''
+        Lists every file version of the bucket, or of key_ranges, into a
+        VersionStore.
+        :param key_ranges: key ranges from _plan_key_ranges (optional,
+        default the whole bucket)
+        :param workers: Number of threads listing key ranges in parallel
+        :return: VersionStore
+        '''
+
+        if key_ranges is None:
+            key_ranges = self._plan_key_ranges(workers=workers)
+
+        # The key ranges are disjoint and come back in keyspace order, so
+        # chaining them gives the same store a serial scan builds.
+
+        store = VersionStore()
+        for partial_store in self._map_key_ranges(self._scan_range,
+                                                  key_ranges, workers):
+            if len(store):
+                store.extend(partial_store)
+            else:
+                store = partial_store
+        return store
+
+    def output_files_with_multiple_versions(self, workers=1,
+                                            shard_strategy='prefix',
+                                            stream=False,
+                                            checkpoint_file=None,
+                                            checkpoint_interval=30,
+                                            resume=False,
+                                            prefixes=None,
+                                            delimiter='',
+                                            fan_out=False,
+                                            writer=None):
+        '''
+        This function spiders through a bucket looking for all the files in
+        the bucket that contain more than one version. It then outputs that
+        file and the number of versions.
+        :param workers: Number of threads listing key ranges in parallel. 1
+        keeps the original serial scan.
+        :param shard_strategy: How to split the keyspace when workers > 1,
+        "prefix" or "sample". See get_shard_boundaries.
+        :param stream: Report each file as soon as all of its versions have
+        been listed instead of keeping every version of the bucket first.
+        :param checkpoint_file: Periodically save the scan's cursor and
+        partial results here so an interrupted serial scan can be resumed
+        (optional). The file is removed once the report is complete.
+        :param checkpoint_interval: Seconds between checkpoints
+        :param resume: Continue from checkpoint_file instead of starting over
+        :param prefixes: Only scan the names under these prefixes (optional)
+        :param delimiter: Only scan the files directly under each prefix
+        (optional)
+        :param fan_out: List each first-level folder under each prefix as its
+        own key range, in parallel when workers > 1
+        :param writer: ReportWriter the report goes to (optional, default the
+        text report on stdout)
+        :return:
+        '''
+
+        writer = writer or TextReportWriter(sys.stdout)
+
+        # Resuming can't add a page a recording doesn't have, so a replay
+        # is never checkpointed.
+
+        replaying = self.cassette is not None and self.cassette.replaying
+        if checkpoint_file and workers == 1 and not replaying:
+            self._output_checkpointed(stream, checkpoint_file,
+                                      checkpoint_interval, resume, prefixes,
+                                      delimiter, fan_out, writer)
+            return
+
+        key_ranges = self._plan_key_ranges(prefixes, delimiter, workers,
+                                           shard_strategy, fan_out)
+
+        if stream:
+            self._output_streaming(key_ranges, workers, writer)
+            return
+
+        store = self.scan_versions(key_ranges, workers)
+
         # Output all the files with > 1 versions.
-        print('Files where more than one version exists: ')
-        print('\tmd5, uploadtimestamp, fileId for each object')
+        writer.write_header()
         files_with_versions_count = 0
-        total_files = 0
-        for key, value in files_map.items():
-            if(value[0] > 1):
-                files_with_versions_count = files_with_versions_count + 1
-                value.pop(0)
-                print('filename: ' + key)
+        for key, versions in store.iter_multi_version_groups():
+            files_with_versions_count = files_with_versions_count + 1
+            writer.write_group(key, versions)
 
-                # If there are two file versions, spit out the delta in
-                # upload timestamps, in seconds to make it easy to compare.
+        total_files = store.single_version_count()
+        total_file_versions = len(store)
 
-                if (len(value) == 2):
-                    diff_ms = value[0]['uploadtimestamp'] - value[1]['uploadtimestamp']
+        writer.write_totals(files_with_versions_count, total_files,
+                            total_file_versions)
 
-                    if (value[0]['md5'] == value[1]['md5']):
-                        md5match = 'md5 match'
-                    else:
-                        md5match = 'md5 does not match'
+    def _output_checkpointed(self, stream, checkpoint_file,
+                             checkpoint_interval, resume, prefixes=None,
+                             delimiter='', fan_out=False, writer=None):
+        '''
+        Serial scan that saves its cursor and partial results to
+        checkpoint_file every checkpoint_interval seconds, and when it has to
+        stop on an error. Files are grouped the same way _iter_file_groups
+        does; at a page boundary every group but the last one is final, so the
+        checkpoint only needs the key ranges being scanned, the totals and the
+        last, still open, group. Without stream, the multi-version groups
+        found since the previous checkpoint are appended to checkpoint_file
+        + '.groups', so a checkpoint costs what the scan added since the last
+        one. A resumed scan uses the checkpoint's key ranges.
+        '''
 
-                    print('Two versions, %s, uploaded %s seconds apart' %
-                    (md5match, int(diff_ms)/1000))
+        writer = writer or TextReportWriter(sys.stdout)
+        groups_file = checkpoint_file + '.groups'
+
+        state = None
+        if resume:
+            state = load_checkpoint(checkpoint_file)
+            if state is None:
+                print('No checkpoint found in ' + checkpoint_file +
+                      ', starting from the beginning.', file=sys.stderr)
+            elif state['bucketId'] != self.bucket_id or \
+                    state['stream'] != stream:
+                print('Checkpoint ' + checkpoint_file + ' is for a different '
+                      'bucket or output mode. Exiting.', file=sys.stderr)
+                sys.exit(1)
 
-                for item in value:
-                    print('\tmd5: %s, fileId: %s, upload timestamp: %s'
-                          % (str(item['md5']),
-                             str(item['fileId']),
-                             str(item['uploadtimestamp'])))
+        if state is None:
+            state = {}
+            state['bucketId'] = self.bucket_id
+            state['stream'] = stream
+            state['keyRanges'] = self._plan_key_ranges(prefixes, delimiter,
+                                                       1, fan_out=fan_out)
+            state['rangeIndex'] = 0
+            state['rangeStarted'] = False
+            state['headerPrinted'] = False
+            state['nextFileName'] = ''
+            state['nextFileId'] = ''
+            state['key'] = None
+            state['versions'] = []
+            state['groupsFileSize'] = 0
+            state['filesWithVersionsCount'] = 0
+            state['totalFiles'] = 0
+            state['totalFileVersions'] = 0
+
+        # In stream mode the part of the report printed before the
+        # interruption is already out, so a resumed run only continues it.
+
+        if stream and not state['headerPrinted']:
+            writer.write_header()
+            state['headerPrinted'] = True
+
+        # Groups past groupsFileSize were appended after the last checkpoint
+        # was written, and are found again by the resumed scan.
+
+        groups = []
+        if state['groupsFileSize']:
+            with open(groups_file, 'rb') as f:
+                for line in f.read(state['groupsFileSize']).splitlines():
+                    key, versions = json.loads(line.decode('utf-8'))
+                    groups.append((key, versions))
+        saved_groups = [len(groups)]
+
+        def close_group(key, versions):
+            if len(versions) > 1:
+                state['filesWithVersionsCount'] = \
+                    state['filesWithVersionsCount'] + 1
+                if stream:
+                    writer.write_group(key, versions)
+                else:
+                    groups.append((key, versions))
             else:
-                total_files = total_files + 1
+                state['totalFiles'] = state['totalFiles'] + 1
+
+        def checkpoint():
+            writer.flush()
+            if not stream:
+                with open(groups_file, 'ab') as f:
+                    f.truncate(state['groupsFileSize'])
+                    for key, versions in groups[saved_groups[0]:]:
+                        f.write(json.dumps([key, versions],
+                                           separators=(',', ':'))
+                                .encode('utf-8') + b'\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                    state['groupsFileSize'] = f.tell()
+                saved_groups[0] = len(groups)
+            save_checkpoint(checkpoint_file, state)
+
+        last_checkpoint = time.time()
+
+        # _iter_pages exits on a non 200 status before handing out the
+        # failed page, so the state is always at a page boundary here.
+
+        try:
+            while state['rangeIndex'] < len(state['keyRanges']):
+                start_file_name, end_file_name, prefix, range_delimiter = \
+                    state['keyRanges'][state['rangeIndex']]
+                next_file_id = ''
+                if state['rangeStarted']:
+                    start_file_name = state['nextFileName']
+                    next_file_id = state['nextFileId']
+
+                # A range whose cursor is None was finished before the
+                # checkpoint was written.
+
+                if start_file_name is not None:
+                    for items, next_file_name, next_file_id in \
+                            self._iter_pages(start_file_name, end_file_name,
+                                             prefix, range_delimiter,
+                                             next_file_id):
+                        for item in items:
+                            state['totalFileVersions'] = \
+                                state['totalFileVersions'] + 1
+                            if item.fileName != state['key']:
+                                if state['versions']:
+                                    close_group(state['key'],
+                                                state['versions'])
+                                state['key'] = item.fileName
+                                state['versions'] = []
+                            state['versions'].append(make_fileinfo(item))
+
+                        state['rangeStarted'] = True
+                        state['nextFileName'] = next_file_name
+                        state['nextFileId'] = next_file_id
+
+                        if time.time() - last_checkpoint >= \
+                                checkpoint_interval:
+                            checkpoint()
+                            last_checkpoint = time.time()
+
+                state['rangeIndex'] = state['rangeIndex'] + 1
+                state['rangeStarted'] = False
+        except SystemExit:
+            checkpoint()
+            print('Run again with --resume to continue from the last page.')
+            raise
+
+        if state['versions']:
+            close_group(state['key'], state['versions'])
+
+        if stream:
+            writer.write_totals(state['filesWithVersionsCount'],
+                                state['totalFiles'],
+                                state['totalFileVersions'])
+        else:
+            self.print_report(groups, state['totalFiles'],
+                              state['totalFileVersions'], writer)
+
+        for path in (checkpoint_file, groups_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _output_streaming(self, key_ranges, workers, writer):
+        '''
+        Streaming version of output_files_with_multiple_versions. A serial
+        scan holds at most one file's versions in memory. A sharded scan
+        prints each range's multi-version files in keyspace order as the
+        ranges complete, so it only holds those.
+        '''
+
+        writer.write_header()
+        files_with_versions_count = 0
+        total_files = 0
+        total_file_versions = 0
+
+        if workers > 1:
+            for groups, range_files, range_versions in self._map_key_ranges(
+                    self._scan_range_streaming, key_ranges, workers):
+                for key, versions in groups:
+                    files_with_versions_count = files_with_versions_count + 1
+                    writer.write_group(key, versions)
+                total_files = total_files + range_files
+                total_file_versions = total_file_versions + range_versions
+        else:
+            for key_range in key_ranges:
+                for key, versions in self._iter_file_groups(*key_range):
+                    total_file_versions = total_file_versions + len(versions)
+                    if len(versions) > 1:
+                        files_with_versions_count = \
+                            files_with_versions_count + 1
+                        writer.write_group(key, versions)
+                    else:
+                        total_files = total_files + 1
+
+        writer.write_totals(files_with_versions_count, total_files,
+                            total_file_versions)
+
+    def update_version_index(self, index, prefixes=None, delimiter='',
+                             workers=1, shard_strategy='prefix',
+                             fan_out=False):
+        '''
+        Lists the bucket (or the names under prefixes) and brings a
+        VersionIndex up to date with it. The key ranges are saved in the
+        index, so the next scan of the same prefixes lists the same ranges
+        and key ranges that haven't changed are skipped.
+        :param index: VersionIndex
+        :return: scan id, number of key ranges, number of them that changed
+        '''
 
-        print('\nFound files with > 1 version count: ', str(files_with_versions_count))
+        scan_id = index.begin_scan(self.bucket_id, self.bucket_name)
+
+        key_ranges = index.saved_key_ranges(self.bucket_id, prefixes,
+                                            delimiter)
+        if key_ranges is None:
+            # Plan at least 16 ranges even for a serial scan, so a change
+            # only makes a small part of the bucket be compared again. Only
+            # the first scan of a scope plans; the later ones reuse its
+            # ranges, and planning itself never lists more than a page per
+            # folder level (see get_shard_boundaries).
+
+            key_ranges = self._plan_key_ranges(prefixes, delimiter,
+                                               max(workers, 4),
+                                               shard_strategy, fan_out)
+            index.save_key_ranges(self.bucket_id, prefixes, delimiter,
+                                  key_ranges)
+
+        changed = 0
+        stores = self._map_key_ranges(self._scan_range, key_ranges, workers)
+        for key_range, store in zip(key_ranges, stores):
+            if index.update_range(scan_id, self.bucket_id, key_range, store):
+                changed = changed + 1
+
+        index.finish_scan(scan_id)
+        return scan_id, len(key_ranges), changed
+
+    def output_version_index_changes(self, index, prefixes=None, delimiter='',
+                                     workers=1, shard_strategy='prefix',
+                                     fan_out=False):
+        '''
+        Updates a VersionIndex (see update_version_index) and prints what
+        changed since the previous scan: new versions, removed versions and
+        files that now have more than one version, then the totals of the
+        index.
+        '''
+
+        scan_id, range_count, changed = self.update_version_index(
+            index, prefixes, delimiter, workers, shard_strategy, fan_out)
+
+        print('Key ranges changed since the last scan: %d of %d' %
+              (changed, range_count))
+
+        if index.previous_scan(self.bucket_id, scan_id) is None:
+            print('First scan of this bucket, every version is new.')
+        else:
+            new_versions = index.new_versions(scan_id)
+            print('\nNew versions: ', str(len(new_versions)))
+            for file_name, file_id, upload_timestamp in new_versions:
+                print('\tfilename: %s, fileId: %s, upload timestamp: %s' %
+                      (file_name, file_id, upload_timestamp))
+
+            removed_versions = index.removed_versions(scan_id)
+            print('\nRemoved versions: ', str(len(removed_versions)))
+            for file_name, file_id, upload_timestamp in removed_versions:
+                print('\tfilename: %s, fileId: %s, upload timestamp: %s' %
+                      (file_name, file_id, upload_timestamp))
+
+            multi_versioned = index.newly_multi_versioned(scan_id)
+            print('\nFiles now with more than one version: ',
+                  str(len(multi_versioned)))
+            for file_name, version_count in multi_versioned:
+                print('\tfilename: %s, versions: %d' %
+                      (file_name, version_count))
+
+        files_with_versions_count, total_files, total_file_versions = \
+            index.totals(self.bucket_id, prefixes, delimiter)
+        print('\nFound files with > 1 version count: ',
+              str(files_with_versions_count))
         print('Total files in bucket: ', str(total_files))
-        print('Total file versions in bucket: ', str(total_file_versions))
\ No newline at end of file
+        print('Total file versions in bucket: ', str(total_file_versions))
+
+    def _spill_range(self, start_file_name='', end_file_name=None, prefix='',
+                     delimiter=''):
+        '''
+        Lists a key range into a temporary spill file for find_duplicates.
+        See _iter_pages for the parameters.
+        :return: spill file, number of versions in it
+        '''
+
+        spill = tempfile.TemporaryFile(buffering=1 << 20)
+        count = 0
+        for items, next_file_name, next_file_id in self._iter_pages(
+                start_file_name, end_file_name, prefix, delimiter):
+            count = count + write_spill(spill, items)
+        return spill, count
+
+    def output_duplicate_content(self, prefixes=None, delimiter='',
+                                 workers=1, shard_strategy='prefix',
+                                 fan_out=False):
+        '''
+        Prints the content stored more than once in the bucket, under any
+        file names, grouped by sha1 (md5 for large files) with the bytes the
+        extra copies take. The bucket is listed once into temporary files;
+        see duplicates.py for how memory is kept bounded.
+        '''
+
+        key_ranges = self._plan_key_ranges(prefixes, delimiter, workers,
+                                           shard_strategy, fan_out)
+
+        spills = []
+        version_count = 0
+        for spill, count in self._map_key_ranges(self._spill_range,
+                                                 key_ranges, workers):
+            spills.append(spill)
+            version_count = version_count + count
+
+        try:
+            duplicates = find_duplicates(spills, version_count)
+        finally:
+            for spill in spills:
+                spill.close()
+
+        print('Content stored more than once: ')
+        print('\tcontent hash, size, copies and bytes wasted, then each copy')
+
+        extra_copies = 0
+        bytes_wasted = 0
+        for key, length, copies in duplicates:
+            wasted = length * (len(copies) - 1)
+            extra_copies = extra_copies + len(copies) - 1
+            bytes_wasted = bytes_wasted + wasted
+            print('%s, size: %d, copies: %d, bytes wasted: %d' %
+                  (describe_key(key), length, len(copies), wasted))
+            for file_name, file_id, upload_timestamp in copies:
+                print('\tfilename: %s, fileId: %s, upload timestamp: %s' %
+                      (file_name, file_id, upload_timestamp))
+
+        print('\nDuplicated content count: ', str(len(duplicates)))
+        print('Extra copies: ', str(extra_copies))
+        print('Total bytes wasted: ', str(bytes_wasted))
+
+    def output_version_stats(self, prefixes=None, delimiter='', workers=1,
+                             shard_strategy='prefix', fan_out=False):
+        '''
+        Prints statistics about the versions in the bucket (or prefixes):
+        how many versions file names have, the time between consecutive
+        versions, the bytes held by older versions and hide markers, in
+        total and for each folder under the prefix. The bucket is listed
+        into a VersionStore first; see version_stats.py.
+        '''
+
+        key_ranges = self._plan_key_ranges(prefixes, delimiter, workers,
+                                           shard_strategy, fan_out)
+        store = self.scan_versions(key_ranges, workers)
+
+        # Folders are rolled up under what every prefix starts with.
+
+        common_prefix = os.path.commonprefix(prefixes or [''])
+        started = time.time()
+        stats = version_stats(store, len(common_prefix.encode('utf-8')))
+        print('Statistics computed in %.3f seconds' %
+              (time.time() - started), file=sys.stderr)
+
+        print('Version statistics: ')
+        print('Total file names: ', str(stats['files']))
+        print('Total file versions: ', str(stats['versions']))
+        print('Total bytes: ', str(stats['bytes']))
+        print('Bytes in older versions: ', str(stats['old_version_bytes']))
+        print('Hide markers: ', str(stats['hide_markers']))
+        print('File names hidden: ', str(stats['hidden_files']))
+
+        print('\nFile names by number of versions: ')
+        for low, high, names in stats['version_counts']:
+            label = str(low) if low == high else '%d - %d' % (low, high)
+            print('\t%s: %d' % (label, names))
+
+        print('\nTime between consecutive versions of a file name: ')
+        for (label, bound), count in zip(GAP_BUCKETS, stats['gap_counts']):
+            print('\t%s: %d' % (label, count))
+        for p, gap in zip(GAP_PERCENTILES, stats['gap_percentiles']):
+            label = 'max' if p == 100 else '%dth percentile' % p
+            print('\t%s: %.1f hours' % (label, gap / 3600000.0))
+
+        print('\nBy folder, most bytes in older versions first: ')
+        print('\tfolder, file names, versions, bytes, bytes in older '
+              'versions, hide markers')
+        for row in stats['prefixes']:
+            print('%s, %d, %d, %d, %d, %d' % (row.prefix or '(no folder)',
+                                              row.files, row.versions,
+                                              row.bytes,
+                                              row.old_version_bytes,
+                                              row.hide_markers))
+
+    def _list_window(self, start_file_name, prefix, window,
+                     start_file_id=''):
+        '''
+        Lists one page of up to window versions from start_file_name under
+        prefix.
+        :return: list of ListEntry, nextFileName, nextFileId. The cursor is
+        None once the listing is exhausted.
+        '''
+
+        result, status_code = self.list_file_versions(
+            self.bucket_id, window, start_file_name, start_file_id,
+            prefix=prefix, decoder=decode_list_page)
+        if status_code != 200:
+            print('Non 200 status code issued.')
+            sys.exit()
+
+        items = [item for item in result['files'] if item.action != 'folder']
+        return items, result['nextFileName'], result['nextFileId']
+
+    def _listing_calls(self):
+        endpoints = self.metrics.snapshot()['endpoints']
+        return endpoints.get('b2_list_file_versions', {}).get('requests', 0)
+
+    def _find_strata(self, stratum_count, prefix='', workers=1):
+        '''
+        Splits the names under prefix into ranges for an estimate by
+        bisecting the keyspace, like _sample_boundaries, but also keeps track
+        of the stretches a probe found empty so they aren't sampled.
+        :return: list of Stratum, in keyspace order. Each one starts at a real
+        file name.
+        '''
+
+        first = self._first_file_name_from(prefix, prefix)
+        if first is None:
+            return []
+
+        done = []
+        gaps = [(first, _prefix_end(prefix))]
+        probes_left = stratum_count * 2
+
+        # Each round probes the midpoints of the oldest gaps in parallel;
+        # a hit splits a gap in two, a miss halves it.
+
+        while gaps and len(done) + len(gaps) < stratum_count and \
+                probes_left > 0:
+            wanted = min(probes_left, stratum_count - len(done) - len(gaps))
+            batch = []
+            while gaps and len(batch) < wanted:
+                low, high = gaps.pop(0)
+                middle = _name_between(low, high)
+                if middle is None:
+                    done.append((low, high))
+                else:
+                    batch.append((low, high, middle))
+            if not batch:
+                break
+
+            probes_left = probes_left - len(batch)
+            found_names = self._map_key_ranges(
+                self._first_file_name_from,
+                [(middle, prefix) for low, high, middle in batch], workers)
+            for (low, high, middle), found in zip(batch, found_names):
+                gaps.append((low, middle))
+                if found is not None and (high is None or found < high):
+                    gaps.append((found, high))
+
+        return [Stratum(low, high) for low, high in sorted(done + gaps)]
+
+    def estimate_versions(self, samples=64, window=1000, prefixes=None,
+                          workers=8, confidence=0.95, seed=None):
+        '''
+        Estimates what output_files_with_multiple_versions would count,
+        without listing the whole bucket. The keyspace is split into up to
+        samples / 4 strata by bisection; the first page of each one is
+        listed exactly and the rest estimated from windows at random points,
+        samples in all, after up to samples probes for the characters names
+        use. See estimate.py.
+        :param samples: Number of random windows
+        :param window: Versions listed per window. B2 bills a listing per
+        1000 versions returned, so 1000 costs one transaction.
+        :param prefixes: Only estimate the names under these prefixes
+        (optional)
+        :param workers: Number of listings in flight
+        :param confidence: Coverage of the confidence intervals
+        :param seed: Seed for the random points, to repeat an estimate
+        (optional)
+        :return: dictionary of Estimate (see combine_strata), number of
+        listing calls made
+        '''
+
+        rnd = random.Random(seed)
+        stratum_count = max(samples // 4, 1)
+        calls_before = self._listing_calls()
+
+        # A prefix that fits in one page is simply counted.
+
+        strata = []
+        for start, end, prefix, delimiter in self._plan_key_ranges(prefixes):
+            items, next_file_name, next_file_id = self._list_window(
+                prefix, prefix, window)
+            if next_file_name is None:
+                if items:
+                    stratum = Stratum(items[0].fileName, None)
+                    stratum.add_head(items, True)
+                    strata.append((stratum, prefix))
+                continue
+            for stratum in self._find_strata(stratum_count, prefix, workers):
+                strata.append((stratum, prefix))
+
+        def list_head(stratum, prefix):
+            if stratum.counted:
+                return []
+            items, next_file_name, next_file_id = self._list_window(
+                stratum.low, prefix, window)
+            stratum.add_head(items, next_file_name is None)
+            return [item.fileName for item in items]
+
+        names = set(stratum.low for stratum, prefix in strata)
+        for head_names in self._map_key_ranges(list_head, strata, workers):
+            names.update(head_names)
+
+        # Rounds of successor probes, while they find new names, up to
+        # samples probes.
+
+        probes_left = samples
+        tried = set()
+        probes = []
+        if any(stratum.end is not None for stratum, prefix in strata):
+            probes = successor_probes(names, tried)
+        while probes and probes_left > 0:
+            probes = probes[:probes_left]
+            probes_left = probes_left - len(probes)
+            found = set(self._map_key_ranges(self._first_file_name_from,
+                                             [(p,) for p in probes], workers))
+            found.discard(None)
+            found.difference_update(names)
+            if not found:
+                break
+            names.update(found)
+            probes = successor_probes(names, tried)
+        alphabets = Alphabets(names)
+
+        sampled = [(stratum, prefix) for stratum, prefix in strata
+                   if stratum.place(alphabets)]
+        windows = []
+        for stratum, prefix in sampled:
+            for i in range(max(samples // len(sampled), 2)):
+                windows.append((stratum, prefix) + stratum.window(rnd))
+
+        # A window in a denser stretch than the first page of its stratum
+        # takes more than one page to list.
+
+        def list_sample(stratum, prefix, name, low, high):
+            items = []
+            next_file_name = name
+            next_file_id = ''
+            for page in range(4):
+                page_items, next_file_name, next_file_id = \
+                    self._list_window(next_file_name, prefix, window,
+                                      next_file_id)
+                items.extend(page_items)
+                if next_file_name is None or not items or \
+                        stratum.past(items[-1].fileName, high):
+                    break
+            stratum.add_window(low, high, items, next_file_name is None)
+
+        for result in self._map_key_ranges(list_sample, windows, workers):
+            pass
+
+        calls = self._listing_calls() - calls_before
+        return combine_strata([s for s, p in strata], confidence), calls
+
+    def output_estimate(self, samples=64, window=1000, prefixes=None,
+                        workers=8, confidence=0.95):
+        '''
+        Prints the totals estimate_versions estimates, each with its
+        confidence interval, and what a full scan would cost.
+        '''
+
+        started = time.time()
+        estimates, calls = self.estimate_versions(samples, window, prefixes,
+                                                  workers, confidence)
+        seconds = time.time() - started
+
+        print('Estimated totals (%d list calls, %.1f seconds): ' %
+              (calls, seconds))
+        print('\testimate, then the %g%% confidence interval' %
+              (confidence * 100))
+
+        lines = [('Files with > 1 version', 'multi_version_files'),
+                 ('Total file names', 'files'),
+                 ('Total file versions', 'versions'),
+                 ('Total bytes', 'bytes'),
+                 ('Bytes in older versions', 'old_version_bytes')]
+        for label, field in lines:
+            e = estimates[field]
+            print('%s: %d (%d - %d)' % (label, round(e.value), round(e.low),
+                                         round(e.high)))
+        e = estimates['multi_version_ratio']
+        print('Share of files with > 1 version: %.4f (%.4f - %.4f)' %
+              (e.value, e.low, e.high))
+
+        # B2 bills a listing per 1000 versions returned, so a full scan
+        # costs about one transaction per 1000 versions.
+
+        print('\nTransactions a full scan would take: about %d' %
+              math.ceil(estimates['versions'].value / 1000))
+
+    def _select_range(self, select, keep, start_file_name='',
+                      end_file_name=None, prefix='', delimiter=''):
+        '''
+        Picks the versions a prune policy deletes in a key range. See
+        _iter_pages for the key range parameters.
+        :param select: policy function from PRUNE_POLICIES
+        :param keep: number of newest versions of each file to keep
+        :return: list of (file name, file id, content length) to delete
+        '''
+
+        plan = []
+        key = None
+        versions = []
+        for item in self._iter_file_versions(start_file_name, end_file_name,
+                                             prefix, delimiter):
+            if item.fileName != key:
+                if len(versions) > keep:
+                    for version in select(versions, keep):
+                        plan.append((version.fileName, version.fileId,
+                                     version.contentLength))
+                key = item.fileName
+                versions = []
+            versions.append(item)
+
+        if len(versions) > keep:
+            for version in select(versions, keep):
+                plan.append((version.fileName, version.fileId,
+                             version.contentLength))
+        return plan
+
+    def prune_versions(self, policy='identical', keep=1, prefixes=None,
+                       delimiter='', workers=1, shard_strategy='prefix',
+                       fan_out=False, dry_run=False, journal_file=None,
+                       resume=False, delete_workers=16, delete_rate=None):
+        '''
+        Deletes old versions picked by a policy. The bucket (or the names
+        under prefixes) is listed first and the versions to delete are
+        written to journal_file; then delete_workers threads delete them,
+        recording each finished deletion in the journal. A resumed prune
+        deletes what is left of the journal's plan without listing again.
+        :param policy: "identical" deletes older versions with the same
+        content as the newest, "keep-newest" deletes all but the newest keep
+        versions. See prune.py.
+        :param keep: Number of newest versions of every file never deleted
+        :param prefixes: Only prune the names under these prefixes (optional)
+        :param delimiter: Only prune the files directly under each prefix
+        (optional)
+        :param workers: Number of threads listing key ranges in parallel
+        :param shard_strategy: See get_shard_boundaries
+        :param fan_out: See _plan_key_ranges
+        :param dry_run: Only print the versions that would be deleted
+        :param journal_file: Where the plan and finished deletions are
+        recorded (optional for a dry run)
+        :param resume: Continue the prune recorded in journal_file
+        :param delete_workers: Number of deletions in flight. _call_api
+        still holds each one to the limiter's poolSize slots.
+        :param delete_rate: Most deletions started per second (optional)
+        :return: None
+        '''
+
+        if keep < 1:
+            print('A prune has to keep at least the newest version.',
+                  file=sys.stderr)
+            sys.exit(1)
+
+        scope = {}
+        scope['bucketId'] = self.bucket_id
+        scope['policy'] = policy
+        scope['keep'] = keep
+        scope['prefixes'] = sorted(prefixes or [''])
+        scope['delimiter'] = delimiter
+
+        journal = PruneJournal(journal_file) if journal_file else None
+        loaded = None
+        if resume and journal is not None:
+            loaded = journal.load()
+            if loaded is None:
+                print('No complete prune plan in ' + journal_file +
+                      ', listing the bucket again.', file=sys.stderr)
+            elif loaded[0] != scope:
+                print('Journal ' + journal_file + ' is for a different '
+                      'bucket, policy or prefixes. Exiting.', file=sys.stderr)
+                sys.exit(1)
+
+        if loaded is None:
+            key_ranges = self._plan_key_ranges(prefixes, delimiter, workers,
+                                               shard_strategy, fan_out)
+            plan = []
+            select = partial(self._select_range, PRUNE_POLICIES[policy], keep)
+            for range_plan in self._map_key_ranges(select, key_ranges,
+                                                   workers):
+                plan.extend(range_plan)
+            deleted = set()
+        else:
+            scope, plan, deleted = loaded
+
+        remaining = [version for version in plan if version[1] not in deleted]
+
+        if dry_run:
+            print('Versions that would be deleted: ')
+            print('\tfilename, fileId and size of each version')
+            for file_name, file_id, length in remaining:
+                print('%s, fileId: %s, size: %d' % (file_name, file_id,
+                                                    length))
+            print('\nVersions to delete: ', str(len(remaining)))
+            print('Bytes to free: ',
+                  str(sum(version[2] for version in remaining)))
+            return
+
+        if journal is not None:
+            if loaded is None:
+                journal.start(scope, plan)
+            else:
+                journal.resume()
+
+        limiter = RateLimiter(delete_rate, burst=delete_workers)
+        lock = threading.Lock()
+        pending = iter(remaining)
+        counts = {}
+        counts['deleted'] = 0
+        counts['bytes'] = 0
+        counts['failed'] = 0
+
+        def delete_versions():
+            while True:
+                with lock:
+                    version = next(pending, None)
+                if version is None:
+                    return
+
+                file_name, file_id, length = version
+                limiter.acquire()
+                result, status_code = self.delete_file_version(file_name,
+                                                               file_id)
+
+                # A version that is already gone counts as deleted, it may
+                # have been deleted just before an interruption.
+
+                error_code = result.get('code') if isinstance(result, dict) \
+                    else None
+                if status_code == 200 or error_code == 'file_not_present':
+                    if journal is not None:
+                        journal.record_deleted(file_id)
+                    with lock:
+                        counts['deleted'] = counts['deleted'] + 1
+                        counts['bytes'] = counts['bytes'] + length
+                else:
+                    print('Delete ' + file_name + ' ' + file_id +
+                          ': status code ' + str(status_code),
+                          file=sys.stderr)
+                    print(result, file=sys.stderr)
+                    with lock:
+                        counts['failed'] = counts['failed'] + 1
+
+        try:
+            with ThreadPoolExecutor(max_workers=delete_workers) as executor:
+                futures = [executor.submit(delete_versions)
+                           for i in range(delete_workers)]
+                for future in futures:
+                    future.result()
+        finally:
+            if journal is not None:
+                journal.close()
+
+        print('Versions to delete: ', str(len(remaining)))
+        print('Versions deleted: ', str(counts['deleted']))
+        print('Bytes freed: ', str(counts['bytes']))
+        print('Failed deletions: ', str(counts['failed']))
+        if counts['failed'] and journal is not None:
+            print('Run again with --resume to retry them.')
+
+    def _select_verify_range(self, selection, start_file_name='',
+                             end_file_name=None, prefix='', delimiter=''):
+        '''
+        Picks the versions to verify in a key range. See _iter_pages for the
+        key range parameters.
+        :param selection: "multi-version" for every uploaded version of the
+        files with more than one, "all" for every uploaded version
+        :return: list of ListEntry
+        '''
+
+        selected = []
+        key = None
+        versions = []
+        for item in self._iter_file_versions(start_file_name, end_file_name,
+                                             prefix, delimiter):
+            if item.fileName != key:
+                if selection == 'all' or len(versions) > 1:
+                    selected.extend(v for v in versions
+                                    if v.action == 'upload')
+                key = item.fileName
+                versions = []
+            versions.append(item)
+
+        if selection == 'all' or len(versions) > 1:
+            selected.extend(v for v in versions if v.action == 'upload')
+        return selected
+
+    def _download_range(self, file_id, start, end, length, consume,
+                        bandwidth):
+        '''
+        Streams bytes start to end (excluded) of a file version into consume,
+        a chunk at a time, through b2_download_file_by_id. A download that
+        breaks off is retried from the first byte not received yet, with
+        backoff, and an expired token is replaced like in _call_api. Only
+        attempts that received nothing count against max_retries. Every
+        attempt holds a slot of self.limiter.
+
+        Anything but the whole file is asked for with a Range header, and
+        only taken from a 206 whose Content-Range starts at the byte asked
+        for: a server that ignores the header would send the file from its
+        first byte.
+        :param file_id: fileId of the version
+        :param length: contentLength of the version
+        :param consume: called with each chunk, in order
+        :param bandwidth: RateLimiter charged one call per byte
+        :return: None once every byte went to consume, else an error message
+        '''
+
+        url = self.downloadUrl + self.api_version + 'b2_download_file_by_id'
+        params = {}
+        params['fileId'] = file_id
+
+        position = start
+        attempt = 0
+        while True:
+            token = self.authToken
+            headers = {}
+            headers['Authorization'] = token
+            ranged = position > 0 or end < length
+            if ranged:
+                headers['Range'] = 'bytes=%d-%d' % (position, end - 1)
+
+            status_code = None
+            error = None
+            resumed_from = position
+            self.limiter.acquire()
+            try:
+                response = self.transport.get(url, params=params,
+                                              headers=headers, stream=True)
+                status_code = response.status_code
+                try:
+                    content_range = response.headers.get('Content-Range')
+                    if (status_code == 200 and not ranged) or \
+                            (status_code == 206 and ranged and
+                             _content_range_start(content_range) ==
+                             position):
+                        for chunk in response.iter_content(
+                                DOWNLOAD_CHUNK_SIZE):
+                            if len(chunk) > end - position:
+                                chunk = chunk[:end - position]
+                            bandwidth.acquire(len(chunk))
+                            consume(chunk)
+                            position = position + len(chunk)
+                            if position >= end:
+                                break
+                        if position >= end:
+                            return None
+                        error = 'download ended at byte %d of %d' % (
+                            position, end)
+                    elif status_code in (200, 206):
+                        return 'asked for bytes %d-%d, got status code %d ' \
+                            'with Content-Range %s' % (position, end - 1,
+                                                       status_code,
+                                                       content_range)
+                    else:
+                        error = 'status code %d' % status_code
+                finally:
+                    response.close()
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            finally:
+                self.limiter.release(status_code in (429, 503))
+
+            if position > resumed_from:
+                attempt = 0
+            if attempt >= self.max_retries:
+                return error
+            if status_code == 401:
+                self._reauthorize(token)
+            elif status_code in (None, 200, 206) or \
+                    status_code in RETRY_STATUS_CODES:
+                time.sleep(backoff_delay(attempt))
+            else:
+                return error
+
+            attempt = attempt + 1
+
+    def _verify_version(self, item, range_size, range_executor, range_slots,
+                        bandwidth):
+        '''
+        Downloads a version and checks it against its listed digests. A
+        version larger than range_size is split into ranges downloaded in
+        parallel on range_executor, which are hashed in order as they arrive.
+        Every range downloading or buffered holds one of range_slots, shared
+        by all versions.
+        :param item: ListEntry of the version
+        :param range_slots: threading.BoundedSemaphore of buffered ranges
+        :param bandwidth: RateLimiter charged one call per byte
+        :return: result (see verify.py) and its description
+        '''
+
+        hasher = ContentHasher()
+        length = item.contentLength
+        if length <= range_size:
+            error = self._download_range(item.fileId, 0, length, length,
+                                         hasher.update, bandwidth)
+        else:
+            def fetch(start, end):
+                buffer = bytearray()
+                return buffer, self._download_range(item.fileId, start, end,
+                                                    length, buffer.extend,
+                                                    bandwidth)
+
+            # Only a version with no range in flight waits for a slot: one
+            # that holds slots while waiting for more could block the others
+            # holding the rest.
+
+            ranges = split_ranges(length, range_size)
+            fetching = []
+            error = None
+            while ranges or fetching:
+                while ranges and len(fetching) <= RANGES_AHEAD and \
+                        range_slots.acquire(not fetching):
+                    start, end = ranges.pop(0)
+                    fetching.append(range_executor.submit(fetch, start, end))
+
+                buffer, error = fetching.pop(0).result()
+                if error is None:
+                    hasher.update(buffer)
+                del buffer
+                range_slots.release()
+                if error is not None:
+                    for future in fetching:
+                        future.cancel()
+                        future.add_done_callback(
+                            lambda future: range_slots.release())
+                    break
+
+        if error is not None:
+            return FAILED, error
+        return check_version(item, hasher)
+
+    def verify_versions(self, selection='multi-version', prefixes=None,
+                        delimiter='', workers=1, shard_strategy='prefix',
+                        fan_out=False, download_workers=8,
+                        range_size=16 * 1000 * 1000, bandwidth=None):
+        '''
+        Downloads versions by fileId and checks every body against the
+        digests B2 listed for it. The versions are listed first, then
+        download_workers threads download them, largest first.
+        :param selection: "multi-version" or "all", see _select_verify_range
+        :param prefixes: Only verify the names under these prefixes
+        (optional)
+        :param delimiter: Only verify the files directly under each prefix
+        (optional)
+        :param workers: Number of threads listing key ranges in parallel
+        :param shard_strategy: See get_shard_boundaries
+        :param fan_out: See _plan_key_ranges
+        :param download_workers: Number of versions downloading at once. A
+        large version downloads up to RANGES_AHEAD more ranges on a second
+        pool of as many threads.
+        :param range_size: Versions larger than this many bytes are
+        downloaded in ranges of this size. At most download_workers ranges
+        are buffered at a time, across all versions.
+        :param bandwidth: Most bytes per second downloaded, across all
+        threads (optional)
+        :return: list of (ListEntry, result, description) for every version
+        that did not verify, number of versions, bytes downloaded, seconds
+        '''
+
+        key_ranges = self._plan_key_ranges(prefixes, delimiter, workers,
+                                           shard_strategy, fan_out)
+        items = []
+        select = partial(self._select_verify_range, selection)
+        for selected in self._map_key_ranges(select, key_ranges, workers):
+            items.extend(selected)
+
+        # Starting with the largest versions keeps one big download from
+        # running alone at the end.
+
+        order = sorted(items, key=lambda item: -item.contentLength)
+        limiter = RateLimiter(bandwidth,
+                              burst=DOWNLOAD_CHUNK_SIZE * download_workers)
+        range_slots = threading.BoundedSemaphore(download_workers)
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=download_workers) as \
+                range_executor:
+            with ThreadPoolExecutor(max_workers=download_workers) as executor:
+                results = list(executor.map(
+                    lambda item: self._verify_version(item, range_size,
+                                                      range_executor,
+                                                      range_slots,
+                                                      limiter), order))
+        elapsed_time = time.time() - start_time
+
+        failures = [(item, result, description)
+                    for item, (result, description) in zip(order, results)
+                    if result != VERIFIED]
+        failures.sort(key=lambda failure: (failure[0].fileName,
+                                           -failure[0].uploadTimestamp))
+        downloaded = sum(item.contentLength for item, (result, description)
+                         in zip(order, results) if result != FAILED)
+        return failures, len(items), downloaded, elapsed_time
+
+    def output_verified_versions(self, selection='multi-version',
+                                 prefixes=None, delimiter='', workers=1,
+                                 shard_strategy='prefix', fan_out=False,
+                                 download_workers=8,
+                                 range_size=16 * 1000 * 1000, bandwidth=None):
+        '''
+        Prints the versions whose content does not match their listed
+        digests, or that have none, and the download throughput. See
+        verify_versions for the parameters.
+        :return: None
+        '''
+
+        failures, version_count, downloaded, elapsed_time = \
+            self.verify_versions(selection, prefixes, delimiter, workers,
+                                 shard_strategy, fan_out, download_workers,
+                                 range_size, bandwidth)
+
+        counts = {}
+        for result in (MISMATCH, UNHASHED, FAILED):
+            counts[result] = 0
+        for item, result, description in failures:
+            counts[result] = counts[result] + 1
+
+        print('Versions that did not verify: ')
+        print('\tfilename, fileId, size, result and details of each version')
+        for item, result, description in failures:
+            print('%s, fileId: %s, size: %d, %s: %s' % (
+                item.fileName, item.fileId, item.contentLength, result,
+                description))
+
+        print('\nVersions checked: ', str(version_count))
+        print('Versions verified: ', str(version_count - len(failures)))
+        print('Digest mismatches: ', str(counts[MISMATCH]))
+        print('Versions without a stored digest: ', str(counts[UNHASHED]))
+        print('Failed downloads: ', str(counts[FAILED]))
+        print('Bytes downloaded: %d in %.1f seconds (%.2f MB/s)' % (
+            downloaded, elapsed_time,
+            downloaded / max(elapsed_time, 0.001) / 1000000))
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# Measures scan throughput against fake_b2_server.py, so performance
+# regressions can be caught without spending transactions on a real bucket.
+# Each scan mode runs in its own process so peak RSS is measured per mode.
+
+from __future__ import print_function
+
+# Python Imports
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Tools Imports
+
+import yaml
+
+# Project Imports
+
+from async_scanner import AsyncBucketScanner
+from b2_connector import B2Connector
+from cassette import PageReplayer
+from fake_b2_server import FakeB2Server
+from fake_b2_server import add_bucket_arguments
+from fake_b2_server import make_buckets
+from library import decode_list_page
+from report_writers import REPORT_WRITERS
+from report_writers import open_report_writer
+
+
+def _scan_files_map(b2, workers, writer):
+    b2.output_files_with_multiple_versions(writer=writer)
+
+def _scan_stream(b2, workers, writer):
+    b2.output_files_with_multiple_versions(stream=True, writer=writer)
+
+def _scan_checkpointed(b2, workers, writer):
+    checkpoint_file = os.path.join(tempfile.mkdtemp(), 'scan.checkpoint')
+    b2.output_files_with_multiple_versions(checkpoint_file=checkpoint_file,
+                                           writer=writer)
+
+def _scan_sharded(b2, workers, writer):
+    b2.output_files_with_multiple_versions(workers=workers, writer=writer)
+
+def _scan_sharded_stream(b2, workers, writer):
+    b2.output_files_with_multiple_versions(workers=workers, stream=True,
+                                           writer=writer)
+
+def _scan_all_buckets(b2, workers, writer):
+    AsyncBucketScanner(b2, max_in_flight=workers).run(writer=writer)
+
+# Scan modes, by name. Each one takes an authorized B2Connector, the worker
+# count and the ReportWriter for its report.
+
+SCAN_MODES = {}
+SCAN_MODES['files-map'] = _scan_files_map
+SCAN_MODES['stream'] = _scan_stream
+SCAN_MODES['checkpointed'] = _scan_checkpointed
+SCAN_MODES['sharded'] = _scan_sharded
+SCAN_MODES['sharded-stream'] = _scan_sharded_stream
+SCAN_MODES['all-buckets'] = _scan_all_buckets
+
+
+def peak_rss_mb():
+    '''
+    :return: peak resident set size of this process, in MB
+    '''
+
+    # On Linux, ru_maxrss survives exec, so a child would report the
+    # benchmark parent's peak (with all the fake buckets) if that was higher.
+    # VmHWM is reset by exec.
+
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError):
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def cpu_seconds():
+    '''
+    :return: user plus system CPU time used by this process, in seconds
+    '''
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_child(mode, settings_file, workers, report_format, replay=None):
+    '''
+    Runs one scan mode in this process and prints its measurements as JSON
+    on the last line of stdout. The report itself is discarded.
+    :param replay: recording to replay instead of calling the server
+    (optional)
+    '''
+
+    cassette = PageReplayer(replay) if replay else None
+    b2 = B2Connector(settings_file, cassette=cassette)
+    rss_before = peak_rss_mb()
+
+    writer = open_report_writer(report_format, os.devnull)
+    start_cpu = cpu_seconds()
+    start_time = time.time()
+    try:
+        SCAN_MODES[mode](b2, workers, writer)
+    finally:
+        elapsed = time.time() - start_time
+        cpu = cpu_seconds() - start_cpu
+        writer.close()
+
+    opened, reused = b2.transport.connection_stats()
+
+    measurement = {}
+    measurement['seconds'] = elapsed
+    measurement['cpuSeconds'] = cpu
+    measurement['peakRssMb'] = peak_rss_mb()
+    measurement['startRssMb'] = rss_before
+    measurement['connectionsOpened'] = opened
+    measurement['connectionsReused'] = reused
+    if cassette is not None:
+        measurement['pagesReplayed'] = cassette.pages
+    print(json.dumps(measurement))
+
+
+def write_settings(server_url, bucket_name):
+    settings = {}
+    settings['authUrl'] = server_url
+    settings['apiVersion'] = '/b2api/v2/'
+    settings['bucketName'] = bucket_name
+    settings['keyid'] = 'benchmark'
+    settings['appkey'] = 'benchmark'
+    settings['authCacheFile'] = ''
+
+    fd, settings_file = tempfile.mkstemp(prefix='benchmark-',
+                                         suffix='.yaml')
+    with os.fdopen(fd, 'w') as f:
+        yaml.safe_dump(settings, f)
+    return settings_file
+
+
+def count_recorded_versions(replay):
+    '''
+    :return: name of the bucket a recording is from, and the number of
+    distinct versions in it
+    '''
+
+    cassette = PageReplayer(replay)
+    file_ids = set()
+    for request, body in cassette.iter_pages():
+        for item in decode_list_page(body)['files']:
+            if item.action != 'folder':
+                file_ids.add(item.fileId)
+    cassette.close()
+    return cassette.bucket_name, len(file_ids)
+
+
+def run_replay_benchmark(args):
+    '''
+    Runs every requested mode against a recording made with start.py
+    --record, so real buckets can be benchmarked without calling B2. Modes
+    only replay if the recording was made with the same options.
+    '''
+
+    bucket_name, versions = count_recorded_versions(args.replay)
+    settings_file = write_settings('http://127.0.0.1:1', bucket_name)
+
+    results = []
+    try:
+        for mode in args.modes:
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), '--child', mode,
+                 '--settings', settings_file, '--workers',
+                 str(args.workers), '--format', args.format, '--replay',
+                 args.replay])
+            measurement = json.loads(output.decode('utf-8').splitlines()[-1])
+
+            measurement['mode'] = mode
+            measurement['versions'] = versions
+            measurement['versionsPerSecond'] = \
+                versions / max(measurement['seconds'], 1e-9)
+            results.append(measurement)
+
+            if not args.json:
+                print('%-16s %10d versions %8.2f s %8.2f s CPU %12.0f '
+                      'versions/s %8.1f MB peak RSS %6d pages replayed' %
+                      (mode, versions, measurement['seconds'],
+                       measurement['cpuSeconds'],
+                       measurement['versionsPerSecond'],
+                       measurement['peakRssMb'],
+                       measurement['pagesReplayed']))
+                sys.stdout.flush()
+    finally:
+        os.remove(settings_file)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+def run_benchmark(args):
+    '''
+    Serves the synthetic buckets, runs every requested mode against them in a
+    child process, and prints one line of results per mode.
+    '''
+
+    buckets = make_buckets(args.buckets, args.files, args.version_weights,
+                           args.folders, args.hide_ratio,
+                           content_size=args.content_size)
+    versions = sum(b.version_count() for b in buckets)
+    server = FakeB2Server(buckets, latency=args.latency,
+                          error_rate=args.error_rate,
+                          token_lifetime=args.token_lifetime).start()
+    settings_file = write_settings(server.url, buckets[0].name)
+
+    results = []
+    try:
+        for mode in args.modes:
+            # The all-buckets mode lists every bucket, the others only the
+            # first one.
+
+            scanned = versions if mode == 'all-buckets' else \
+                buckets[0].version_count()
+
+            server.reset_counts()
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), '--child', mode,
+                 '--settings', settings_file, '--workers',
+                 str(args.workers), '--format', args.format])
+            measurement = json.loads(output.decode('utf-8').splitlines()[-1])
+
+            counts = server.counts()
+            measurement['mode'] = mode
+            measurement['versions'] = scanned
+            measurement['versionsPerSecond'] = \
+                scanned / max(measurement['seconds'], 1e-9)
+            measurement['requests'] = sum(counts.values())
+            measurement['requestCounts'] = counts
+            results.append(measurement)
+
+            if not args.json:
+                print('%-16s %10d versions %8.2f s %8.2f s CPU %12.0f '
+                      'versions/s %8.1f MB peak RSS %6d requests' %
+                      (mode, scanned, measurement['seconds'],
+                       measurement['cpuSeconds'],
+                       measurement['versionsPerSecond'],
+                       measurement['peakRssMb'], measurement['requests']))
+                sys.stdout.flush()
+    finally:
+        server.stop()
+        os.remove(settings_file)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark scan modes against a local fake B2 server.')
+    add_bucket_arguments(parser)
+    parser.add_argument('--modes', nargs='+', choices=sorted(SCAN_MODES),
+                        default=['files-map', 'stream', 'sharded'],
+                        help='scan modes to run (default: files-map stream '
+                             'sharded)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='workers for sharded modes and in-flight limit '
+                             'for all-buckets (default: 4)')
+    parser.add_argument('--format', choices=sorted(REPORT_WRITERS),
+                        default='text',
+                        help='report format to produce (default: text)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='replay a recording made with start.py '
+                             '--record instead of serving synthetic buckets')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--settings', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.settings, args.workers, args.format,
+                  args.replay)
+    elif args.replay:
+        run_replay_benchmark(args)
+    else:
+        run_benchmark(args)
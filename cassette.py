@@ -0,0 +1,256 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import json
+import mmap
+import struct
+import sys
+import threading
+import zlib
+
+# Recordings of b2_list_file_versions pages, so a bucket listed once can be
+# analysed again with other report settings without calling B2.
+#
+# A recording is a file of records, in the order the pages came in:
+#
+#   magic        b'B2PAGES1'
+#   records      key length, body length (big-endian uint32 each), the key,
+#                then the zlib-compressed raw response body
+#   index        (when the recording was closed) zlib-compressed JSON list
+#                of [key, body offset, body length], its offset (uint64)
+#                and b'B2PAGEIX'
+#
+# A page's key is its request, as sorted JSON, so replaying only answers
+# the requests a recorded scan made: run it with the same scan options. The
+# first record, with an empty key, holds the bucket id and name.
+#
+# Replaying maps the file and decompresses one page at a time, so a
+# recording of any size takes a few bytes of memory per page for the
+# index. A recording whose index is missing, because recording was
+# interrupted, is indexed by reading the record headers.
+
+_MAGIC = b'B2PAGES1'
+_INDEX_MAGIC = b'B2PAGEIX'
+_RECORD = struct.Struct('>II')
+_TRAILER = struct.Struct('>Q8s')
+
+
+class ReplayMiss(Exception):
+    '''
+    Raised when a replayed scan asks for a page the recording doesn't have,
+    because it was recorded with other scan options.
+    '''
+
+
+def page_key(data):
+    '''
+    :param data: b2_list_file_versions request
+    :return: key of the page answering it
+    '''
+
+    return json.dumps(data, sort_keys=True).encode('utf-8')
+
+
+class PageRecorder:
+    '''
+    Writes every b2_list_file_versions page a B2Connector receives to a
+    recording.
+    '''
+
+    replaying = False
+
+    def __init__(self, path, level=3):
+        '''
+        :param path: recording to write, replaced if it exists
+        :param level: zlib compression level
+        '''
+
+        self.path = path
+        self.level = level
+        self.pages = 0
+        self._stream = open(path, 'wb')
+        self._stream.write(_MAGIC)
+        self._offset = len(_MAGIC)
+        self._index = []
+        self._lock = threading.Lock()
+
+    def start(self, bucket_id, bucket_name):
+        '''
+        Records the bucket the pages are from.
+        '''
+
+        bucket = {}
+        bucket['bucketId'] = bucket_id
+        bucket['bucketName'] = bucket_name
+        self._write(b'', json.dumps(bucket).encode('utf-8'))
+
+    def list_file_versions(self, data, decoder, fetch):
+        '''
+        Calls B2 and records the page it answers with.
+        :param data: b2_list_file_versions request
+        :param decoder: decoder the caller asked for, or None for json.loads
+        :param fetch: calls b2_list_file_versions with the decoder it is
+        given, and returns result, status code
+        :return: result, status code
+        '''
+
+        key = page_key(data)
+
+        def record(content):
+            self._write(key, content)
+            return (decoder or json.loads)(content)
+
+        return fetch(record)
+
+    def _write(self, key, content):
+        body = zlib.compress(content, self.level)
+        with self._lock:
+            self._stream.write(_RECORD.pack(len(key), len(body)))
+            self._stream.write(key)
+            self._stream.write(body)
+            body_offset = self._offset + _RECORD.size + len(key)
+            self._index.append([key.decode('utf-8'), body_offset, len(body)])
+            self._offset = body_offset + len(body)
+            if key:
+                self.pages = self.pages + 1
+
+    def close(self):
+        '''
+        Writes the index and closes the recording.
+        '''
+
+        with self._lock:
+            index = zlib.compress(json.dumps(self._index).encode('utf-8'))
+            self._stream.write(index)
+            self._stream.write(_TRAILER.pack(self._offset, _INDEX_MAGIC))
+            self._stream.close()
+
+
+class PageReplayer:
+    '''
+    Answers a B2Connector's b2_list_file_versions calls from a recording,
+    without calling B2.
+    '''
+
+    replaying = True
+
+    def __init__(self, path):
+        '''
+        :param path: recording written by PageRecorder
+        '''
+
+        self.path = path
+        self.pages = 0
+        self._lock = threading.Lock()
+        self._stream = open(path, 'rb')
+        self._map = mmap.mmap(self._stream.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+        if self._map[:len(_MAGIC)] != _MAGIC:
+            print('%s is not a recording of listing pages.' % path)
+            sys.exit()
+
+        self._index = self._read_index()
+        if self._index is None:
+            self._index = dict((key, location) for key, location in
+                               self._scan_records())
+
+        bucket = json.loads(self._body(self._index[b'']))
+        self.bucket_id = bucket['bucketId']
+        self.bucket_name = bucket['bucketName']
+
+    def _read_index(self):
+        # The index of a closed recording, or None.
+
+        size = len(self._map)
+        if size < len(_MAGIC) + _TRAILER.size:
+            return None
+        index_offset, magic = _TRAILER.unpack_from(self._map,
+                                                   size - _TRAILER.size)
+        if magic != _INDEX_MAGIC:
+            return None
+        entries = json.loads(zlib.decompress(
+            self._map[index_offset:size - _TRAILER.size]))
+        return dict((key.encode('utf-8'), (offset, length))
+                    for key, offset, length in entries)
+
+    def _scan_records(self):
+        # Walks the record headers from the start. A record cut short by an
+        # interrupted recording ends the walk.
+
+        offset = len(_MAGIC)
+        size = len(self._map)
+        while offset + _RECORD.size <= size:
+            key_length, body_length = _RECORD.unpack_from(self._map, offset)
+            key_start = offset + _RECORD.size
+            body_start = key_start + key_length
+            if body_start + body_length > size:
+                return
+            yield self._map[key_start:body_start], (body_start, body_length)
+            offset = body_start + body_length
+
+    def _body(self, location):
+        offset, length = location
+        return zlib.decompress(self._map[offset:offset + length])
+
+    def iter_pages(self):
+        '''
+        :return: generator of (request, raw response body) for every page,
+        in the order they were recorded
+        '''
+
+        for key, location in self._scan_records():
+            if key:
+                yield json.loads(key), self._body(location)
+
+    def list_file_versions(self, data, decoder, fetch):
+        '''
+        Answers a b2_list_file_versions request with the recorded page. See
+        PageRecorder.list_file_versions.
+        '''
+
+        location = self._index.get(page_key(data))
+        if location is None:
+            raise ReplayMiss('%s has no page for %s. Replay with the options '
+                             'it was recorded with.' % (self.path,
+                                                        json.dumps(data)))
+
+        with self._lock:
+            self.pages = self.pages + 1
+        return (decoder or json.loads)(self._body(location)), 200
+
+    def close(self):
+        self._map.close()
+        self._stream.close()
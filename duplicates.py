@@ -0,0 +1,235 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import binascii
+import math
+import struct
+
+# Project Imports
+
+from version_store import pack_digests
+from version_store import MD5_PRESENT
+from version_store import SHA1_PRESENT
+
+# Finding content stored under more than one name takes two passes over the
+# versions, which the scan spills to temporary files so the bucket is only
+# listed once:
+#
+#   1. Every content hash goes through a Bloom filter of the hashes seen so
+#      far. A hash that was (probably) seen before is added to a second Bloom
+#      filter of candidates.
+#   2. Only the versions whose hash is in the candidate filter are grouped
+#      exactly. False positives end up in groups of one and are dropped.
+#
+# The filters take 10 to 20 bits per version, and the exact pass only holds
+# the candidates, so memory stays bounded by the duplicates, not the bucket.
+
+# Spill records: content key (1 type byte, then the sha1 or md5), content
+# length, upload timestamp, file name and file id.
+
+_SHA1_KEY = b'S'
+_MD5_KEY = b'M'
+_RECORD = struct.Struct('>BqqHB')
+_WORDS = struct.Struct('>II')
+
+
+class BloomFilter:
+    '''
+    Bloom filter over content hashes. The keys are already uniformly
+    distributed, so the bit positions come straight from their bytes.
+    '''
+
+    def __init__(self, capacity, error_rate=0.01):
+        '''
+        :param capacity: number of keys the filter is sized for. More keys
+        still work, with more false positives.
+        :param error_rate: false positive rate at capacity
+        '''
+
+        capacity = max(capacity, 1)
+        wanted = -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        # A power of two number of bits, so positions are a mask away from
+        # the digest words.
+        self.bit_count = 64
+        while self.bit_count < wanted and self.bit_count < 1 << 32:
+            self.bit_count = self.bit_count << 1
+        self.hash_count = max(int(round(wanted / capacity * math.log(2))), 1)
+        self.bits = bytearray(self.bit_count >> 3)
+
+    def _positions(self, key):
+        # Double hashing on two 32 bit words of the digest.
+
+        h1, h2 = _WORDS.unpack_from(key, 1)
+        mask = self.bit_count - 1
+        return [(h1 + i * h2) & mask for i in range(self.hash_count)]
+
+    def add(self, key):
+        '''
+        Adds a key.
+        :return: True if the key was (probably) already in the filter
+        '''
+
+        bits = self.bits
+        present = True
+        for position in self._positions(key):
+            byte = position >> 3
+            mask = 1 << (position & 7)
+            value = bits[byte]
+            if not value & mask:
+                present = False
+                bits[byte] = value | mask
+        return present
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+def content_key(md5, sha1):
+    '''
+    :return: the key duplicates are grouped by, the raw sha1 (or md5 when
+    B2 has no sha1, as for large files) with a type byte, or None
+    '''
+
+    flags, md5_bytes, sha1_bytes = pack_digests(md5, sha1)
+    if flags & SHA1_PRESENT:
+        return _SHA1_KEY + sha1_bytes
+    if flags & MD5_PRESENT:
+        return _MD5_KEY + md5_bytes
+    return None
+
+
+def describe_key(key):
+    '''
+    :return: "sha1: <hex>" or "md5: <hex>"
+    '''
+
+    kind = 'sha1' if key[:1] == _SHA1_KEY else 'md5'
+    return kind + ': ' + binascii.hexlify(key[1:]).decode('ascii')
+
+
+def write_spill(stream, items):
+    '''
+    Appends the uploaded versions in items that have content to a spill
+    file.
+    :param stream: binary file object
+    :param items: ListEntry from decode_list_page
+    :return: number of versions written
+    '''
+
+    chunks = []
+    count = 0
+    for item in items:
+        if item.action != 'upload' or not item.contentLength:
+            continue
+        key = content_key(item.contentMd5, item.contentSha1)
+        if key is None:
+            continue
+        name = item.fileName.encode('utf-8')
+        file_id = item.fileId.encode('ascii')
+        chunks.append(_RECORD.pack(len(key), item.contentLength,
+                                   item.uploadTimestamp, len(name),
+                                   len(file_id)))
+        chunks.append(key)
+        chunks.append(name)
+        chunks.append(file_id)
+        count = count + 1
+    stream.write(b''.join(chunks))
+    return count
+
+
+def _read_spill_matches(stream, keys):
+    # Reads a spill file from the start, decoding only the records whose key
+    # is in keys, as (key, content length, upload timestamp, file name, file
+    # id). With keys=None, only yields the keys. Open the file with a large
+    # buffer, the records are read one field at a time.
+
+    stream.seek(0)
+    header_size = _RECORD.size
+    unpack = _RECORD.unpack
+    read = stream.read
+    seek = stream.seek
+    while True:
+        header = read(header_size)
+        if len(header) < header_size:
+            return
+        key_size, length, timestamp, name_size, file_id_size = unpack(header)
+        key = read(key_size)
+        if keys is None:
+            seek(name_size + file_id_size, 1)
+            yield key
+        elif key in keys:
+            name = read(name_size).decode('utf-8')
+            file_id = read(file_id_size).decode('ascii')
+            yield key, length, timestamp, name, file_id
+        else:
+            seek(name_size + file_id_size, 1)
+
+
+def find_duplicates(spills, version_count, error_rate=0.01):
+    '''
+    Groups the versions in the spill files by content.
+    :param spills: spill files written by write_spill
+    :param version_count: number of versions in them, to size the filters
+    :param error_rate: false positive rate of the first pass
+    :return: list of (key, content length, copies), copies being a list of
+    (file name, file id, upload timestamp), for every content stored more
+    than once, most bytes wasted first
+    '''
+
+    seen = BloomFilter(version_count, error_rate)
+    candidates = BloomFilter(version_count, error_rate)
+    for spill in spills:
+        for key in _read_spill_matches(spill, None):
+            if seen.add(key):
+                candidates.add(key)
+
+    groups = {}
+    for spill in spills:
+        for key, length, timestamp, name, file_id in \
+                _read_spill_matches(spill, candidates):
+            if key not in groups:
+                groups[key] = (length, [])
+            groups[key][1].append((name, file_id, timestamp))
+
+    duplicates = [(key, length, copies)
+                  for key, (length, copies) in groups.items()
+                  if len(copies) > 1]
+    duplicates.sort(key=lambda d: (-d[1] * (len(d[2]) - 1), d[0]))
+    return duplicates
@@ -0,0 +1,454 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import math
+from bisect import bisect_left
+from collections import namedtuple
+from statistics import NormalDist
+
+# An estimate lists a few small windows of versions instead of the whole
+# bucket. The bucket is split by bisection into strata. The first page of a
+# stratum is listed exactly (all of it, if it is small), and the rest is
+# sampled with windows of a fixed width w on a line the names are placed
+# on, as wide as the stretch the first page covered. A window starts at a
+# uniformly random point of [start - w, end), clipped to [start, end), so
+# every name is counted by a window with the same probability
+# w / (end - start + w), and the counts scaled up by the inverse of that are
+# unbiased totals however the names are clustered (Horvitz-Thompson). A
+# window whose names don't fit in a few pages is scaled up from the part
+# that was listed.
+#
+# The line has one digit per character after the prefix shared by the ends
+# of the stratum. Each character position has its own alphabet, learned
+# from the names listed so far and filled in with every digit and the
+# letters between the lowest and highest seen, so names made from a
+# template like "job003/blocks/00a1/00001234.blk" spread evenly over the
+# line instead of bunching up where the characters they never vary are. A
+# point on the line is turned back into a startFileName to seek to.
+#
+# The first pages only show how the last characters of names vary, so
+# before placing the windows the estimate looks for the other characters
+# each position takes, like a loose index scan: it lists the first name
+# after the highest character seen at a position, and repeats while that
+# turns up new ones.
+
+_DEPTH = 64
+_DIGITS = '0123456789'
+_LETTERS = ('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+# Counts a window (or an exactly listed stretch) adds up.
+
+WINDOW_FIELDS = ('files', 'multi_version_files', 'versions', 'bytes',
+                 'old_version_bytes')
+
+Estimate = namedtuple('Estimate', ['value', 'low', 'high'])
+
+
+def _common_prefix(a, b):
+    i = 0
+    while i < len(a) and i < len(b) and a[i] == b[i]:
+        i = i + 1
+    return a[:i]
+
+
+class Alphabets:
+    '''
+    The characters seen at each position of the file names listed so far.
+    An empty string stands for "the name ended here".
+    '''
+
+    def __init__(self, names):
+        '''
+        :param names: file names
+        '''
+
+        seen = []
+        for name in names:
+            while len(seen) <= len(name):
+                seen.append(set())
+            for i, c in enumerate(name):
+                seen[i].add(c)
+            seen[len(name)].add('')
+
+        self._alphabets = []
+        for chars in seen:
+            # Digits are often counters or dates that use all of them;
+            # letters are often hex digits that only go up to f.
+
+            if len(chars.intersection(_DIGITS)) > 1:
+                chars.update(_DIGITS)
+            for letters in _LETTERS:
+                found = chars.intersection(letters)
+                if len(found) > 1:
+                    chars.update(c for c in letters
+                                 if min(found) <= c <= max(found))
+            self._alphabets.append(sorted(chars))
+
+    def at(self, i):
+        '''
+        :return: sorted list of the characters at position i
+        '''
+
+        if i < len(self._alphabets):
+            return self._alphabets[i]
+        return ['']
+
+
+def successor_probes(names, tried):
+    '''
+    :param names: file names seen so far
+    :param tried: set of the (position, character) already probed past,
+    updated with the new ones
+    :return: for every character position, a name to list from to find the
+    next character above the highest one seen there
+    '''
+
+    highest = {}
+    for name in names:
+        for i, c in enumerate(name):
+            if i not in highest or c > highest[i]:
+                highest[i] = c
+    probes = set()
+    for name in names:
+        for i, c in enumerate(name):
+            if highest.get(i) == c:
+                del highest[i]
+                if c < '~' and (i, c) not in tried:
+                    tried.add((i, c))
+                    probes.add(name[:i] + chr(ord(c) + 1))
+    return sorted(probes)
+
+
+class KeySpace:
+    '''
+    The stretch of file names from low (included) to high (excluded),
+    placed on a line of integer positions.
+    '''
+
+    def __init__(self, low, high, alphabets):
+        '''
+        :param low: first file name of the range
+        :param high: first file name past the range, None for the end of
+        the bucket
+        :param alphabets: Alphabets of the names seen so far, which should
+        include low and high
+        '''
+
+        self.prefix = _common_prefix(low, high) if high is not None else ''
+        self._alphabets = [alphabets.at(len(self.prefix) + i)
+                           for i in range(_DEPTH)]
+
+        # Mixed radix: the weight of a digit is the number of positions
+        # the digits after it span.
+
+        self._weights = [1] * _DEPTH
+        for i in range(_DEPTH - 2, -1, -1):
+            self._weights[i] = self._weights[i + 1] * \
+                len(self._alphabets[i + 1])
+        self.low = self.position(low)
+        if high is None:
+            self.high = self._weights[0] * len(self._alphabets[0])
+        else:
+            self.high = self.position(high)
+
+    def position(self, name):
+        '''
+        :param name: a file name in the range
+        :return: its position. A name with a character not in the alphabets
+        is placed where the next known character starts.
+        '''
+
+        rest = name[len(self.prefix):]
+        position = 0
+        for i in range(_DEPTH):
+            c = rest[i] if i < len(rest) else ''
+            alphabet = self._alphabets[i]
+            digit = bisect_left(alphabet, c)
+            position = position + digit * self._weights[i]
+            if digit == len(alphabet) or alphabet[digit] != c or not c:
+                break
+        return position
+
+    def name_at(self, position):
+        '''
+        :return: the largest file name made of known characters whose
+        position is at or before position
+        '''
+
+        chars = []
+        for i in range(_DEPTH):
+            digit, position = divmod(position, self._weights[i])
+            c = self._alphabets[i][digit]
+            if not c:
+                break
+            chars.append(c)
+        return self.prefix + ''.join(chars)
+
+    def width(self):
+        return self.high - self.low
+
+
+def count_versions(items):
+    '''
+    Counts files, versions and bytes.
+    :param items: ListEntry of complete files, in listing order
+    :return: dictionary of the WINDOW_FIELDS counts
+    '''
+
+    counts = dict.fromkeys(WINDOW_FIELDS, 0)
+    name = None
+    versions = 0
+    for item in items:
+        if item.fileName != name:
+            name = item.fileName
+            versions = 0
+            counts['files'] = counts['files'] + 1
+        versions = versions + 1
+        if versions == 2:
+            counts['multi_version_files'] = counts['multi_version_files'] + 1
+        length = item.contentLength or 0
+        counts['versions'] = counts['versions'] + 1
+        counts['bytes'] = counts['bytes'] + length
+        if versions > 1:
+            counts['old_version_bytes'] = counts['old_version_bytes'] + length
+    return counts
+
+
+class Stratum:
+    '''
+    One range of file names an estimate samples: its first page is listed
+    exactly, the rest through windows at random points.
+    '''
+
+    def __init__(self, low, high):
+        '''
+        :param low: first file name of the stratum, a real one
+        :param high: first file name past it, None for the end of the bucket
+        '''
+
+        self.low = low
+        self.high = high
+        self.exact = dict.fromkeys(WINDOW_FIELDS, 0)
+        self.counted = False
+        self.end = None
+        self.space = None
+        self.samples = []
+
+    def add_head(self, items, complete):
+        '''
+        Counts the first page of the stratum. Unless the page reached the
+        end of the stratum, the file it stops in is left to the windows.
+        :param items: ListEntry listed from low, in listing order
+        :param complete: True if the listing ended before a full page
+        :return: None
+        '''
+
+        inside = [item for item in items if self.contains(item.fileName)]
+        if not complete and len(inside) == len(items) and inside:
+            self.end = inside[-1].fileName
+            inside = [item for item in inside if item.fileName != self.end]
+        self.exact = count_versions(inside)
+        self.counted = True
+
+    def contains(self, file_name):
+        return self.high is None or file_name < self.high
+
+    def place(self, alphabets):
+        '''
+        Puts the stratum on a line, once the first pages of every stratum
+        have been listed.
+        :param alphabets: Alphabets of the names listed so far
+        :return: True if there is anything left to sample
+        '''
+
+        if self.end is None:
+            return False
+        self.space = KeySpace(self.low, self.high, alphabets)
+        self.start = self.space.position(self.end)
+        self.width = max(self.start - self.space.low, 1)
+        return self.space.high > self.start
+
+    def window(self, rnd):
+        '''
+        :param rnd: random.Random
+        :return: name to start listing at, and the window's first and last
+        (excluded) positions
+        '''
+
+        point = rnd.randrange(self.start - self.width, self.space.high)
+        low = max(point, self.start)
+        high = min(point + self.width, self.space.high)
+        return self.space.name_at(low), low, high
+
+    def past(self, file_name, high):
+        '''
+        :return: True if file_name is after the window ending at position
+        high
+        '''
+
+        return not self.contains(file_name) or \
+            self.space.position(file_name) >= high
+
+    def add_window(self, low, high, items, complete):
+        '''
+        Adds a window to the estimate.
+        :param low: first position of the window
+        :param high: first position past the window
+        :param items: ListEntry listed from the window's name, in listing
+        order, until past the window or out of pages
+        :param complete: True if the listing reached the end of the bucket
+        :return: None
+        '''
+
+        inside = []
+        reached = complete
+        for item in items:
+            if not self.contains(item.fileName):
+                reached = True
+                break
+            position = self.space.position(item.fileName)
+            if position >= high:
+                reached = True
+                break
+            if position >= low:
+                inside.append(item)
+
+        # Out of pages inside a dense window: scale up what was listed,
+        # leaving out the file the listing stopped in.
+
+        scale = 1.0
+        if not reached and inside:
+            last = inside[-1].fileName
+            inside = [item for item in inside if item.fileName != last]
+            listed = self.space.position(last) - low
+            scale = (high - low) / max(listed, 1)
+
+        counts = count_versions(inside)
+        scale = scale * (self.space.high - self.start + self.width) / \
+            self.width
+        self.samples.append(dict((field, counts[field] * scale)
+                                 for field in WINDOW_FIELDS))
+
+    def totals(self):
+        '''
+        :return: dictionary of estimated totals and dictionary of the
+        variance of each total and covariance of each pair of totals
+        '''
+
+        totals = dict(self.exact)
+        variance = {}
+        if not self.samples:
+            return totals, variance
+
+        n = len(self.samples)
+        means = {}
+        for field in WINDOW_FIELDS:
+            means[field] = sum(s[field] for s in self.samples) / n
+            totals[field] = totals[field] + means[field]
+        if n > 1:
+            for a in WINDOW_FIELDS:
+                for b in WINDOW_FIELDS:
+                    variance[a, b] = sum(
+                        (s[a] - means[a]) * (s[b] - means[b])
+                        for s in self.samples) / (n - 1) / n
+        return totals, variance
+
+
+def _t_quantile(p, df):
+    # Student's t quantile from the normal one (Cornish-Fisher expansion),
+    # within 1% from 3 degrees of freedom up.
+
+    z = NormalDist().inv_cdf(p)
+    return z + (z ** 3 + z) / (4 * df) + \
+        (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2) + \
+        (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3)
+
+
+def combine_strata(strata, confidence=0.95):
+    '''
+    Adds up the strata into estimates of the bucket's totals, with
+    confidence intervals. A few windows per stratum give a rough variance,
+    so the intervals use Student's t with the Welch-Satterthwaite degrees
+    of freedom rather than the normal distribution.
+    :param strata: Stratum list
+    :param confidence: coverage of the intervals
+    :return: dictionary of Estimate for each of WINDOW_FIELDS and for
+    "multi_version_ratio", the share of files with more than one version
+    '''
+
+    totals = dict.fromkeys(WINDOW_FIELDS, 0)
+    variance = {}
+    spread = {}
+    for stratum in strata:
+        stratum_totals, stratum_variance = stratum.totals()
+        for field in WINDOW_FIELDS:
+            totals[field] = totals[field] + stratum_totals[field]
+        for key, value in stratum_variance.items():
+            variance[key] = variance.get(key, 0) + value
+            spread[key] = spread.get(key, 0) + \
+                value * value / (len(stratum.samples) - 1)
+
+    def interval(value, key):
+        v = variance.get(key, 0)
+        if v <= 0:
+            return 0
+        df = max(v * v / spread[key], 3)
+        return _t_quantile(0.5 + confidence / 2, df) * math.sqrt(v)
+
+    estimates = {}
+    for field in WINDOW_FIELDS:
+        error = interval(totals[field], (field, field))
+        estimates[field] = Estimate(totals[field],
+                                    max(totals[field] - error, 0),
+                                    totals[field] + error)
+
+    # Delta method for the ratio of two estimated totals.
+
+    files = totals['files']
+    multi = totals['multi_version_files']
+    ratio = multi / files if files else 0
+    ratio_variance = 0
+    if files:
+        ratio_variance = (
+            variance.get(('multi_version_files', 'multi_version_files'), 0) -
+            2 * ratio * variance.get(('multi_version_files', 'files'), 0) +
+            ratio * ratio * variance.get(('files', 'files'), 0)) / \
+            (files * files)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    error = z * math.sqrt(max(ratio_variance, 0))
+    estimates['multi_version_ratio'] = Estimate(ratio, max(ratio - error, 0),
+                                                min(ratio + error, 1))
+    return estimates
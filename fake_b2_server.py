@@ -0,0 +1,798 @@
+#!/usr/bin/env python
+
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# A local stand-in for the parts of the B2 API this project uses, serving
+# synthetic buckets. It lets scans be run and measured without touching a
+# real account. Point B2Connector at it with these config.yaml settings:
+#
+#     authUrl    : 'http://127.0.0.1:8000'
+#     apiVersion : '/b2api/v2/'
+#     bucketName : 'bucket0'
+#     keyid      : 'any'
+#     appkey     : 'any'
+
+from __future__ import print_function
+
+# Python Imports
+
+import argparse
+import bisect
+import hashlib
+import json
+import random
+import threading
+import time
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+# Project Imports
+
+ACCOUNT_ID = 'fakeaccount0001'
+
+# Every part of a large file but the last has to be at least this big.
+
+MINIMUM_PART_SIZE = 5 * 1000 * 1000
+
+# Indexes into the tuples a FakeBucket stores for each version.
+
+NAME, FILE_ID, MD5, SHA1, TIMESTAMP, LENGTH, ACTION = range(7)
+
+
+class FakeBucket:
+    '''
+    A bucket of synthetic file versions, kept sorted the way
+    b2_list_file_versions returns them: by file name, then newest first.
+    '''
+
+    def __init__(self, name, bucket_id, file_count=10000,
+                 version_weights=(90, 7, 2, 1), folders=16,
+                 hide_ratio=0.02, seed=0, content_size=None):
+        '''
+        :param name: bucket name
+        :param bucket_id: bucket id
+        :param file_count: number of distinct file names
+        :param version_weights: relative weights for a file having 1, 2, 3...
+        versions
+        :param folders: number of top-level folders names are spread over
+        (0 for a flat bucket)
+        :param hide_ratio: fraction of newest versions that are hide markers
+        :param seed: random seed, so a bucket can be generated again
+        :param content_size: give every version a real body of up to this
+        many bytes, which the listed digests are computed from, so
+        downloads can be verified (optional). Without it, versions are
+        around 1 MB and the digests are of a short string. Bodies of 10 MB
+        and more are listed without digests, like large files.
+        '''
+
+        self.name = name
+        self.bucket_id = bucket_id
+        self.content_size = content_size
+        self.lock = threading.Lock()
+        self.next_file_id = 0
+
+        # Bodies of uploaded versions, and the short strings synthetic ones
+        # are made from, by file id.
+        self.bodies = {}
+        self.seeds = {}
+
+        rnd = random.Random(seed)
+        counts = list(range(1, len(version_weights) + 1))
+        versions = []
+        for i in range(file_count):
+            if folders:
+                file_name = 'job%03d/blocks/%04x/%08d.blk' % (
+                    rnd.randrange(folders), rnd.randrange(65536), i)
+            else:
+                file_name = '%08x-%08d.dat' % (rnd.getrandbits(32), i)
+
+            version_count = rnd.choices(counts, weights=version_weights)[0]
+            content = '%s-%d' % (file_name, rnd.randrange(3))
+            timestamp = 1600000000000 + rnd.randrange(10 ** 9)
+            for v in range(version_count):
+                # Most extra versions re-upload the same content, like the
+                # Veeam blocks in the README.
+                if rnd.random() < 0.3:
+                    content = '%s-%d' % (file_name, rnd.randrange(1000))
+                action = 'upload'
+                if v == 0 and rnd.random() < hide_ratio:
+                    action = 'hide'
+                # The same content always has the same length.
+                data = content.encode('utf-8')
+                versions.append(self._make_version(
+                    file_name, data, timestamp,
+                    1 + zlib.crc32(data) % ((content_size or 1 << 20) - 1),
+                    action))
+                timestamp = timestamp - rnd.randrange(1000, 10 ** 7)
+
+        versions.sort(key=lambda v: (v[NAME], -v[TIMESTAMP], v[FILE_ID]))
+        self.versions = versions
+        self.names = [v[NAME] for v in versions]
+        self.by_file_id = dict((v[FILE_ID], v) for v in versions)
+
+        # Deleted versions stay in the sorted lists, which would be slow to
+        # remove from, and are skipped when listing.
+
+        self.deleted = set()
+
+    def _make_version(self, file_name, content, timestamp, length,
+                      action='upload'):
+        self.next_file_id = self.next_file_id + 1
+        file_id = '4_z%s_f%020d' % (self.bucket_id, self.next_file_id)
+        if action == 'hide':
+            return (file_name, file_id, None, 'none', timestamp, 0, action)
+        if self.content_size:
+            self.seeds[file_id] = content
+            if length >= 2 * MINIMUM_PART_SIZE:
+                return (file_name, file_id, None, 'none', timestamp, length,
+                        action)
+            content = synthetic_body(content, length)
+        return (file_name, file_id, hashlib.md5(content).hexdigest(),
+                hashlib.sha1(content).hexdigest(), timestamp, length, action)
+
+    def version_count(self):
+        return len(self.versions)
+
+    def new_file_id(self):
+        with self.lock:
+            self.next_file_id = self.next_file_id + 1
+            return '4_z%s_f%020d' % (self.bucket_id, self.next_file_id)
+
+    def add_version(self, file_name, sha1, length, md5=None, file_id=None,
+                    body=None):
+        '''
+        Stores an uploaded version and returns its JSON description.
+        '''
+
+        file_id = file_id or self.new_file_id()
+        with self.lock:
+            if body is not None:
+                self.bodies[file_id] = body
+            version = (file_name, file_id, md5, sha1,
+                       int(time.time() * 1000), length, 'upload')
+            self.by_file_id[file_id] = version
+            i = bisect.bisect_left(self.names, file_name)
+            self.versions.insert(i, version)
+            self.names.insert(i, file_name)
+        return self.to_json(version)
+
+    def delete_version(self, file_name, file_id):
+        '''
+        Deletes a version like b2_delete_file_version.
+        :return: response dictionary, or None if there is no such version
+        '''
+
+        with self.lock:
+            i = bisect.bisect_left(self.names, file_name)
+            while i < len(self.versions) and self.names[i] == file_name:
+                if self.versions[i][FILE_ID] == file_id and \
+                        file_id not in self.deleted:
+                    self.deleted.add(file_id)
+                    result = {}
+                    result['fileId'] = file_id
+                    result['fileName'] = file_name
+                    return result
+                i = i + 1
+        return None
+
+    def find_version(self, file_id):
+        '''
+        :return: the version with this file id, or None
+        '''
+
+        with self.lock:
+            if file_id in self.deleted:
+                return None
+            return self.by_file_id.get(file_id)
+
+    def body(self, version):
+        '''
+        :return: the content of an uploaded version. Synthetic versions
+        without a content_size get made-up bytes of the right length, which
+        don't match their digests.
+        '''
+
+        file_id = version[FILE_ID]
+        if file_id in self.bodies:
+            return self.bodies[file_id]
+        seed = self.seeds.get(file_id, file_id.encode('ascii'))
+        return synthetic_body(seed, version[LENGTH])
+
+    def to_json(self, version):
+        item = {}
+        item['accountId'] = ACCOUNT_ID
+        item['action'] = version[ACTION]
+        item['bucketId'] = self.bucket_id
+        item['contentLength'] = version[LENGTH]
+        item['contentMd5'] = version[MD5]
+        item['contentSha1'] = version[SHA1]
+        item['contentType'] = 'application/octet-stream'
+        item['fileId'] = version[FILE_ID]
+        item['fileInfo'] = {}
+        item['fileName'] = version[NAME]
+        item['uploadTimestamp'] = version[TIMESTAMP]
+        return item
+
+    def list_file_versions(self, start_file_name='', start_file_id=None,
+                           max_file_count=1000, prefix='', delimiter=None):
+        '''
+        Pages through the versions like b2_list_file_versions, including
+        rolling names up into folders when a delimiter is given.
+        :return: response dictionary
+        '''
+
+        with self.lock:
+            i = bisect.bisect_left(self.names,
+                                   max(start_file_name or '', prefix))
+            if start_file_id:
+                while i < len(self.versions) and \
+                        self.names[i] == start_file_name and \
+                        self.versions[i][FILE_ID] != start_file_id:
+                    i = i + 1
+
+            files = []
+            next_file_name = None
+            next_file_id = None
+            while i < len(self.versions):
+                version = self.versions[i]
+                if not version[NAME].startswith(prefix):
+                    break
+                if version[FILE_ID] in self.deleted:
+                    i = i + 1
+                    continue
+                if len(files) >= max_file_count:
+                    next_file_name = version[NAME]
+                    next_file_id = version[FILE_ID]
+                    break
+
+                if delimiter:
+                    at = version[NAME].find(delimiter, len(prefix))
+                    if at >= 0:
+                        folder = version[NAME][:at + len(delimiter)]
+                        files.append(self._folder_json(folder))
+                        i = bisect.bisect_left(
+                            self.names, folder[:-1] + chr(ord(folder[-1]) + 1))
+                        continue
+
+                files.append(self.to_json(version))
+                i = i + 1
+
+        result = {}
+        result['files'] = files
+        result['nextFileName'] = next_file_name
+        result['nextFileId'] = next_file_id
+        return result
+
+    def _folder_json(self, folder):
+        item = {}
+        item['accountId'] = ACCOUNT_ID
+        item['action'] = 'folder'
+        item['bucketId'] = self.bucket_id
+        item['contentLength'] = 0
+        item['contentMd5'] = None
+        item['contentSha1'] = None
+        item['contentType'] = None
+        item['fileId'] = None
+        item['fileInfo'] = {}
+        item['fileName'] = folder
+        item['uploadTimestamp'] = 0
+        return item
+
+
+def synthetic_body(seed, length):
+    '''
+    :return: seed repeated to length bytes
+    '''
+
+    return (seed * (length // len(seed) + 1))[:length]
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops connections when many workers (or
+    # network probes) connect at once.
+
+    request_queue_size = 128
+
+
+class FakeB2Server:
+    '''
+    Threaded HTTP server answering B2 API calls for a set of FakeBuckets.
+    '''
+
+    def __init__(self, buckets, host='127.0.0.1', port=0, latency=0.0,
+                 error_rate=0.0, token_lifetime=None,
+                 recommended_part_size=100 * 1000 * 1000):
+        '''
+        :param buckets: list of FakeBucket
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free one
+        :param latency: seconds added to every response
+        :param error_rate: fraction of API calls answered with a 503
+        :param token_lifetime: expire each account token after this many API
+        calls (optional)
+        :param recommended_part_size: part size b2_authorize_account
+        recommends for large files
+        '''
+
+        self.buckets = dict((b.bucket_id, b) for b in buckets)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_lifetime = token_lifetime
+        self.recommended_part_size = recommended_part_size
+
+        self.lock = threading.Lock()
+        self.large_files = {}
+        self.request_counts = {}
+        # Like B2, every b2_authorize_account hands out a new token without
+        # revoking the earlier ones, so several processes can share an
+        # account. Each token maps to the calls made with it.
+        self.token_generation = 0
+        self.token_calls = {}
+
+        self.httpd = _HTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            self.request_counts = {}
+
+    def counts(self):
+        with self.lock:
+            return dict(self.request_counts)
+
+    def count(self, cmd):
+        with self.lock:
+            self.request_counts[cmd] = self.request_counts.get(cmd, 0) + 1
+
+    def check_token(self, token):
+        '''
+        :return: True if token is a valid account token. Also expires the
+        token once it has been used token_lifetime times.
+        '''
+
+        with self.lock:
+            if token not in self.token_calls:
+                return False
+            calls = self.token_calls[token] + 1
+            if self.token_lifetime and calls >= self.token_lifetime:
+                del self.token_calls[token]
+            else:
+                self.token_calls[token] = calls
+            return True
+
+    def authorize(self):
+        with self.lock:
+            self.token_generation = self.token_generation + 1
+            token = 'fake-token-%d' % self.token_generation
+            self.token_calls[token] = 0
+
+        allowed = {}
+        allowed['bucketId'] = None
+        allowed['bucketName'] = None
+        allowed['capabilities'] = ['listBuckets', 'listFiles', 'readFiles',
+                                   'writeFiles', 'deleteFiles']
+
+        result = {}
+        result['accountId'] = ACCOUNT_ID
+        result['apiUrl'] = self.url
+        result['authorizationToken'] = token
+        result['downloadUrl'] = self.url
+        result['allowed'] = allowed
+        result['recommendedPartSize'] = self.recommended_part_size
+        result['absoluteMinimumPartSize'] = MINIMUM_PART_SIZE
+        return result
+
+
+def _error(status, code, message=''):
+    result = {}
+    result['status'] = status
+    result['code'] = code
+    result['message'] = message
+    return status, result
+
+
+def _make_handler(server):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self._dispatch()
+
+        def do_POST(self):
+            self._dispatch()
+
+        def _send_json(self, status, result):
+            body = json.dumps(result).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _dispatch(self):
+            url = urlparse(self.path)
+            parts = url.path.strip('/').split('/')
+            cmd = parts[2] if len(parts) > 2 else ''
+
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+
+            args = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+            if cmd not in ('b2_upload_file', 'b2_upload_part') and body:
+                try:
+                    args.update(json.loads(body.decode('utf-8')))
+                except ValueError:
+                    self._send_json(*_error(400, 'bad_request',
+                                            'Invalid JSON'))
+                    return
+
+            server.count(cmd)
+            if server.latency:
+                time.sleep(server.latency)
+
+            if server.error_rate and random.random() < server.error_rate:
+                status, result = _error(503, 'service_unavailable',
+                                        'Injected error')
+            elif cmd == 'b2_download_file_by_id':
+                status, result = self._download(args)
+            else:
+                status, result = self._handle(cmd, parts, args, body)
+            if result is not None:
+                self._send_json(status, result)
+
+        def _download(self, args):
+            # Sends the body, or the part of it a "Range: bytes=a-b" header
+            # asks for. Returns (status, error) when there is nothing to
+            # send, else (status, None).
+
+            token = self.headers.get('Authorization', '')
+            if not server.check_token(token):
+                return _error(401, 'expired_auth_token',
+                              'Authorization token has expired')
+
+            file_id = args.get('fileId', '')
+            bucket = server.buckets.get(file_id[3:].split('_f')[0])
+            version = bucket and bucket.find_version(file_id)
+            if not version or version[ACTION] != 'upload':
+                return _error(404, 'not_found', 'File not present: ' +
+                              file_id)
+
+            body = bucket.body(version)
+            start = 0
+            end = len(body)
+            status = 200
+            requested = self.headers.get('Range')
+            if requested and requested.startswith('bytes='):
+                first, last = requested[6:].split('-')
+                start = int(first)
+                end = min(int(last) + 1 if last else end, end)
+                if start >= end:
+                    return _error(416, 'range_not_satisfiable')
+                status = 206
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start))
+            if status == 206:
+                self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                                 (start, end - 1, len(body)))
+            self.send_header('X-Bz-File-Id', file_id)
+            self.send_header('X-Bz-File-Name', quote(version[NAME]))
+            self.send_header('X-Bz-Content-Sha1', version[SHA1])
+            self.end_headers()
+            view = memoryview(body)
+            for offset in range(start, end, 1 << 20):
+                self.wfile.write(view[offset:min(offset + (1 << 20), end)])
+            return status, None
+
+        def _handle(self, cmd, parts, args, body):
+            token = self.headers.get('Authorization', '')
+
+            if cmd == 'b2_authorize_account':
+                if not token.startswith('Basic '):
+                    return _error(401, 'bad_auth_token')
+                return 200, server.authorize()
+
+            if cmd == 'b2_upload_file':
+                return self._upload_file(parts, token, body)
+
+            if cmd == 'b2_upload_part':
+                return self._upload_part(parts, token, body)
+
+            if not server.check_token(token):
+                return _error(401, 'expired_auth_token',
+                              'Authorization token has expired')
+
+            if cmd == 'b2_list_buckets':
+                buckets = []
+                for b in server.buckets.values():
+                    bucket = {}
+                    bucket['accountId'] = ACCOUNT_ID
+                    bucket['bucketId'] = b.bucket_id
+                    bucket['bucketName'] = b.name
+                    bucket['bucketType'] = 'allPrivate'
+                    buckets.append(bucket)
+                return 200, {'buckets': buckets}
+
+            bucket = server.buckets.get(args.get('bucketId'))
+
+            if cmd == 'b2_list_file_versions':
+                if bucket is None:
+                    return _error(400, 'bad_bucket_id')
+                max_file_count = int(args.get('maxFileCount', 1000))
+                if max_file_count > 10000:
+                    return _error(400, 'bad_request',
+                                  'maxFileCount out of range')
+                return 200, bucket.list_file_versions(
+                    args.get('startFileName', ''),
+                    args.get('startFileId'), max_file_count,
+                    args.get('prefix', ''), args.get('delimiter'))
+
+            if cmd == 'b2_delete_file_version':
+                # The bucket id is part of the file id.
+                file_id = args.get('fileId', '')
+                bucket = server.buckets.get(file_id[3:].split('_f')[0])
+                result = bucket and bucket.delete_version(
+                    args.get('fileName'), file_id)
+                if not result:
+                    return _error(400, 'file_not_present',
+                                  'File not present: ' + file_id)
+                return 200, result
+
+            if cmd == 'b2_get_upload_url':
+                if bucket is None:
+                    return _error(400, 'bad_bucket_id')
+                result = {}
+                result['bucketId'] = bucket.bucket_id
+                result['uploadUrl'] = server.url + \
+                    '/b2api/v2/b2_upload_file/' + bucket.bucket_id
+                result['authorizationToken'] = 'fake-upload-token'
+                return 200, result
+
+            if cmd == 'b2_start_large_file':
+                if bucket is None:
+                    return _error(400, 'bad_bucket_id')
+                large_file = {}
+                large_file['bucket'] = bucket
+                large_file['fileName'] = args.get('fileName')
+                large_file['parts'] = {}
+                file_id = bucket.new_file_id()
+                with server.lock:
+                    server.large_files[file_id] = large_file
+                return 200, self._large_file_json(file_id, large_file)
+
+            if cmd in ('b2_get_upload_part_url', 'b2_finish_large_file',
+                       'b2_cancel_large_file'):
+                file_id = args.get('fileId')
+                with server.lock:
+                    large_file = server.large_files.get(file_id)
+                if large_file is None:
+                    return _error(400, 'bad_request',
+                                  'No active upload for: ' + str(file_id))
+
+            if cmd == 'b2_get_upload_part_url':
+                result = {}
+                result['fileId'] = file_id
+                result['uploadUrl'] = server.url + \
+                    '/b2api/v2/b2_upload_part/' + file_id
+                result['authorizationToken'] = 'fake-upload-token'
+                return 200, result
+
+            if cmd == 'b2_finish_large_file':
+                return self._finish_large_file(file_id, large_file,
+                                               args.get('partSha1Array', []))
+
+            if cmd == 'b2_cancel_large_file':
+                with server.lock:
+                    server.large_files.pop(file_id, None)
+                return 200, self._large_file_json(file_id, large_file)
+
+            return _error(404, 'not_found', 'Unknown API ' + cmd)
+
+        def _check_content_sha1(self, body):
+            # Returns the body without a trailing sha1, and its sha1, or
+            # None if it doesn't match the data.
+
+            sha1 = self.headers.get('X-Bz-Content-Sha1')
+            if sha1 == 'hex_digits_at_end':
+                sha1 = body[-40:].decode('ascii', 'replace')
+                body = body[:-40]
+            if sha1 != hashlib.sha1(body).hexdigest():
+                return body, None
+            return body, sha1
+
+        def _upload_file(self, parts, token, body):
+            if token != 'fake-upload-token':
+                return _error(401, 'bad_auth_token')
+            bucket = server.buckets.get(parts[3] if len(parts) > 3 else '')
+            if bucket is None:
+                return _error(400, 'bad_bucket_id')
+
+            body, sha1 = self._check_content_sha1(body)
+            if sha1 is None:
+                return _error(400, 'bad_request', 'Sha1 did not match data')
+
+            return 200, bucket.add_version(
+                unquote(self.headers.get('X-Bz-File-Name')), sha1, len(body),
+                hashlib.md5(body).hexdigest(), body=body)
+
+        def _upload_part(self, parts, token, body):
+            if token != 'fake-upload-token':
+                return _error(401, 'bad_auth_token')
+            file_id = parts[3] if len(parts) > 3 else ''
+            with server.lock:
+                large_file = server.large_files.get(file_id)
+            if large_file is None:
+                return _error(400, 'bad_request',
+                              'No active upload for: ' + file_id)
+
+            body, sha1 = self._check_content_sha1(body)
+            if sha1 is None:
+                return _error(400, 'bad_request', 'Sha1 did not match data')
+
+            part_number = int(self.headers.get('X-Bz-Part-Number'))
+            with server.lock:
+                large_file['parts'][part_number] = (sha1, len(body), body)
+
+            result = {}
+            result['fileId'] = file_id
+            result['partNumber'] = part_number
+            result['contentLength'] = len(body)
+            result['contentSha1'] = sha1
+            return 200, result
+
+        def _finish_large_file(self, file_id, large_file, part_sha1s):
+            with server.lock:
+                parts = large_file['parts']
+                numbers = list(range(1, len(part_sha1s) + 1))
+                if len(part_sha1s) < 2 or sorted(parts) != numbers or \
+                        [parts[n][0] for n in numbers] != part_sha1s:
+                    return _error(400, 'bad_request',
+                                  'Part sha1s do not match the parts')
+                for n in numbers[:-1]:
+                    if parts[n][1] < MINIMUM_PART_SIZE:
+                        return _error(400, 'bad_request',
+                                      'Part %d is too small' % n)
+                server.large_files.pop(file_id)
+
+            body = b''.join(parts[n][2] for n in numbers)
+            return 200, large_file['bucket'].add_version(
+                large_file['fileName'], 'none', len(body), file_id=file_id,
+                body=body)
+
+        def _large_file_json(self, file_id, large_file):
+            result = {}
+            result['accountId'] = ACCOUNT_ID
+            result['bucketId'] = large_file['bucket'].bucket_id
+            result['fileId'] = file_id
+            result['fileName'] = large_file['fileName']
+            return result
+
+    return Handler
+
+
+def make_buckets(count, file_count, version_weights, folders, hide_ratio,
+                 seed=0, content_size=None):
+    '''
+    :return: count FakeBuckets named bucket0, bucket1, ...
+    '''
+
+    return [FakeBucket('bucket%d' % i, 'fakebucketid%04d' % i, file_count,
+                       version_weights, folders, hide_ratio, seed + i,
+                       content_size)
+            for i in range(count)]
+
+
+def parse_weights(text):
+    return [float(w) for w in text.split(',')]
+
+
+def add_bucket_arguments(parser):
+    '''
+    Adds the options describing the synthetic buckets to an argparse parser.
+    Shared with benchmark.py.
+    '''
+
+    parser.add_argument('--buckets', type=int, default=1,
+                        help='number of buckets (default: 1)')
+    parser.add_argument('--files', type=int, default=100000,
+                        help='file names per bucket (default: 100000)')
+    parser.add_argument('--version-weights', type=parse_weights,
+                        default='90,7,2,1',
+                        help='relative weights of a file having 1, 2, 3... '
+                             'versions (default: 90,7,2,1)')
+    parser.add_argument('--folders', type=int, default=16,
+                        help='top-level folders, 0 for a flat bucket '
+                             '(default: 16)')
+    parser.add_argument('--hide-ratio', type=float, default=0.02,
+                        help='fraction of files hidden (default: 0.02)')
+    parser.add_argument('--content-size', type=int, default=None,
+                        help='give versions real bodies of up to this many '
+                             'bytes, matching their digests, for --verify '
+                             '(default: none, digests of made-up content)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every response (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of calls failing with 503 '
+                             '(default: 0)')
+    parser.add_argument('--token-lifetime', type=int, default=None,
+                        help='expire the account token after this many '
+                             'calls (default: never)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve synthetic buckets over a local stand-in for the '
+                    'B2 API.')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen on (default: 8000)')
+    add_bucket_arguments(parser)
+    args = parser.parse_args()
+
+    buckets = make_buckets(args.buckets, args.files, args.version_weights,
+                           args.folders, args.hide_ratio,
+                           content_size=args.content_size)
+    server = FakeB2Server(buckets, port=args.port, latency=args.latency,
+                          error_rate=args.error_rate,
+                          token_lifetime=args.token_lifetime)
+
+    print('Serving %d bucket(s) with %d versions on %s' %
+          (len(buckets), sum(b.version_count() for b in buckets), server.url))
+    print("Set authUrl : '%s' in config.yaml to use it." % server.url)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
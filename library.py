@@ -34,193 +34,625 @@ from __future__ import print_function
 
 # Python Imports
 
-import subprocess
+import gzip
+import hashlib
 import json
 import os
+import queue
+import random
 import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from operator import itemgetter
 
 # Tools Imports
 
 import requests
-from io import BytesIO
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Project Imports
 
-def ping_test(hostname):
+class _PooledAdapter(HTTPAdapter):
     '''
-    This function pings a host for 30 seconds and averages the response time.
-    :param hostname: hostname to ping
-    :return: the average response time, in ms
+    HTTPAdapter whose connection pools tell the owning HttpTransport every
+    time they have to open a new connection instead of reusing an idle one.
     '''
 
-    cmd = ['ping', '-c', '30', hostname]
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    def __init__(self, transport, **kwargs):
+        self.transport = transport
+        HTTPAdapter.__init__(self, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+
+        transport = self.transport
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                transport._connection_opened()
+                return transport._timed(HTTPConnectionPool._new_conn(self))
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                transport._connection_opened()
+                return transport._timed(HTTPSConnectionPool._new_conn(self))
 
-    p.wait()
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
 
-    output = ''
-    err = ''
+class HttpTransport:
+    '''
+    Keep-alive HTTP transport shared by every request a B2Connector makes.
+    Connections are pooled per host and reused across calls and threads, so
+    paging through a bucket only pays for the TCP and TLS handshake once per
+    connection instead of once per page.
+    '''
+
+    def __init__(self, pool_size=16, max_hosts=10, connect_timeout=10,
+                 read_timeout=120, metrics=None):
+        '''
+        :param pool_size: Number of idle connections kept per host. Should
+        be at least the number of threads making requests.
+        :param max_hosts: Number of hosts to keep a pool for. B2 only uses a
+        handful (api, download and upload pods).
+        :param connect_timeout: Seconds to wait for a connection
+        :param read_timeout: Seconds to wait for the server to send data
+        :param metrics: Metrics every request and new connection is recorded
+        in (optional)
+        '''
 
-    for line in p.stderr:
-        err = err + line
+        self.timeout = (connect_timeout, read_timeout)
+        self.metrics = metrics
 
-    for line in p.stdout:
-        output = output + line
+        self._lock = threading.Lock()
+        self.requests_made = 0
+        self.connections_opened = 0
 
-    output_array = [s.strip() for s in output.splitlines()]
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.session.headers['Connection'] = 'keep-alive'
 
-    # If there's an error - bail.
+        adapter = _PooledAdapter(self, pool_connections=max_hosts,
+                                 pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
-    time = 0
-    status_code = 0
+    def _connection_opened(self):
+        with self._lock:
+            self.connections_opened = self.connections_opened + 1
 
-    if err:
-        time = 0
-        status_code = 100
-    else:
+    def _timed(self, connection):
+        # Times opening the connection, which urllib3 does on its first
+        # request.
 
-        ping_count = 0
-        ping_time = 0.0
-        packet_loss = 0
+        metrics = self.metrics
+        if metrics is None:
+            return connection
 
-        for element in output_array:
-            if element.startswith('64 bytes'):
-                ping_count = ping_count + 1
-                left, right = element[7:].split('time=')
-                ping_time = ping_time + float(right[:-3])
-            elif element.find('packets transmitted') > 0:
+        connect = connection.connect
 
-                # Found the summary line. Note that the format of this line
-                # is different on Mac vs. Linux, of course
+        def timed_connect():
+            start_time = time.time()
+            connect()
+            metrics.observe_connect(time.time() - start_time)
 
-                # Linux:
-                # 30 packets transmitted, 30 received, 0% packet loss, time 29034ms
-                # Mac:
-                # 5 packets transmitted, 5 packets received, 0.0% packet loss
-                # I'm gonna resort to using uname. Ugh.
+        connection.connect = timed_connect
+        return connection
 
-                host_os = os.uname()[0]
+    def request(self, method, url, **kwargs):
+        '''
+        Makes a request through the pool. Takes the same arguments as
+        requests.request. gzip-encoded responses are decoded transparently.
+        '''
 
-                if host_os == 'Darwin':
-                    packet_loss = int(element.split(', ')[2].split('.')[0])
-                if host_os == 'Linux':
-                    packet_loss = int(element.split(', ')[2].split('%')[0])
+        with self._lock:
+            self.requests_made = self.requests_made + 1
+        kwargs.setdefault('timeout', self.timeout)
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
 
-        if ping_count == 0:
-            time = 0
+        start_time = time.time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.metrics.observe(endpoint_name(url), time.time() - start_time,
+                                 900, body_size(kwargs.get('data')))
+            raise
+        # A streamed body hasn't been read yet, and reading it here would
+        # hold all of it in memory.
+
+        if kwargs.get('stream'):
+            received = int(response.headers.get('Content-Length') or 0)
         else:
-            time = ping_time / ping_count
+            received = len(response.content)
+        self.metrics.observe(endpoint_name(url), time.time() - start_time,
+                             response.status_code,
+                             body_size(kwargs.get('data')), received)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def connection_stats(self):
+        '''
+        :return: tuple of (connections opened, connections reused)
+        '''
 
-        status_code = packet_loss
+        with self._lock:
+            opened = self.connections_opened
+            reused = max(self.requests_made - opened, 0)
+        return opened, reused
 
-    return time, status_code
+    def close(self):
+        self.session.close()
 
-def postUrlPyCurl(url, headers={}, data=""):
+def endpoint_name(url):
+    '''
+    :return: the B2 API a url calls, e.g. b2_list_file_versions, also for
+    upload urls which continue past it
     '''
-    Post via PyCurl. There are better performance timing counters in PyCurl
-    then requests. Docs that describe how pycurl work are:
-    https://blog.cloudflare.com/a-question-of-timing/ (not pycurl, but curl)
-    https://netbeez.net/blog/http-transaction-timing-breakdown-with-curl/
-    https://stackoverflow.com/questions/744532/getting-ttfb-time-till-first-byte-for-an-http-request
-    http://pycurl.io/docs/latest/index.html
-    https://stackoverflow.com/questions/31826814/curl-post-request-into-pycurl-code
 
-    :param url: url to fetch.
-    :param http_verb: The http verb. Support GET and POST.
-    :param headers: dictionary of headers to pass with the request (
-    optional)
-    :param params: dictionary of parameters to pass with the request (
-    optional)
-    :param data: data to be posted with the request (optional)
-    :return: HTTP response, formatted as Python dictionary, elapsed time in
-    seconds of the round trip, HTTP status code
+    path = url.split('?', 1)[0]
+    at = path.find('/b2_')
+    if at < 0:
+        return path
+    end = path.find('/', at + 1)
+    return path[at + 1:end] if end >= 0 else path[at + 1:]
+
+def body_size(data):
+    '''
+    :return: size in bytes of a request body given to HttpTransport
+    '''
+
+    if data is None:
+        return 0
+    try:
+        return len(data)
+    except TypeError:
+        return 0
+
+# Status codes worth retrying: request timeout, too many requests, the
+# service being busy or failing, and fetchUrl's own 900 for a failed
+# connection or a 200 response whose body couldn't be decoded.
+
+RETRY_STATUS_CODES = (408, 429, 500, 503, 900)
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    '''
+    Exponential backoff with full jitter.
+    :param attempt: number of attempts that already failed, starting at 0
+    :param base: delay in seconds after the first failure, before jitter
+    :param cap: longest delay in seconds
+    :return: seconds to sleep before the next attempt
     '''
 
-    # Convert headers dictionary to the format
-    # that pycurl requires.
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class AdaptiveLimiter:
+    '''
+    Limits the number of requests in flight, adjusting the limit AIMD style:
+    every successful request grows it by 1/limit (about one more request per
+    round of requests), and a 429 or 503 halves it. Halving happens at most
+    once per decrease_interval so a burst of rejections from requests that
+    were already in flight only counts once.
+    '''
+
+    def __init__(self, maximum, minimum=1, decrease_interval=1.0):
+        '''
+        :param maximum: Highest number of concurrent requests allowed
+        :param minimum: Lowest the limit shrinks to
+        :param decrease_interval: Seconds between two decreases
+        '''
+
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease_interval = decrease_interval
+        self.limit = float(maximum)
+        self.in_flight = 0
+
+        self._condition = threading.Condition()
+        self._last_decrease = 0
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight = self.in_flight + 1
+
+    def release(self, throttled=False):
+        '''
+        :param throttled: True if the service asked us to slow down
+        '''
+
+        with self._condition:
+            self.in_flight = self.in_flight - 1
+            if throttled:
+                now = time.time()
+                if now - self._last_decrease >= self.decrease_interval:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+class RateLimiter:
+    '''
+    Spaces calls out to a steady rate across threads, letting up to burst
+    calls through at once after an idle spell.
+    '''
+
+    def __init__(self, rate, burst=1):
+        '''
+        :param rate: calls per second, None or 0 for no limit
+        :param burst: calls allowed back to back
+        '''
+
+        self.rate = rate
+        self.burst = burst
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        '''
+        Blocks until the next call is allowed.
+        :param amount: how many calls this one counts for, e.g. bytes when
+        the rate is a bandwidth
+        '''
+
+        if not self.rate:
+            return
+
+        with self._lock:
+            now = time.time()
+            self._next = max(self._next, now - (self.burst - 1) / self.rate)
+            delay = self._next - now
+            self._next = self._next + float(amount) / self.rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+# Upload urls are good for 24 hours. Pooled ones are dropped a little
+# earlier so an upload doesn't start on one about to expire.
+
+UPLOAD_URL_LIFETIME = 23 * 60 * 60
+
+class UploadTargetPool:
+    '''
+    Upload urls and their authorization tokens, kept for reuse. B2 only
+    takes one upload at a time on each url, so an upload checks one out
+    with acquire, which gives each thread its own, and hands it back with
+    release once the upload went through. A url that failed (401, 503, ...)
+    is simply not handed back, and the next upload fetches a new one.
+    '''
+
+    def __init__(self, fetch, lifetime=UPLOAD_URL_LIFETIME):
+        '''
+        :param fetch: returns a new (upload url, authorization token)
+        :param lifetime: seconds a url is reused for
+        '''
+
+        self.fetch_target = fetch
+        self.lifetime = lifetime
+        self.fetches = 0
+
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        '''
+        :return: a new (upload url, authorization token, time fetched), not
+        pooled until it is released
+        '''
 
-    headers_as_array = []
-    for item in headers.items():
-        headers_as_array.append(item[0] + ': ' + item[1])
+        upload_url, token = self.fetch_target()
+        with self._lock:
+            self.fetches = self.fetches + 1
+        return upload_url, token, time.time()
 
+    def acquire(self):
+        '''
+        :return: an idle (upload url, authorization token, time fetched), or
+        a new one
+        '''
+
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                target = self._idle.pop()
+                if now - target[2] < self.lifetime:
+                    return target
+        return self.fetch()
+
+    def release(self, target):
+        '''
+        Hands back a url an upload succeeded on.
+        '''
+
+        with self._lock:
+            self._idle.append(target)
+
+_PREFETCH_END = object()
+
+def prefetch(iterable, depth=1):
+    '''
+    Iterates over iterable on a background thread, keeping up to depth items
+    ready ahead of the caller in a bounded queue; the thread waits while the
+    queue is full. Items come out in order. An exception raised by iterable
+    (SystemExit included) is raised in the caller when it gets that far.
+    Stopping early, or closing the generator, stops the thread at its next
+    item.
+    :param iterable: iterable to run ahead on
+    :param depth: number of items to keep ready, 0 to iterate in the caller
+    :return: generator of the items of iterable
+    '''
+
+    if depth < 1:
+        for item in iterable:
+            yield item
+        return
+
+    items = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(entry):
+        while not stopped.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_PREFETCH_END, None))
+        except BaseException as e:
+            put((_PREFETCH_END, e))
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if item is _PREFETCH_END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+def write_file_atomically(path, data):
+    '''
+    Writes data to a temporary file in the same directory which then
+    replaces path, so a crash mid-write leaves the previous file intact. The
+    file is only readable by its owner.
+    :param path: file name
+    :param data: bytes to write
+    :return: None
+    '''
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
     try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def save_checkpoint(path, state):
+    '''
+    Atomically writes a checkpoint as gzipped JSON.
+    :param path: checkpoint file name
+    :param state: JSON serializable dictionary
+    :return: None
+    '''
+
+    data = json.dumps(state, separators=(',', ':')).encode('utf-8')
+    write_file_atomically(path, gzip.compress(data, compresslevel=1))
+
+def load_checkpoint(path):
+    '''
+    Reads a checkpoint written by save_checkpoint.
+    :param path: checkpoint file name
+    :return: the saved dictionary, or None if there is no checkpoint
+    '''
+
+    if not os.path.exists(path):
+        return None
+
+    with gzip.open(path, 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+# The fields of a b2_list_file_versions entry the scans use. Everything else
+# in the entry (fileInfo, contentType, accountId, ...) is dropped while the
+# page is decoded.
+
+ListEntry = namedtuple('ListEntry', ['fileName', 'fileId', 'action',
+                                     'contentMd5', 'contentSha1',
+                                     'contentLength', 'uploadTimestamp'])
+
+_list_entry_fields = itemgetter(*ListEntry._fields)
+
+
+def _make_list_entry(item):
+    try:
+        return tuple.__new__(ListEntry, _list_entry_fields(item))
+    except KeyError:
+        # Folder entries may leave out the fields that only make sense for
+        # files.
+        return ListEntry(*[item.get(field) for field in ListEntry._fields])
+
+
+def _list_page_hook(item):
+    if 'action' in item:
+        return _make_list_entry(item)
+    if 'files' in item:
+        return item
+    return None
 
-        buffer = BytesIO()
+_list_page_decoder = json.JSONDecoder(object_hook=_list_page_hook)
 
-        c = pycurl.Curl()
-        c.setopt(pycurl.URL, url)
-        c.setopt(pycurl.POST, 1)
-        c.setopt(pycurl.POSTFIELDS, data)
-        c.setopt(c.HTTPHEADER, headers_as_array)
-        c.setopt(c.WRITEDATA, buffer)
 
-        content = c.perform()  # execute
+def decode_list_page(body):
+    '''
+    Decodes a successful b2_list_file_versions response, keeping only the
+    ListEntry fields of each entry. With orjson installed the page is parsed
+    by it, which is faster. Otherwise the json module reduces every entry to
+    a ListEntry as soon as it has been parsed, so the page's full dictionaries
+    never exist all at once.
+    :param body: response body, bytes
+    :return: dictionary with "files" (list of ListEntry), "nextFileName" and
+    "nextFileId"
+    '''
+
+    if orjson is not None:
+        page = orjson.loads(body)
+        page['files'] = [_make_list_entry(item) for item in page['files']]
+        return page
 
-        # Body is a byte string.
-        # We have to know the encoding in order to print it to a text file
-        # such as standard output.
-        # http://pycurl.io/docs/latest/quickstart.html
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    return _list_page_decoder.decode(body)
 
-        body = buffer.getvalue().decode('iso-8859-1')
 
-        dns_time = c.getinfo(pycurl.NAMELOOKUP_TIME)  # DNS time
-        conn_time = c.getinfo(pycurl.CONNECT_TIME)  # TCP/IP 3-way handshaking time
-        app_conn_time = c.getinfo(pycurl.APPCONNECT_TIME)
-        pretransfer_time = c.getinfo(pycurl.PRETRANSFER_TIME)
-        starttransfer_time = c.getinfo(pycurl.STARTTRANSFER_TIME)  # time-to-first-byte time
-        total_time = c.getinfo(pycurl.TOTAL_TIME)  # last requst time
-        status_code = c.getinfo((pycurl.RESPONSE_CODE)) # status code
+class HashingReader:
+    '''
+    Request body that reads a file as it is sent, hashing it on the way, and
+    ends with the hex sha1 of what came before. B2 takes that with
+    X-Bz-Content-Sha1: hex_digits_at_end, so a file is uploaded in one pass
+    without holding it in memory.
+    '''
 
-        c.close()
+    def __init__(self, stream, size):
+        '''
+        :param stream: binary file object, at its start
+        :param size: number of bytes to send from it
+        '''
 
-        data = {}
-        data['dns_time']           = dns_time
-        data['conn_time']          = conn_time
-        data['app_conn_time']      = app_conn_time
-        data['pretransfer_time']   = pretransfer_time
-        data['starttransfer_time'] = starttransfer_time
-        data['total_time']         = total_time
-        data['status_code']        = status_code
+        self.stream = stream
+        self.size = size
+        self.seek(0)
 
-        result = json.loads(body)
-        return result, data
+    def __len__(self):
+        return self.size + 40
 
+    def seek(self, offset, whence=0):
+        '''
+        Rewinds to the start, so a failed upload can be sent again.
         '''
-        # TODO: Check response status. If auth token fails, go retrieve
 
+        if offset != 0 or whence != 0:
+            raise ValueError('HashingReader can only seek to its start')
+        self.stream.seek(0)
+        self._remaining = self.size
+        self._sha1 = hashlib.sha1()
+        self._trailer = None
+
+    def read(self, size=-1):
+        if self._remaining:
+            if size < 0 or size > self._remaining:
+                size = self._remaining
+            block = self.stream.read(size)
+            if not block:
+                raise IOError('File shrank while it was being uploaded')
+            self._remaining = self._remaining - len(block)
+            self._sha1.update(block)
+            return block
+
+        if self._trailer is None:
+            self._trailer = self._sha1.hexdigest().encode('ascii')
+        block = self._trailer[:size] if size >= 0 else self._trailer
+        self._trailer = self._trailer[len(block):]
+        return block
+
+def postData(url, headers, data, transport=None):
+    '''
+    Posts a raw body, as b2_upload_file and b2_upload_part take, and decodes
+    the JSON response. Like fetchUrl, a failed connection is status 900.
+    :param url: upload url
+    :param headers: dictionary of headers to pass with the request
+    :param data: bytes, a memoryview or a file-like object with a length,
+    such as a HashingReader. It is streamed, not copied.
+    :param transport: HttpTransport to send the request through (optional)
+    :return: HTTP response, formatted as Python dictionary, elapsed time in
+    seconds of the round trip, HTTP status code
+    '''
+
+    http = transport if transport is not None else requests
+
+    try:
+        response = http.post(url=url, headers=headers, data=data)
         result = json.loads(response.content)
-        return result, response.elapsed.total_seconds(),\
+        return result, response.elapsed.total_seconds(), \
                response.status_code
-        '''
     except ValueError as e:
-        print ('JSON decoding failed.', file=sys.stderr)
-        print (url, file=sys.stderr)
-        print ('status code: ' + str(data['status_code']), file=sys.stderr)
-        print ('response content: ' + body, file=sys.stderr)
-        print (e, file=sys.stderr)
-
-        result = json.loads('[]')
-        return result, data
-
-    except pycurl.error as e:
+        print('JSON decoding failed.', file=sys.stderr)
+        print(url, file=sys.stderr)
+        print('status code: ' + str(response.status_code), file=sys.stderr)
+        print(e, file=sys.stderr)
+        return {}, response.elapsed.total_seconds(), response.status_code
+    except (requests.exceptions.RequestException, IOError) as e:
         print('HTTP POST Request failed', file=sys.stderr)
         print(url, file=sys.stderr)
         print(e, file=sys.stderr)
-        result = json.loads('[]')
+        return {}, 0, 900
 
-        nulldata = {}
+def _decode_response(url, response, decoder):
+    '''
+    Decodes a response body for fetchUrl. A body that can't be decoded
+    gives no result, and a 200 one the status 900 of a failed connection,
+    so it is retried rather than taken for an empty answer.
+    :param decoder: function decoding the body of a 200 response, or None
+    for json.loads
+    :return: result, HTTP status code
+    '''
 
-        nulldata['dns_time'] = -1
-        nulldata['conn_time'] = -1
-        nulldata['app_conn_time'] = -1
-        nulldata['pretransfer_time'] = -1
-        nulldata['starttransfer_time'] = -1
-        nulldata['total_time'] = -1
-        nulldata['status_code'] = -1
+    try:
+        if decoder is not None and response.status_code == 200:
+            return decoder(response.content), response.status_code
+        return json.loads(response.content), response.status_code
+    except ValueError as e:
+        print('JSON decoding failed.', file=sys.stderr)
+        print(url, file=sys.stderr)
+        print('status code: ' + str(response.status_code), file=sys.stderr)
+        print(response.content[:1000], file=sys.stderr)
+        print(e, file=sys.stderr)
 
-        return result, nulldata
+        if response.status_code == 200:
+            return None, 900
+        return None, response.status_code
 
-def fetchUrl(url, http_verb, headers={}, params={}, data=""):
+def fetchUrl(url, http_verb, headers={}, params={}, data="", transport=None,
+             decoder=None):
     '''
     Fetch URL. If the connection fails, it return a status 900 that will find
     it's way back to appengine. This is useful for debugging purposes.
@@ -231,23 +663,26 @@ def fetchUrl(url, http_verb, headers={}, params={}, data=""):
     :param params: dictionary of parameters to pass with the request (
     optional)
     :param data: data to be posted with the request (optional)
+    :param transport: HttpTransport to send the request through (optional).
+    Without one, every call opens a new connection.
+    :param decoder: function decoding the body of a 200 response, instead
+    of json.loads (optional). Error responses are always decoded with
+    json.loads.
     :return: HTTP response, formatted as Python dictionary, elapsed time in
     seconds of the round trip, HTTP status code
     '''
 
+    http = transport if transport is not None else requests
+
     if http_verb == 'GET':
         try:
-            response = requests.get(
+            response = http.get(
                 url=url,
                 params=params,
                 headers=headers,
             )
-            result = json.loads(response.content)
-            return result, response.elapsed.total_seconds(), \
-                   response.status_code
-
-            # TODO: Check response status. If auth token fails, go retrieve
-            # a new one and try this fetch again.
+            result, status_code = _decode_response(url, response, None)
+            return result, response.elapsed.total_seconds(), status_code
 
         except requests.exceptions.RequestException as e:
             print('HTTP GET Request failed', file=sys.stderr)
@@ -259,27 +694,14 @@ def fetchUrl(url, http_verb, headers={}, params={}, data=""):
 
     elif http_verb == 'POST':
         try:
-            response = requests.post(
+            response = http.post(
                 url=url,
                 headers=headers,
                 data=json.dumps(data)
             )
 
-            # TODO: Check response status. If auth token fails, go retrieve
-
-            result = json.loads(response.content)
-            return result, response.elapsed.total_seconds(),\
-                   response.status_code
-        except ValueError as e:
-            print ('JSON decoding failed.', file=sys.stderr)
-            print (url, file=sys.stderr)
-            print ('status code: ' + str(response.status_code), file=sys.stderr)
-            print (response.content, file=sys.stderr)
-            print (e, file=sys.stderr)
-
-            result = json.loads('[]')
-            return result, response.elapsed.total_seconds(),\
-                   response.status_code
+            result, status_code = _decode_response(url, response, decoder)
+            return result, response.elapsed.total_seconds(), status_code
 
         except requests.exceptions.RequestException as e:
             print('HTTP POST Request failed', file=sys.stderr)
@@ -291,7 +713,7 @@ def fetchUrl(url, http_verb, headers={}, params={}, data=""):
 
     elif http_verb == 'PUT':
         try:
-            response = requests.put(
+            response = http.put(
                 url=url,
                 headers=headers,
                 data=data
@@ -314,7 +736,7 @@ def fetchUrl(url, http_verb, headers={}, params={}, data=""):
 
     elif http_verb == 'DELETE':
         try:
-            response = requests.delete(
+            response = http.delete(
                 url=url,
                 headers=headers,
             )
@@ -0,0 +1,314 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import json
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+# Every HTTP request B2Connector makes goes through HttpTransport, which
+# records it here: one histogram of round trip times, status code counts and
+# bytes per B2 endpoint. The scans add the pages and versions they listed.
+# Recording is a lock and a few additions per request, which is nothing next
+# to a request, and the listing loop only counts once per page.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+
+
+class Histogram:
+    '''
+    Counts observations into fixed buckets, Prometheus style: a value goes
+    in the first bucket whose upper bound is at least the value.
+    '''
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count = self.count + 1
+        self.sum = self.sum + value
+
+    def cumulative(self):
+        '''
+        :return: list of (upper bound, observations at or below it), ending
+        with '+Inf'
+        '''
+
+        buckets = []
+        total = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            total = total + count
+            buckets.append((bound, total))
+        return buckets
+
+    def quantile(self, q):
+        '''
+        :return: upper bound of the bucket the q quantile falls in, None
+        without observations
+        '''
+
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+
+
+class EndpointStats:
+    '''
+    What Metrics keeps for one B2 endpoint.
+    '''
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.status_codes = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class Metrics:
+    '''
+    Thread safe counters for a run. See the comment at the top of the
+    module.
+    '''
+
+    def __init__(self):
+        self.started = time.time()
+        self.endpoints = {}
+        self.counters = {}
+        self.connect_latency = Histogram()
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, seconds, status_code, bytes_sent=0,
+                bytes_received=0):
+        '''
+        Records one request.
+        :param endpoint: B2 API name, e.g. b2_list_file_versions
+        :param seconds: round trip time, including reading the response
+        :param status_code: HTTP status code, 900 for a failed connection
+        :param bytes_sent: size of the request body
+        :param bytes_received: size of the response body
+        '''
+
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.latency.observe(seconds)
+            stats.status_codes[status_code] = \
+                stats.status_codes.get(status_code, 0) + 1
+            stats.bytes_sent = stats.bytes_sent + bytes_sent
+            stats.bytes_received = stats.bytes_received + bytes_received
+
+    def observe_connect(self, seconds):
+        '''
+        Records the time a new connection took to open, DNS, TCP and TLS
+        included.
+        '''
+
+        with self._lock:
+            self.connect_latency.observe(seconds)
+
+    def count(self, name, amount=1):
+        '''
+        Adds to a counter, e.g. "pages" or "versions".
+        '''
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        '''
+        :return: JSON serializable dictionary of everything recorded, with
+        the rates per second of the counters
+        '''
+
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+
+            endpoints = {}
+            for name, stats in sorted(self.endpoints.items()):
+                endpoint = {}
+                endpoint['requests'] = stats.latency.count
+                endpoint['seconds'] = stats.latency.sum
+                endpoint['statusCodes'] = dict(
+                    (str(code), count)
+                    for code, count in sorted(stats.status_codes.items()))
+                endpoint['bytesSent'] = stats.bytes_sent
+                endpoint['bytesReceived'] = stats.bytes_received
+                endpoint['p50Seconds'] = stats.latency.quantile(0.5)
+                endpoint['p99Seconds'] = stats.latency.quantile(0.99)
+                endpoint['latencyBuckets'] = [
+                    [bound, total]
+                    for bound, total in stats.latency.cumulative()]
+                endpoints[name] = endpoint
+
+            counters = {}
+            for name, value in sorted(self.counters.items()):
+                counters[name] = value
+                counters[name + 'PerSecond'] = value / elapsed
+
+            snapshot = {}
+            snapshot['elapsedSeconds'] = elapsed
+            snapshot['endpoints'] = endpoints
+            snapshot['counters'] = counters
+            snapshot['connections'] = self.connect_latency.count
+            snapshot['connectSeconds'] = self.connect_latency.sum
+        return snapshot
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        '''
+        :return: everything recorded in the Prometheus text format
+        '''
+
+        lines = []
+
+        def histogram(name, help_text, histograms):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s histogram' % name)
+            for labels, h in histograms:
+                prefix = labels + ',' if labels else ''
+                for bound, total in h.cumulative():
+                    lines.append('%s_bucket{%sle="%s"} %d' %
+                                 (name, prefix, bound, total))
+                suffix = '{' + labels + '}' if labels else ''
+                lines.append('%s_sum%s %r' % (name, suffix, h.sum))
+                lines.append('%s_count%s %d' % (name, suffix, h.count))
+
+        with self._lock:
+            elapsed = time.time() - self.started
+            endpoints = sorted(self.endpoints.items())
+
+            histogram('b2_request_duration_seconds',
+                      'Round trip time of B2 API requests.',
+                      [('endpoint="%s"' % name, stats.latency)
+                       for name, stats in endpoints])
+
+            lines.append('# HELP b2_requests_total B2 API requests by '
+                         'status code (900: connection failed).')
+            lines.append('# TYPE b2_requests_total counter')
+            for name, stats in endpoints:
+                for code, count in sorted(stats.status_codes.items()):
+                    lines.append('b2_requests_total{endpoint="%s",code="%s"} '
+                                 '%d' % (name, code, count))
+
+            lines.append('# HELP b2_request_bytes_total Request and response '
+                         'body bytes.')
+            lines.append('# TYPE b2_request_bytes_total counter')
+            for name, stats in endpoints:
+                lines.append('b2_request_bytes_total{endpoint="%s",'
+                             'direction="sent"} %d' % (name, stats.bytes_sent))
+                lines.append('b2_request_bytes_total{endpoint="%s",'
+                             'direction="received"} %d' %
+                             (name, stats.bytes_received))
+
+            histogram('b2_connect_duration_seconds',
+                      'Time to open a connection, DNS, TCP and TLS included.',
+                      [('', self.connect_latency)])
+
+            for name, value in sorted(self.counters.items()):
+                lines.append('# TYPE b2_%s_total counter' % name)
+                lines.append('b2_%s_total %d' % (name, value))
+
+            lines.append('# TYPE b2_run_seconds gauge')
+            lines.append('b2_run_seconds %r' % elapsed)
+
+        return '\n'.join(lines) + '\n'
+
+    def progress_line(self):
+        '''
+        :return: one line summing up the run so far
+        '''
+
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            requests = 0
+            errors = 0
+            for stats in self.endpoints.values():
+                requests = requests + stats.latency.count
+                for code, count in stats.status_codes.items():
+                    if code != 200:
+                        errors = errors + count
+            pages = self.counters.get('pages', 0)
+            versions = self.counters.get('versions', 0)
+
+        return '%ds: %d pages (%.1f/s), %d versions (%d/s), %d requests, ' \
+               '%d failed' % (elapsed, pages, pages / elapsed, versions,
+                              versions / elapsed, requests, errors)
+
+
+class ProgressReporter:
+    '''
+    Rewrites a progress line on stderr every interval seconds while a run
+    is going, from a background thread.
+    '''
+
+    def __init__(self, metrics, interval=1.0, stream=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.stream.write('\r' + self.metrics.progress_line() + '\033[K')
+            self.stream.flush()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Stops updating and leaves the final line on screen.
+        '''
+
+        self._stopped.set()
+        self._thread.join()
+        self.stream.write('\r' + self.metrics.progress_line() + '\033[K\n')
+        self.stream.flush()
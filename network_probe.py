@@ -0,0 +1,154 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import math
+import socket
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# Probes B2 endpoints concurrently, without ICMP (which B2 doesn't promise
+# to answer and which needs a ping binary) and within a deadline:
+#
+#   * "tcp": the time to open a TCP connection to the endpoint's port,
+#     a fresh connection for each sample.
+#   * "http": the time to the first byte of a HEAD request's response,
+#     through the connector's pooled transport, so after the first sample
+#     the connection is reused and this is the request round trip.
+#
+# Every endpoint and probe kind is sampled on its own thread, samples one
+# after the other, until it has enough samples or the deadline passes.
+
+ProbeStats = namedtuple('ProbeStats', ['url', 'probe', 'samples', 'failures',
+                                       'min', 'avg', 'p99'])
+
+
+def _percentile(sorted_values, fraction):
+    # Nearest rank.
+
+    rank = max(int(math.ceil(fraction * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(url, probe, samples, failures):
+    '''
+    :param samples: seconds each successful probe took
+    :param failures: number of probes that failed or timed out
+    :return: ProbeStats, with None for the times if nothing succeeded
+    '''
+
+    if not samples:
+        return ProbeStats(url, probe, 0, failures, None, None, None)
+    samples = sorted(samples)
+    return ProbeStats(url, probe, len(samples), failures, samples[0],
+                      sum(samples) / len(samples), _percentile(samples, 0.99))
+
+
+def tcp_connect_time(host, port, timeout):
+    '''
+    :return: seconds it took to open a TCP connection, DNS lookup included
+    '''
+
+    start_time = time.time()
+    connection = socket.create_connection((host, port), timeout=timeout)
+    elapsed = time.time() - start_time
+    connection.close()
+    return elapsed
+
+
+def http_first_byte_time(transport, url, timeout):
+    '''
+    :return: seconds from sending a HEAD request to its response headers
+    '''
+
+    response = transport.request('HEAD', url, timeout=timeout,
+                                 allow_redirects=False)
+    return response.elapsed.total_seconds()
+
+
+def _probe(url, probe, transport, sample_count, deadline):
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+
+    samples = []
+    failures = 0
+    while len(samples) + failures < sample_count:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            if probe == 'tcp':
+                samples.append(tcp_connect_time(parsed.hostname, port,
+                                                remaining))
+            else:
+                samples.append(http_first_byte_time(transport, url,
+                                                    remaining))
+        except Exception:
+            failures = failures + 1
+    return summarize(url, probe, samples, failures)
+
+
+def probe_endpoints(urls, transport, sample_count=10, deadline=5.0):
+    '''
+    Probes every url with both probes at the same time.
+    :param urls: endpoint urls, e.g. the connector's apiUrl, downloadUrl
+    and an upload url
+    :param transport: HttpTransport for the http probe
+    :param sample_count: samples per endpoint and probe
+    :param deadline: seconds after which no more probes are started; each
+    probe also times out then
+    :return: list of ProbeStats, in the order of urls, tcp before http
+    '''
+
+    deadline = time.time() + deadline
+    jobs = [(url, probe) for url in urls for probe in ('tcp', 'http')]
+    with ThreadPoolExecutor(max_workers=len(jobs) or 1) as executor:
+        futures = [executor.submit(_probe, url, probe, transport,
+                                   sample_count, deadline)
+                   for url, probe in jobs]
+        return [future.result() for future in futures]
+
+
+def slow_endpoints(stats, threshold=0.5):
+    '''
+    :param stats: ProbeStats from probe_endpoints
+    :param threshold: p99 in seconds above which an endpoint counts as slow
+    :return: the ProbeStats that are slow or had failures
+    '''
+
+    return [s for s in stats
+            if s.failures or s.p99 is None or s.p99 > threshold]
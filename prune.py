@@ -0,0 +1,200 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import json
+import os
+import threading
+
+# Project Imports
+
+from duplicates import content_key
+
+# A prune keeps the newest versions of every file and deletes older ones
+# picked by a policy. Only uploads and hide markers are deleted; unfinished
+# large files ("start") need b2_cancel_large_file instead.
+
+DELETABLE_ACTIONS = ('upload', 'hide')
+
+
+def select_keep_newest(versions, keep=1):
+    '''
+    Deletes every version older than the newest keep uploads. Hide markers
+    don't count towards keep, so a hidden file keeps its hide marker and
+    the uploads it can still be restored from.
+    :param versions: ListEntry of one file, newest first
+    :param keep: number of newest uploads to keep
+    :return: list of the ListEntry to delete
+    '''
+
+    selected = []
+    uploads = 0
+    for version in versions:
+        if uploads >= keep:
+            if version.action in DELETABLE_ACTIONS:
+                selected.append(version)
+        elif version.action == 'upload':
+            uploads = uploads + 1
+    return selected
+
+
+def select_identical(versions, keep=1):
+    '''
+    Deletes the versions older than the newest keep ones that have the same
+    content as the newest version: same length and sha1, or md5 for large
+    files. Nothing is deleted when the newest version is a hide marker.
+    :param versions: ListEntry of one file, newest first
+    :param keep: number of newest versions to keep whatever their content
+    :return: list of the ListEntry to delete
+    '''
+
+    newest = versions[0]
+    if newest.action != 'upload':
+        return []
+    key = content_key(newest.contentMd5, newest.contentSha1)
+    if key is None:
+        return []
+
+    return [version for version in versions[keep:]
+            if version.action == 'upload' and
+            version.contentLength == newest.contentLength and
+            content_key(version.contentMd5, version.contentSha1) == key]
+
+
+PRUNE_POLICIES = {}
+PRUNE_POLICIES['identical'] = select_identical
+PRUNE_POLICIES['keep-newest'] = select_keep_newest
+
+
+class PruneJournal:
+    '''
+    Tab separated log of a prune, so an interrupted one can carry on without
+    listing the bucket again. B2 doesn't allow control characters in file
+    names, so tabs can't appear in them. The lines are:
+
+        scope     <JSON of the bucket, policy and prefixes>
+        plan      <fileId> <contentLength> <fileName>   (one per version)
+        planned   <number of plan lines>
+        deleted   <fileId>                              (as deletions finish)
+
+    Deletions only start once the "planned" line is on disk.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: journal file name
+        '''
+
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        '''
+        Reads the journal of an earlier prune.
+        :return: the scope it was started with, the list of planned (file
+        name, file id, content length) and the set of file ids already
+        deleted, or None if there is no complete plan to continue
+        '''
+
+        if not os.path.exists(self.path):
+            return None
+
+        scope = None
+        plan = []
+        deleted = set()
+        planned = False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] == 'scope':
+                    scope = json.loads(fields[1])
+                elif fields[0] == 'plan' and len(fields) == 4:
+                    plan.append((fields[3], fields[1], int(fields[2])))
+                elif fields[0] == 'planned':
+                    planned = True
+                elif fields[0] == 'deleted' and len(fields) == 2:
+                    deleted.add(fields[1])
+
+        if not planned:
+            return None
+        return scope, plan, deleted
+
+    def start(self, scope, plan):
+        '''
+        Starts a new journal with the versions a prune is going to delete.
+        :param scope: JSON serializable dictionary describing the prune
+        :param plan: list of (file name, file id, content length)
+        :return: None
+        '''
+
+        lines = ['scope\t' + json.dumps(scope, sort_keys=True) + '\n']
+        for file_name, file_id, length in plan:
+            lines.append('plan\t%s\t%d\t%s\n' % (file_id, length, file_name))
+        lines.append('planned\t%d\n' % len(plan))
+
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def resume(self):
+        '''
+        Reopens a journal that load read, to record more deletions.
+        :return: None
+        '''
+
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def record_deleted(self, file_id):
+        '''
+        Records a finished deletion. Thread safe. The line is flushed to the
+        OS right away, so it survives the process being killed.
+        :param file_id: id of the deleted version
+        :return: None
+        '''
+
+        with self._lock:
+            self._file.write('deleted\t' + file_id + '\n')
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
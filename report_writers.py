@@ -0,0 +1,417 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import csv
+import io
+import json
+import os
+import struct
+import sys
+
+# Project Imports
+
+from version_store import MD5_PRESENT
+from version_store import SHA1_PRESENT
+from version_store import pack_digests
+from version_store import unpack_digests
+
+# Writers collect output in memory and hand it to the underlying stream in
+# chunks of about this many characters (or bytes), instead of one write per
+# line.
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+
+class ReportWriter:
+    '''
+    Base class for the version report writers. A report is written as:
+    write_header(), then write_group() for every file with more than one
+    version in file name order, then write_totals(). Groups are written as
+    soon as the scan completes them.
+    '''
+
+    binary = False
+
+    def __init__(self, stream, buffer_size=DEFAULT_BUFFER_SIZE,
+                 continued=False):
+        '''
+        :param stream: file object to write to. Text writers need a text
+        stream, binary writers a binary one.
+        :param buffer_size: how much output to collect before writing it
+        :param continued: the stream already holds the start of this report,
+        from a run that is being resumed
+        '''
+
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.continued = continued
+        self.bucket_name = None
+        self._chunks = []
+        self._buffered = 0
+
+    def _write(self, data):
+        self._chunks.append(data)
+        self._buffered = self._buffered + len(data)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes everything collected so far to the stream and flushes it.
+        '''
+
+        if self._chunks:
+            empty = b'' if self.binary else ''
+            self.stream.write(empty.join(self._chunks))
+            self._chunks = []
+            self._buffered = 0
+        self.stream.flush()
+
+    def close(self):
+        '''
+        Flushes the report, and closes the stream unless it is stdout.
+        '''
+
+        self.flush()
+        if self.stream not in (sys.stdout, getattr(sys.stdout, 'buffer', None)):
+            self.stream.close()
+
+    def write_header(self, bucket_name=None):
+        '''
+        :param bucket_name: name of the bucket the report is for, when
+        reporting on several buckets (optional)
+        '''
+
+        self.bucket_name = bucket_name
+
+    def write_group(self, file_name, versions):
+        '''
+        :param file_name: file name
+        :param versions: list of fileinfo dictionaries, newest first
+        '''
+
+        raise NotImplementedError
+
+    def write_totals(self, files_with_versions_count, total_files,
+                     total_file_versions):
+        raise NotImplementedError
+
+
+class TextReportWriter(ReportWriter):
+    '''
+    The original human-readable report.
+    '''
+
+    def write_header(self, bucket_name=None):
+        ReportWriter.write_header(self, bucket_name)
+        if bucket_name is not None:
+            self._write('Bucket: ' + bucket_name + '\n')
+        self._write('Files where more than one version exists: \n'
+                    '\tmd5, uploadtimestamp, fileId for each object\n')
+
+    def write_group(self, file_name, versions):
+        lines = ['filename: ' + file_name]
+
+        # If there are two file versions, spit out the delta in
+        # upload timestamps, in seconds to make it easy to compare.
+
+        if (len(versions) == 2):
+            diff_ms = versions[0]['uploadtimestamp'] - \
+                versions[1]['uploadtimestamp']
+
+            if (versions[0]['md5'] == versions[1]['md5']):
+                md5match = 'md5 match'
+            else:
+                md5match = 'md5 does not match'
+
+            lines.append('Two versions, %s, uploaded %s seconds apart' %
+                         (md5match, int(diff_ms)/1000))
+
+        for item in versions:
+            lines.append('\tmd5: %s, fileId: %s, upload timestamp: %s' %
+                         (item['md5'], item['fileId'],
+                          item['uploadtimestamp']))
+
+        lines.append('')
+        self._write('\n'.join(lines))
+
+    def write_totals(self, files_with_versions_count, total_files,
+                     total_file_versions):
+        self._write('\nFound files with > 1 version count:  %d\n'
+                    'Total files in bucket:  %d\n'
+                    'Total file versions in bucket:  %d\n' %
+                    (files_with_versions_count, total_files,
+                     total_file_versions))
+        if self.bucket_name is not None:
+            self._write('\n')
+        self.flush()
+
+
+class JsonLinesReportWriter(ReportWriter):
+    '''
+    One JSON object per line: a "file" record for every file with more than
+    one version, then a single "totals" record.
+    '''
+
+    def write_group(self, file_name, versions):
+        record = {}
+        record['type'] = 'file'
+        record['bucketName'] = self.bucket_name
+        record['fileName'] = file_name
+        record['versions'] = [_version_record(v) for v in versions]
+        self._write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def write_totals(self, files_with_versions_count, total_files,
+                     total_file_versions):
+        record = {}
+        record['type'] = 'totals'
+        record['bucketName'] = self.bucket_name
+        record['filesWithMultipleVersions'] = files_with_versions_count
+        record['filesWithOneVersion'] = total_files
+        record['fileVersions'] = total_file_versions
+        self._write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.flush()
+
+
+class CsvReportWriter(ReportWriter):
+    '''
+    One CSV row per version of every file with more than one version. The
+    totals don't fit the rows, so they go to stderr in the text format.
+    '''
+
+    COLUMNS = ['bucketName', 'fileName', 'versionCount', 'fileId', 'md5',
+               'sha1', 'uploadTimestamp']
+
+    def __init__(self, stream, buffer_size=DEFAULT_BUFFER_SIZE,
+                 continued=False):
+        ReportWriter.__init__(self, stream, buffer_size, continued)
+        self._rows = io.StringIO()
+        self._csv = csv.writer(self._rows, lineterminator='\n')
+        if not continued:
+            self._csv.writerow(self.COLUMNS)
+            self._take_rows()
+
+    def _take_rows(self):
+        self._write(self._rows.getvalue())
+        self._rows.seek(0)
+        self._rows.truncate()
+
+    def write_group(self, file_name, versions):
+        count = len(versions)
+        self._csv.writerows([self.bucket_name or '', file_name, count,
+                             v['fileId'], v['md5'], v['sha1'],
+                             v['uploadtimestamp']] for v in versions)
+        self._take_rows()
+
+    def write_totals(self, files_with_versions_count, total_files,
+                     total_file_versions):
+        self.flush()
+        if self.bucket_name is not None:
+            print('Bucket: ' + self.bucket_name, file=sys.stderr)
+        print('Found files with > 1 version count: ',
+              str(files_with_versions_count), file=sys.stderr)
+        print('Total files in bucket: ', str(total_files), file=sys.stderr)
+        print('Total file versions in bucket: ', str(total_file_versions),
+              file=sys.stderr)
+
+
+# The binary format is a magic number followed by records, each starting
+# with a one byte type:
+#
+#   'B' bucket:  uint16 length + UTF-8 bucket name
+#   'F' file:    uint16 length + UTF-8 file name, uint32 version count, then
+#                for each version: uint8 flags, 16 byte md5 if flag 1,
+#                20 byte sha1 if flag 2 (flag 4 marks it "unverified:",
+#                flag 8 a sha1 listed as "none"),
+#                int64 upload timestamp, uint16 length + ASCII file id
+#   'T' totals:  three uint64: files with more than one version, files with
+#                one version, file versions
+#
+# The digest flags are the ones version_store.pack_digests returns. All
+# integers are big-endian. Digests are stored as raw bytes, which makes
+# records less than half the size of the JSON ones.
+
+BINARY_MAGIC = b'B2VR\x01'
+
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_I64 = struct.Struct('>q')
+_TOTALS = struct.Struct('>QQQ')
+
+
+class BinaryReportWriter(ReportWriter):
+    '''
+    Compact binary records, see the format description above. Read them
+    back with read_binary_report.
+    '''
+
+    binary = True
+
+    def __init__(self, stream, buffer_size=DEFAULT_BUFFER_SIZE,
+                 continued=False):
+        ReportWriter.__init__(self, stream, buffer_size, continued)
+        if not continued:
+            self._write(BINARY_MAGIC)
+
+    def write_header(self, bucket_name=None):
+        ReportWriter.write_header(self, bucket_name)
+        if bucket_name is not None:
+            self._write(b'B' + _string(bucket_name))
+
+    def write_group(self, file_name, versions):
+        parts = [b'F', _string(file_name), _U32.pack(len(versions))]
+        for v in versions:
+            flags, md5, sha1 = pack_digests(v['md5'], v['sha1'])
+            parts.append(struct.pack('>B', flags))
+            if flags & MD5_PRESENT:
+                parts.append(md5)
+            if flags & SHA1_PRESENT:
+                parts.append(sha1)
+            parts.append(_I64.pack(v['uploadtimestamp']))
+            parts.append(_string(v['fileId']))
+        self._write(b''.join(parts))
+
+    def write_totals(self, files_with_versions_count, total_files,
+                     total_file_versions):
+        self._write(b'T' + _TOTALS.pack(files_with_versions_count,
+                                        total_files, total_file_versions))
+        self.flush()
+
+
+def _version_record(v):
+    record = {}
+    record['fileId'] = v['fileId']
+    record['md5'] = v['md5']
+    record['sha1'] = v['sha1']
+    record['uploadTimestamp'] = v['uploadtimestamp']
+    return record
+
+
+def _string(text):
+    data = text.encode('utf-8')
+    return _U16.pack(len(data)) + data
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated binary report')
+    return data
+
+
+def _read_string(stream):
+    size = _U16.unpack(_read_exactly(stream, 2))[0]
+    return _read_exactly(stream, size).decode('utf-8')
+
+
+def read_binary_report(stream):
+    '''
+    Reads a report written by BinaryReportWriter.
+    :param stream: binary file object
+    :return: generator of ('bucket', name), ('file', file name, versions)
+    and ('totals', files with more than one version, files with one
+    version, file versions) tuples. versions are fileinfo dictionaries.
+    '''
+
+    if stream.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError('Not a binary version report')
+
+    while True:
+        record_type = stream.read(1)
+        if not record_type:
+            return
+
+        if record_type == b'B':
+            yield ('bucket', _read_string(stream))
+        elif record_type == b'T':
+            yield ('totals',) + _TOTALS.unpack(_read_exactly(stream, 24))
+        elif record_type == b'F':
+            file_name = _read_string(stream)
+            count = _U32.unpack(_read_exactly(stream, 4))[0]
+            versions = []
+            for i in range(count):
+                flags = struct.unpack('>B', _read_exactly(stream, 1))[0]
+                md5 = None
+                sha1 = None
+                if flags & MD5_PRESENT:
+                    md5 = _read_exactly(stream, 16)
+                if flags & SHA1_PRESENT:
+                    sha1 = _read_exactly(stream, 20)
+
+                fileinfo = {}
+                fileinfo['md5'], fileinfo['sha1'] = unpack_digests(flags, md5,
+                                                                   sha1)
+                fileinfo['uploadtimestamp'] = _I64.unpack(
+                    _read_exactly(stream, 8))[0]
+                fileinfo['fileId'] = _read_string(stream)
+                versions.append(fileinfo)
+            yield ('file', file_name, versions)
+        else:
+            raise ValueError('Unknown record type in binary report')
+
+
+REPORT_WRITERS = {}
+REPORT_WRITERS['text'] = TextReportWriter
+REPORT_WRITERS['jsonl'] = JsonLinesReportWriter
+REPORT_WRITERS['csv'] = CsvReportWriter
+REPORT_WRITERS['binary'] = BinaryReportWriter
+
+
+def open_report_writer(report_format='text', output=None, append=False):
+    '''
+    Creates a report writer for report_format writing to the file output,
+    or to stdout.
+    :param report_format: one of REPORT_WRITERS
+    :param output: file name (optional)
+    :param append: continue the report already in output, for a resumed
+    streaming scan
+    :return: ReportWriter
+    '''
+
+    writer_class = REPORT_WRITERS[report_format]
+    continued = False
+    if output:
+        continued = append and os.path.exists(output) and \
+            os.path.getsize(output) > 0
+        mode = 'a' if continued else 'w'
+        if writer_class.binary:
+            mode = mode + 'b'
+        stream = open(output, mode)
+    elif writer_class.binary:
+        stream = sys.stdout.buffer
+    else:
+        stream = sys.stdout
+    return writer_class(stream, continued=continued)
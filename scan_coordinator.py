@@ -0,0 +1,393 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import argparse
+import binascii
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from multiprocessing.connection import Listener
+
+# Project Imports
+
+from b2_connector import B2Connector
+from report_writers import TextReportWriter
+
+# Scans a bucket with several worker processes, on this machine or on
+# others, so decoding and counting pages isn't held to one interpreter.
+#
+# The coordinator splits the keyspace into work units, the key ranges of
+# B2Connector._plan_key_ranges, and listens for workers. Each worker has its
+# own B2Connector; it takes a unit, lists it and sends back the partial
+# aggregate (the multi-version files of the range and its counts), then
+# takes the next one. The partial aggregates are merged into the report in
+# keyspace order as they arrive. A unit whose worker reports an error or
+# goes away is handed out again, a few times at most.
+#
+# The protocol is multiprocessing.connection over TCP: pickled tuples,
+# after a challenge with a shared key.
+#
+#   coordinator to worker: ('scan', unit index, key range) or ('stop',)
+#   worker to coordinator: ('done', unit index, partial aggregate) or
+#                          ('failed', unit index, error message)
+
+# Local workers get the key from the environment, so it isn't visible in
+# the process list.
+
+KEY_ENVIRONMENT_VARIABLE = 'B2_COORDINATOR_KEY'
+
+
+def parse_address(text):
+    '''
+    :param text: "host:port"
+    :return: (host, port)
+    '''
+
+    host, port = text.rsplit(':', 1)
+    return host, int(port)
+
+
+class ScanCoordinator:
+    '''
+    Runs a scan on worker processes: local ones it starts itself, and
+    remote ones started with "python scan_coordinator.py --connect
+    HOST:PORT" on other machines with the same config.yaml.
+    '''
+
+    def __init__(self, connector, processes=4, listen=None, max_attempts=3):
+        '''
+        :param connector: An authorized B2Connector, used to plan the work
+        units. Its config file is the one local workers are started with.
+        :param processes: Number of local worker processes
+        :param listen: (host, port) remote workers connect to (optional).
+        Without it, only local workers on 127.0.0.1 can connect. Remote
+        workers need coordinatorKey in config.yaml.
+        :param max_attempts: Times a work unit is handed out before the scan
+        gives up on it
+        '''
+
+        self.connector = connector
+        self.processes = processes
+        self.listen = listen
+        self.max_attempts = max_attempts
+
+        self.key = connector.coordinator_key
+        if self.key is None:
+            self.key = binascii.hexlify(os.urandom(16)).decode('ascii')
+
+        self.units = []
+        self.error = None
+        self.redispatched = 0
+        self.worker_count = 0
+
+        self._condition = threading.Condition()
+        self._pending = []
+        self._attempts = []
+        self._results = {}
+        self._finished = False
+        self._listener = None
+        self._local_workers = []
+        self._restarts_left = 0
+
+    def run(self, prefixes=None, delimiter='', workers=None,
+            shard_strategy='prefix', fan_out=False, writer=None):
+        '''
+        Scans the bucket (or prefixes) and prints the version report.
+        :param workers: Plan work units for this many workers (optional,
+        default the number of local processes)
+        :param writer: ReportWriter (optional, default text to stdout)
+        See B2Connector.output_files_with_multiple_versions for the other
+        parameters.
+        :return: None
+        '''
+
+        writer = writer or TextReportWriter(sys.stdout)
+
+        if self.listen and self.connector.coordinator_key is None:
+            print('Remote workers need coordinatorKey in config.yaml.')
+            sys.exit()
+
+        self._listener = Listener(self.listen or ('127.0.0.1', 0),
+                                  authkey=self.key.encode('utf-8'))
+        accepting = threading.Thread(target=self._accept)
+        accepting.daemon = True
+        accepting.start()
+
+        # The workers start up and authorize while the units are planned. A
+        # local worker that dies is replaced, but not forever.
+
+        self._restarts_left = self.processes * self.max_attempts
+        for i in range(self.processes):
+            self._start_local_worker()
+        if self.listen:
+            print('Waiting for workers on %s:%d' % self._listener.address,
+                  file=sys.stderr)
+
+        try:
+            units = self.connector._plan_key_ranges(
+                prefixes, delimiter, workers or self.processes,
+                shard_strategy, fan_out)
+            with self._condition:
+                self.units = units
+                self._pending = list(range(len(units)))
+                self._attempts = [0] * len(units)
+                self._condition.notify_all()
+
+            self._write_report(writer)
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+            self._listener.close()
+            self._stop_local_workers()
+
+        if self.error:
+            print(self.error)
+            sys.exit()
+
+        print('%d work units on %d workers, %d handed out again' %
+              (len(self.units), self.worker_count, self.redispatched),
+              file=sys.stderr)
+
+    def _write_report(self, writer):
+        # Partial aggregates are written in unit order, which is keyspace
+        # order, as soon as every unit before them is in.
+
+        writer.write_header()
+        files_with_versions_count = 0
+        total_files = 0
+        total_file_versions = 0
+
+        for groups, range_files, range_versions in self._iter_results():
+            for key, versions in groups:
+                files_with_versions_count = files_with_versions_count + 1
+                writer.write_group(key, versions)
+            total_files = total_files + range_files
+            total_file_versions = total_file_versions + range_versions
+
+        if self.error is None:
+            writer.write_totals(files_with_versions_count, total_files,
+                                total_file_versions)
+
+    def _iter_results(self):
+        for index in range(len(self.units)):
+            with self._condition:
+                while index not in self._results and self.error is None:
+                    self._condition.wait(1.0)
+                    self._check_local_workers()
+                if self.error is not None:
+                    return
+                result = self._results.pop(index)
+            yield result
+
+    def _start_local_worker(self):
+        environment = dict(os.environ)
+        environment[KEY_ENVIRONMENT_VARIABLE] = self.key
+        host, port = self._listener.address
+        if host in ('', '0.0.0.0'):
+            host = '127.0.0.1'
+        command = [sys.executable, os.path.abspath(__file__),
+                   '--connect', '%s:%d' % (host, port),
+                   '--config', self.connector.settings_file]
+        self._local_workers.append(subprocess.Popen(command, env=environment,
+                                                    stdout=sys.stderr))
+
+    def _check_local_workers(self):
+        # Called with the condition held. Units a dead worker held have
+        # already been put back by its connection's thread.
+
+        if not self._pending:
+            return
+        for i, worker in enumerate(self._local_workers):
+            if worker.poll() is None:
+                continue
+            if self._restarts_left > 0:
+                self._restarts_left = self._restarts_left - 1
+                self._local_workers.pop(i)
+                self._start_local_worker()
+                return
+        if self.processes and not self.listen and \
+                all(w.poll() is not None for w in self._local_workers):
+            self.error = 'All the scan workers stopped.'
+
+    def _stop_local_workers(self):
+        # Workers exit once told to stop; after an error, there is no point
+        # waiting for the units they are still on.
+
+        if self.error:
+            for worker in self._local_workers:
+                if worker.poll() is None:
+                    worker.kill()
+        deadline = time.time() + 10
+        for worker in self._local_workers:
+            try:
+                worker.wait(max(deadline - time.time(), 0.1))
+            except subprocess.TimeoutExpired:
+                worker.kill()
+                worker.wait()
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+            except AuthenticationError:
+                print('A worker connected with the wrong coordinatorKey.',
+                      file=sys.stderr)
+                continue
+            except (OSError, EOFError):
+                # The listener was closed.
+                return
+
+            with self._condition:
+                self.worker_count = self.worker_count + 1
+            serving = threading.Thread(target=self._serve,
+                                       args=(connection,))
+            serving.daemon = True
+            serving.start()
+
+    def _next_unit(self):
+        '''
+        :return: index of the next unit to hand out, or None once the scan
+        is over
+        '''
+
+        with self._condition:
+            while not self._pending and not self._finished and \
+                    self.error is None:
+                self._condition.wait()
+            if self._finished or self.error is not None:
+                return None
+            return self._pending.pop(0)
+
+    def _serve(self, connection):
+        # One thread per connected worker, handing it one unit at a time.
+
+        try:
+            while True:
+                index = self._next_unit()
+                if index is None:
+                    connection.send(('stop',))
+                    return
+                try:
+                    connection.send(('scan', index, self.units[index]))
+                    reply = connection.recv()
+                except (OSError, EOFError):
+                    self._unit_failed(index, 'the worker went away')
+                    return
+                if reply[0] == 'done':
+                    with self._condition:
+                        self._results[index] = reply[2]
+                        self._condition.notify_all()
+                else:
+                    self._unit_failed(index, reply[2])
+        except (OSError, EOFError):
+            pass
+        finally:
+            connection.close()
+
+    def _unit_failed(self, index, message):
+        with self._condition:
+            self._attempts[index] = self._attempts[index] + 1
+            if self._attempts[index] >= self.max_attempts:
+                self.error = 'Work unit %s failed %d times, last: %s' % (
+                    self.units[index], self._attempts[index], message)
+            else:
+                # Back at the front of the queue, the report is waiting for
+                # it.
+                self.redispatched = self.redispatched + 1
+                self._pending.insert(0, index)
+            self._condition.notify_all()
+
+
+def run_worker(connector, address, key):
+    '''
+    Scans the work units a coordinator hands out until it says stop.
+    :param connector: An authorized B2Connector
+    :param address: (host, port) of the coordinator
+    :param key: coordinatorKey shared with the coordinator
+    :return: None
+    '''
+
+    try:
+        connection = Client(address, authkey=key.encode('utf-8'))
+    except AuthenticationError:
+        print('The coordinator rejected coordinatorKey.')
+        sys.exit()
+    except OSError as e:
+        print('Could not connect to the coordinator: %s' % e)
+        sys.exit()
+
+    try:
+        while True:
+            message = connection.recv()
+            if message[0] == 'stop':
+                return
+            index, key_range = message[1], message[2]
+            try:
+                result = connector._scan_range_streaming(*key_range)
+            except Exception as e:
+                connection.send(('failed', index, repr(e)))
+            else:
+                connection.send(('done', index, result))
+    except EOFError:
+        # The coordinator went away.
+        pass
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Scan work units for a coordinated scan (start.py '
+                    '--processes or --listen).')
+    parser.add_argument('--connect', required=True, metavar='HOST:PORT',
+                        help='address of the coordinator')
+    parser.add_argument('--config', default='config.yaml',
+                        help='config file (default: config.yaml)')
+    args = parser.parse_args()
+
+    connector = B2Connector(args.config)
+    key = os.environ.get(KEY_ENVIRONMENT_VARIABLE) or \
+        connector.coordinator_key
+    if key is None:
+        print('Set coordinatorKey in %s to connect to a coordinator.' %
+              args.config)
+        sys.exit()
+    run_worker(connector, parse_address(args.connect), key)
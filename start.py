@@ -32,9 +32,362 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+from __future__ import print_function
+
+import argparse
+import os
 import sys
+import time
 from b2_connector import B2Connector
+from cassette import PageRecorder
+from cassette import PageReplayer
+from cassette import ReplayMiss
+from async_scanner import AsyncBucketScanner
+from metrics import ProgressReporter
+from scan_coordinator import ScanCoordinator
+from scan_coordinator import parse_address
+from report_writers import REPORT_WRITERS
+from report_writers import open_report_writer
+from version_index import VersionIndex
+
+parser = argparse.ArgumentParser(
+    description='Count the versions of every file in a B2 bucket.')
+parser.add_argument('--workers', type=int, default=1,
+                    help='number of key ranges to list in parallel '
+                         '(default: 1, a serial scan)')
+parser.add_argument('--shard-strategy', choices=['prefix', 'sample'],
+                    default='prefix',
+                    help='how to split the bucket into key ranges when '
+                         '--workers is more than 1 (default: prefix)')
+parser.add_argument('--processes', type=int, default=0,
+                    help='scan on this many worker processes, each with '
+                         'its own interpreter, instead of threads')
+parser.add_argument('--listen', type=parse_address, metavar='HOST:PORT',
+                    help='also hand work units out to workers on other '
+                         'machines, started with scan_coordinator.py '
+                         '--connect HOST:PORT')
+parser.add_argument('--stream', action='store_true',
+                    help='report each file as soon as its versions are '
+                         'listed, keeping memory use flat on large buckets')
+parser.add_argument('--prefix', action='append', dest='prefixes',
+                    help='only scan file names starting with this prefix; '
+                         'may be given more than once')
+parser.add_argument('--delimiter', default='',
+                    help='only scan the files directly under each prefix, '
+                         'not those in deeper "folders"')
+parser.add_argument('--fan-out', action='store_true',
+                    help='scan each first-level folder under each prefix '
+                         'as its own range, in parallel with --workers')
+parser.add_argument('--checkpoint-file',
+                    help='save the progress of a serial scan to this file, '
+                         'to continue it with --resume (default: no '
+                         'checkpoints)')
+parser.add_argument('--checkpoint-interval', type=float, default=30,
+                    help='seconds between checkpoints (default: 30)')
+parser.add_argument('--resume', action='store_true',
+                    help='continue an interrupted serial scan from its '
+                         'checkpoint file')
+parser.add_argument('--all-buckets', action='store_true',
+                    help='scan every bucket in the account concurrently and '
+                         'print one report per bucket')
+parser.add_argument('--max-in-flight', type=int, default=16,
+                    help='maximum concurrent listing requests across all '
+                         'buckets with --all-buckets (default: 16)')
+parser.add_argument('--format', choices=sorted(REPORT_WRITERS),
+                    help='format of the version report: the text report, '
+                         'JSON Lines, CSV rows or compact binary records '
+                         '(default: text)')
+parser.add_argument('--output',
+                    help='write the version report to this file instead of '
+                         'stdout')
+parser.add_argument('--index',
+                    help='SQLite file to keep every version in; each scan '
+                         'updates it and prints what changed since the '
+                         'last one')
+parser.add_argument('--duplicates', action='store_true',
+                    help='report content stored more than once under any '
+                         'file name, with the bytes the extra copies take')
+parser.add_argument('--prune', choices=['identical', 'keep-newest'],
+                    help='delete old versions: "identical" deletes the ones '
+                         'with the same content as the newest version, '
+                         '"keep-newest" all but the newest --keep '
+                         'uploads')
+parser.add_argument('--keep', type=int, default=1,
+                    help='versions of each file --prune never deletes, '
+                         'newest first (default: 1)')
+parser.add_argument('--dry-run', action='store_true',
+                    help='only list the versions --prune would delete')
+parser.add_argument('--journal-file', default='prune.journal',
+                    help='where --prune records its plan and finished '
+                         'deletions, for --resume (default: prune.journal)')
+parser.add_argument('--delete-workers', type=int, default=16,
+                    help='deletions --prune runs in parallel (default: 16)')
+parser.add_argument('--delete-rate', type=float,
+                    help='most deletions --prune starts per second '
+                         '(default: no limit)')
+parser.add_argument('--progress', action='store_true',
+                    help='show pages, versions and requests so far on '
+                         'stderr while running')
+parser.add_argument('--metrics-file',
+                    help='write request latencies, status codes, bytes and '
+                         'listing rates to this file at the end of the run')
+parser.add_argument('--metrics-format', choices=['json', 'prometheus'],
+                    default='json',
+                    help='format of --metrics-file: a JSON snapshot or the '
+                         'Prometheus text format (default: json)')
+parser.add_argument('--probe', action='store_true',
+                    help='measure TCP connect time and time to first byte '
+                         'to the API, download and upload endpoints, and '
+                         'flag slow ones, instead of scanning')
+parser.add_argument('--probe-deadline', type=float, default=5.0,
+                    help='seconds --probe may take (default: 5)')
+parser.add_argument('--estimate', action='store_true',
+                    help='estimate the totals of the report, with '
+                         'confidence intervals, from random samples of the '
+                         'bucket instead of scanning all of it')
+parser.add_argument('--samples', type=int, default=64,
+                    help='random windows --estimate lists; more give '
+                         'narrower intervals (default: 64)')
+parser.add_argument('--stats', action='store_true',
+                    help='print statistics about the versions instead of '
+                         'the report: versions per file name, time between '
+                         'versions, bytes in older versions and hide '
+                         'markers, in total and per folder')
+parser.add_argument('--verify', choices=['multi-version', 'all'],
+                    help='download versions and check them against the '
+                         'digests B2 lists: "multi-version" the versions of '
+                         'files with more than one, "all" every version')
+parser.add_argument('--download-workers', type=int, default=8,
+                    help='versions --verify downloads in parallel '
+                         '(default: 8)')
+parser.add_argument('--range-size', type=float, default=16,
+                    help='MB; --verify downloads larger versions in ranges '
+                         'of this size, several at once, buffering up to '
+                         '--download-workers ranges (default: 16)')
+parser.add_argument('--bandwidth', type=float,
+                    help='most MB per second --verify downloads '
+                         '(default: no limit)')
+parser.add_argument('--uploaded-within', type=float, metavar='HOURS',
+                    help='list the versions in --index uploaded in the last '
+                         'HOURS (under --prefix), without calling B2')
+parser.add_argument('--sql',
+                    help='run this SQL query against --index, without '
+                         'calling B2')
+parser.add_argument('--record', metavar='FILE',
+                    help='write every listing page to FILE, to run again '
+                         'later with --replay')
+parser.add_argument('--replay', metavar='FILE',
+                    help='answer the listing calls from a --record FILE '
+                         'instead of calling B2. Use the same scan options '
+                         'it was recorded with')
+args = parser.parse_args()
+
+if args.resume and not args.prune and (args.workers > 1 or
+                                       args.all_buckets):
+    parser.error('--resume only works with serial single-bucket scans')
+if args.resume and not args.prune and not args.checkpoint_file:
+    parser.error('--resume needs the --checkpoint-file of the scan')
+
+if (args.uploaded_within is not None or args.sql) and not args.index:
+    parser.error('--uploaded-within and --sql need --index')
+if args.index and (args.resume or args.all_buckets):
+    parser.error('--index does not work with --resume or --all-buckets')
+if args.duplicates and (args.index or args.resume or args.all_buckets):
+    parser.error('--duplicates does not work with --index, --resume or '
+                 '--all-buckets')
+if args.prune and (args.index or args.duplicates or args.all_buckets):
+    parser.error('--prune does not work with --index, --duplicates or '
+                 '--all-buckets')
+if args.probe and (args.index or args.prune or args.duplicates or
+                   args.all_buckets):
+    parser.error('--probe does not work with --index, --prune, --duplicates '
+                 'or --all-buckets')
+if args.estimate and (args.index or args.prune or args.duplicates or
+                      args.probe or args.all_buckets or args.resume):
+    parser.error('--estimate does not work with --index, --prune, '
+                 '--duplicates, --probe, --resume or --all-buckets')
+if args.stats and (args.index or args.prune or args.duplicates or
+                   args.probe or args.estimate or args.all_buckets or
+                   args.resume):
+    parser.error('--stats does not work with --index, --prune, '
+                 '--duplicates, --probe, --estimate, --resume or '
+                 '--all-buckets')
+if args.verify and (args.index or args.prune or args.duplicates or
+                    args.probe or args.estimate or args.stats or
+                    args.all_buckets or args.resume):
+    parser.error('--verify does not work with --index, --prune, '
+                 '--duplicates, --probe, --estimate, --stats, --resume or '
+                 '--all-buckets')
+if (args.processes or args.listen) and (args.index or args.prune or
+                                        args.duplicates or args.probe or
+                                        args.estimate or args.stats or
+                                        args.verify or args.all_buckets or
+                                        args.resume):
+    parser.error('--processes and --listen do not work with --index, '
+                 '--prune, --duplicates, --probe, --estimate, --stats, '
+                 '--verify, --resume or --all-buckets')
+if args.record and args.replay:
+    parser.error('--record and --replay do not work together')
+if (args.record or args.replay) and (args.all_buckets or args.processes or
+                                     args.listen):
+    parser.error('--record and --replay do not work with --all-buckets, '
+                 '--processes or --listen')
+if args.replay and (args.prune or args.probe or args.estimate or
+                    args.verify or args.checkpoint_file or args.resume):
+    parser.error('--replay does not work with --prune, --probe, --estimate, '
+                 '--verify, --checkpoint-file or --resume')
+if args.range_size <= 0:
+    parser.error('--range-size has to be positive')
+if (args.format or args.output) and (args.index or args.probe or
+                                     args.estimate or args.prune or
+                                     args.stats or args.verify or
+                                     args.duplicates):
+    parser.error('--format and --output only apply to the version report, '
+                 'not to --index, --probe, --estimate, --prune, --stats, '
+                 '--verify or --duplicates')
+if args.dry_run and not args.prune:
+    parser.error('--dry-run needs --prune')
+
+# Questions about the index are answered from it alone.
+
+if args.uploaded_within is not None:
+    index = VersionIndex(args.index)
+    since_ms = int((time.time() - args.uploaded_within * 3600) * 1000)
+    prefixes = args.prefixes or ['']
+    for prefix in prefixes:
+        for row in index.versions_uploaded_since(since_ms, prefix):
+            print('\t'.join(str(value) for value in row))
+    sys.exit()
+
+if args.sql:
+    columns, rows = VersionIndex(args.index).query(args.sql)
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join(str(value) for value in row))
+    sys.exit()
+
+cassette = None
+if args.record:
+    cassette = PageRecorder(args.record)
+elif args.replay:
+    cassette = PageReplayer(args.replay)
 
 # Instantiate B2 connector
-b2 = B2Connector()
-b2.output_files_with_multiple_versions()
+b2 = B2Connector(cassette=cassette)
+if args.replay:
+    print('Replaying %s, recorded from %s' % (args.replay, b2.bucket_name),
+          file=sys.stderr)
+else:
+    print('Authorized in %.3f seconds%s' %
+          (b2.auth_seconds, ' (cached token)' if b2.auth_from_cache else ''),
+          file=sys.stderr)
+
+progress = ProgressReporter(b2.metrics).start() if args.progress else None
+
+# Only the version report goes through a writer; a resumed streaming scan
+# has already written the start of it.
+writer = None
+if not (args.index or args.probe or args.estimate or args.prune or
+        args.stats or args.verify or args.duplicates):
+    writer = open_report_writer(args.format or 'text', args.output,
+                                append=args.resume and args.stream and
+                                args.checkpoint_file is not None and
+                                os.path.exists(args.checkpoint_file))
+
+try:
+    if args.index:
+        b2.output_version_index_changes(VersionIndex(args.index),
+                                        prefixes=args.prefixes,
+                                        delimiter=args.delimiter,
+                                        workers=args.workers,
+                                        shard_strategy=args.shard_strategy,
+                                        fan_out=args.fan_out)
+    elif args.probe:
+        b2.output_network_probe(deadline=args.probe_deadline)
+    elif args.estimate:
+        b2.output_estimate(samples=args.samples,
+                           prefixes=args.prefixes,
+                           workers=max(args.workers, 8))
+    elif args.prune:
+        b2.prune_versions(policy=args.prune,
+                          keep=args.keep,
+                          prefixes=args.prefixes,
+                          delimiter=args.delimiter,
+                          workers=args.workers,
+                          shard_strategy=args.shard_strategy,
+                          fan_out=args.fan_out,
+                          dry_run=args.dry_run,
+                          journal_file=args.journal_file,
+                          resume=args.resume,
+                          delete_workers=args.delete_workers,
+                          delete_rate=args.delete_rate)
+    elif args.stats:
+        b2.output_version_stats(prefixes=args.prefixes,
+                                delimiter=args.delimiter,
+                                workers=args.workers,
+                                shard_strategy=args.shard_strategy,
+                                fan_out=args.fan_out)
+    elif args.verify:
+        b2.output_verified_versions(selection=args.verify,
+                                    prefixes=args.prefixes,
+                                    delimiter=args.delimiter,
+                                    workers=args.workers,
+                                    shard_strategy=args.shard_strategy,
+                                    fan_out=args.fan_out,
+                                    download_workers=args.download_workers,
+                                    range_size=int(args.range_size * 1000000),
+                                    bandwidth=args.bandwidth * 1000000
+                                    if args.bandwidth else None)
+    elif args.duplicates:
+        b2.output_duplicate_content(prefixes=args.prefixes,
+                                    delimiter=args.delimiter,
+                                    workers=args.workers,
+                                    shard_strategy=args.shard_strategy,
+                                    fan_out=args.fan_out)
+    elif args.processes or args.listen:
+        ScanCoordinator(b2, processes=args.processes, listen=args.listen).run(
+            prefixes=args.prefixes,
+            delimiter=args.delimiter,
+            workers=max(args.workers, args.processes),
+            shard_strategy=args.shard_strategy,
+            fan_out=args.fan_out,
+            writer=writer)
+    elif args.all_buckets:
+        AsyncBucketScanner(b2, max_in_flight=args.max_in_flight).run(
+            writer=writer)
+    else:
+        b2.output_files_with_multiple_versions(
+            workers=args.workers,
+            shard_strategy=args.shard_strategy,
+            stream=args.stream,
+            checkpoint_file=args.checkpoint_file,
+            checkpoint_interval=args.checkpoint_interval,
+            resume=args.resume,
+            prefixes=args.prefixes,
+            delimiter=args.delimiter,
+            fan_out=args.fan_out,
+            writer=writer)
+except ReplayMiss as e:
+    print(e, file=sys.stderr)
+    sys.exit(1)
+
+if writer is not None:
+    writer.close()
+
+if cassette is not None:
+    cassette.close()
+    print('%s %d listing pages' % ('Replayed' if args.replay else 'Recorded',
+                                   cassette.pages), file=sys.stderr)
+
+if progress is not None:
+    progress.stop()
+
+if args.metrics_file:
+    with open(args.metrics_file, 'w') as f:
+        if args.metrics_format == 'prometheus':
+            f.write(b2.metrics.to_prometheus())
+        else:
+            f.write(b2.metrics.to_json() + '\n')
+
+opened, reused = b2.transport.connection_stats()
+print('Connections opened: %d, reused: %d' % (opened, reused), file=sys.stderr)
@@ -0,0 +1,78 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+# Project Imports
+
+from b2_connector import B2Connector
+from fake_b2_server import FakeB2Server
+
+
+class FakeAccount:
+    '''
+    A fake_b2_server running in this process, and a B2Connector authorized
+    against it. Use it as a context manager.
+    '''
+
+    def __init__(self, buckets, **server_options):
+        self.server = FakeB2Server(buckets, **server_options).start()
+        self.directory = tempfile.mkdtemp()
+        self.settings_file = os.path.join(self.directory, 'config.yaml')
+        with open(self.settings_file, 'w') as f:
+            f.write("bucketName: '%s'\n" % buckets[0].name)
+            f.write("keyid: 'key'\n")
+            f.write("appkey: 'secret'\n")
+            f.write("apiVersion: '/b2api/v2/'\n")
+            f.write("authCacheFile: ''\n")
+            f.write("authUrl: '%s'\n" % self.server.url)
+        self.connector = B2Connector(self.settings_file)
+
+    def list_calls(self):
+        return self.server.counts().get('b2_list_file_versions', 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.stop()
+        shutil.rmtree(self.directory)
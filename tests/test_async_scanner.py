@@ -0,0 +1,82 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import io
+import random
+import unittest
+
+# Project Imports
+
+from helpers import FakeAccount
+from async_scanner import AsyncBucketScanner
+from async_scanner import aiohttp
+from fake_b2_server import make_buckets
+from report_writers import TextReportWriter
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AiohttpLimiterTest(unittest.TestCase):
+
+    def test_requests_hold_the_connector_limiter(self):
+        with FakeAccount(make_buckets(12, 200, [1, 2], 2, 0.1)) as account:
+            connector = account.connector
+            connector.max_retries = 20
+            limiter = connector.limiter
+            before = account.server.counts()
+            releases = []
+            release = limiter.release
+
+            def record_release(throttled=False):
+                release(throttled)
+                releases.append((throttled, limiter.limit))
+
+            limiter.release = record_release
+            account.server.error_rate = 0.3
+            random.seed(0)
+
+            AsyncBucketScanner(connector, max_in_flight=16).run(
+                writer=TextReportWriter(io.StringIO()))
+
+            calls = account.server.counts()
+            self.assertEqual(len(releases),
+                             sum(calls.values()) - sum(before.values()))
+            self.assertTrue(any(throttled for throttled, _ in releases))
+            self.assertLess(min(limit for _, limit in releases), 16)
+            self.assertEqual(limiter.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
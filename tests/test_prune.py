@@ -0,0 +1,88 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import unittest
+
+# Project Imports
+
+import helpers  # noqa: F401, puts the repository on sys.path
+from library import ListEntry
+from prune import select_identical
+from prune import select_keep_newest
+
+_SHA1 = 'a' * 40
+
+
+def _version(number, action='upload', sha1=_SHA1):
+    # Version number 0 is the newest.
+    if action != 'upload':
+        sha1 = 'none'
+    return ListEntry('file', 'id%d' % number, action, None, sha1,
+                     0 if action != 'upload' else 5, 1000 - number)
+
+
+class KeepNewestTest(unittest.TestCase):
+
+    def test_keeps_newest_uploads(self):
+        versions = [_version(i) for i in range(4)]
+        self.assertEqual([v.fileId for v in select_keep_newest(versions, 2)],
+                         ['id2', 'id3'])
+
+    def test_hidden_file_keeps_an_upload(self):
+        versions = [_version(0, 'hide'), _version(1), _version(2),
+                    _version(3, 'hide'), _version(4)]
+        deleted = select_keep_newest(versions, 1)
+        self.assertEqual([v.fileId for v in deleted], ['id2', 'id3', 'id4'])
+
+    def test_hidden_file_without_older_uploads_is_left_alone(self):
+        versions = [_version(0, 'hide'), _version(1)]
+        self.assertEqual(select_keep_newest(versions, 1), [])
+
+
+class IdenticalTest(unittest.TestCase):
+
+    def test_deletes_older_copies_of_the_newest_content(self):
+        versions = [_version(0), _version(1, sha1='b' * 40), _version(2)]
+        self.assertEqual([v.fileId for v in select_identical(versions, 1)],
+                         ['id2'])
+
+    def test_hidden_file_is_left_alone(self):
+        versions = [_version(0, 'hide'), _version(1), _version(2)]
+        self.assertEqual(select_identical(versions, 1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
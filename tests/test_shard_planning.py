@@ -0,0 +1,104 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import unittest
+
+# Project Imports
+
+from helpers import FakeAccount
+from fake_b2_server import make_buckets
+
+
+def _covers_keyspace(key_ranges, prefix=''):
+    starts = [r[0] for r in key_ranges]
+    ends = [r[1] for r in key_ranges]
+    return starts[0] == prefix and ends[-1] is None and \
+        starts[1:] == ends[:-1]
+
+
+class ShardPlanningTest(unittest.TestCase):
+
+    def test_flat_bucket_is_sampled_not_listed(self):
+        buckets = make_buckets(1, 30000, (90, 7, 2, 1), 0, 0.02)
+        with FakeAccount(buckets) as account:
+            connector = account.connector
+            page_sizes = []
+            list_file_versions = connector.list_file_versions
+
+            def counting(bucket_id, max_file_count, *args, **kwargs):
+                page_sizes.append(max_file_count)
+                return list_file_versions(bucket_id, max_file_count, *args,
+                                          **kwargs)
+
+            connector.list_file_versions = counting
+            before = account.list_calls()
+            key_ranges = connector.get_shard_boundaries(16)
+            planning_calls = account.list_calls() - before
+
+            # One discovery page, then one-entry probes, at most 8 per
+            # shard.
+            self.assertEqual(len([size for size in page_sizes if size > 1]),
+                             1)
+            self.assertLessEqual(planning_calls, 1 + 16 * 8)
+            self.assertGreater(len(key_ranges), 1)
+            self.assertTrue(_covers_keyspace(key_ranges))
+
+    def test_folders_are_split_on_from_one_page(self):
+        buckets = make_buckets(1, 5000, (90, 7, 2, 1), 16, 0.02)
+        with FakeAccount(buckets) as account:
+            before = account.list_calls()
+            key_ranges = account.connector.get_shard_boundaries(8)
+
+            self.assertEqual(account.list_calls() - before, 1)
+            self.assertEqual(len(key_ranges), 8)
+            self.assertTrue(all(r[0].endswith('/') for r in key_ranges[1:]))
+            self.assertTrue(_covers_keyspace(key_ranges))
+
+    def test_sharded_scan_matches_serial_scan(self):
+        buckets = make_buckets(1, 5000, (60, 30, 8, 2), 0, 0.02)
+        with FakeAccount(buckets) as account:
+            serial = account.connector.scan_versions(
+                account.connector._plan_key_ranges(workers=1), 1)
+            sharded = account.connector.scan_versions(
+                account.connector._plan_key_ranges(workers=4), 4)
+
+            self.assertEqual(len(serial), len(sharded))
+            self.assertEqual(list(serial.iter_multi_version_groups()),
+                             list(sharded.iter_multi_version_groups()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import threading
+import unittest
+
+# Project Imports
+
+from helpers import FakeAccount
+import b2_connector
+from fake_b2_server import make_buckets
+from verify import ContentHasher
+from verify import FAILED
+from verify import MISMATCH
+
+
+class RangedVerifyTest(unittest.TestCase):
+
+    def test_buffered_ranges_are_bounded_by_download_workers(self):
+        buckets = make_buckets(1, 40, [1, 2], 2, 0.0,
+                               content_size=2 * 1000 * 1000)
+        with FakeAccount(buckets) as account:
+            connector = account.connector
+            lock = threading.Lock()
+            ranges = [0, 0]  # buffered now, most buffered at once
+            download_range = connector._download_range
+
+            def counting_download_range(file_id, start, end, length, *args):
+                if (start, end) != (0, length):
+                    with lock:
+                        ranges[0] = ranges[0] + 1
+                        ranges[1] = max(ranges)
+                return download_range(file_id, start, end, length, *args)
+
+            class CountingHasher(ContentHasher):
+
+                def update(self, data):
+                    # Whole ranges arrive as bytearrays, streamed chunks as
+                    # bytes.
+                    if isinstance(data, bytearray):
+                        with lock:
+                            ranges[0] = ranges[0] - 1
+                    ContentHasher.update(self, data)
+
+            connector._download_range = counting_download_range
+            hasher = b2_connector.ContentHasher
+            b2_connector.ContentHasher = CountingHasher
+            try:
+                failures, count, downloaded, elapsed_time = \
+                    connector.verify_versions(selection='all',
+                                              download_workers=2,
+                                              range_size=100 * 1000)
+            finally:
+                b2_connector.ContentHasher = hasher
+
+            self.assertFalse([failure for failure in failures
+                              if failure[1] in (MISMATCH, FAILED)])
+            self.assertEqual(ranges[0], 0)
+            self.assertGreater(ranges[1], 0)
+            self.assertLessEqual(ranges[1], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import binascii
+import hashlib
+
+# Project Imports
+
+from version_store import pack_digests
+from version_store import MD5_PRESENT
+from version_store import SHA1_PRESENT
+
+# Verifying a version downloads it and runs the body through md5 and sha1 as
+# it arrives, so no version is ever held in memory whole. A large version is
+# fetched as several ranged requests in parallel, but the digests can only
+# take its bytes in order: the ranges are hashed one after the other as they
+# come in, and only the few fetched ahead of the one being hashed are
+# buffered.
+
+VERIFIED = 'verified'
+MISMATCH = 'mismatch'
+UNHASHED = 'no stored digest'
+FAILED = 'download failed'
+
+
+class ContentHasher:
+    '''
+    md5 and sha1 of a body fed to it a chunk at a time.
+    '''
+
+    def __init__(self):
+        self.md5 = hashlib.md5()
+        self.sha1 = hashlib.sha1()
+        self.length = 0
+
+    def update(self, chunk):
+        self.md5.update(chunk)
+        self.sha1.update(chunk)
+        self.length = self.length + len(chunk)
+
+
+def check_version(item, hasher):
+    '''
+    Compares a downloaded body with what the listing says about the version.
+    B2 keeps a sha1 for small files and, for large files, only the md5 the
+    uploader may have set; each one present is checked.
+    :param item: ListEntry of the version
+    :param hasher: ContentHasher the whole body went through
+    :return: VERIFIED, MISMATCH or UNHASHED, and a description of the
+    difference (or of the computed digests when nothing was stored)
+    '''
+
+    flags, md5_bytes, sha1_bytes = pack_digests(item.contentMd5,
+                                                item.contentSha1)
+    md5 = hasher.md5.hexdigest()
+    sha1 = hasher.sha1.hexdigest()
+
+    problems = []
+    if hasher.length != item.contentLength:
+        problems.append('length %d, listed %d' % (hasher.length,
+                                                  item.contentLength))
+    if flags & SHA1_PRESENT:
+        stored = binascii.hexlify(sha1_bytes).decode('ascii')
+        if sha1 != stored:
+            problems.append('sha1 %s, listed %s' % (sha1, stored))
+    if flags & MD5_PRESENT:
+        stored = binascii.hexlify(md5_bytes).decode('ascii')
+        if md5 != stored:
+            problems.append('md5 %s, listed %s' % (md5, stored))
+
+    if problems:
+        return MISMATCH, ', '.join(problems)
+    if not flags & (SHA1_PRESENT | MD5_PRESENT):
+        return UNHASHED, 'sha1 %s, md5 %s' % (sha1, md5)
+    return VERIFIED, ''
+
+# Bodies are read from the connection 64 KB at a time, the unit the bandwidth
+# cap is charged in. A large version keeps at most RANGES_AHEAD ranges
+# downloading or buffered past the one being hashed, and all versions together
+# at most --download-workers ranges.
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+RANGES_AHEAD = 4
+
+
+def split_ranges(length, range_size):
+    '''
+    :return: list of (start, end) byte ranges, end excluded, covering a body
+    of length bytes in pieces of range_size
+    '''
+
+    return [(start, min(start + range_size, length))
+            for start in range(0, length, range_size)]
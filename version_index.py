@@ -0,0 +1,430 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import json
+import sqlite3
+import time
+
+# Project Imports
+
+from version_store import MD5_PRESENT
+from version_store import SHA1_PRESENT
+from version_store import unpack_digests
+
+# Every version listed is kept in the versions table. A scan is split into
+# key ranges that are saved with the bucket, so the next scan of the same
+# prefixes lists the same ranges; a range whose versions have the same digest
+# as last time is left alone, only changed ranges are compared row by row.
+# What changed is kept per scan, in new versions (first_seen), removed_versions
+# and newly_multi_versioned.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS buckets (
+    bucket_id TEXT PRIMARY KEY,
+    bucket_name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scans (
+    scan_id INTEGER PRIMARY KEY,
+    bucket_id TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    file_id TEXT PRIMARY KEY,
+    bucket_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    action TEXT NOT NULL,
+    digest_flags INTEGER NOT NULL,
+    md5 BLOB,
+    sha1 BLOB,
+    content_length INTEGER NOT NULL,
+    upload_timestamp INTEGER NOT NULL,
+    first_seen INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS versions_by_name
+    ON versions (bucket_id, file_name);
+CREATE INDEX IF NOT EXISTS versions_by_upload
+    ON versions (bucket_id, upload_timestamp);
+CREATE INDEX IF NOT EXISTS versions_by_scan
+    ON versions (first_seen);
+CREATE TABLE IF NOT EXISTS removed_versions (
+    file_id TEXT NOT NULL,
+    bucket_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    action TEXT NOT NULL,
+    digest_flags INTEGER NOT NULL,
+    md5 BLOB,
+    sha1 BLOB,
+    content_length INTEGER NOT NULL,
+    upload_timestamp INTEGER NOT NULL,
+    first_seen INTEGER NOT NULL,
+    removed_in INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS newly_multi_versioned (
+    scan_id INTEGER NOT NULL,
+    bucket_id TEXT NOT NULL,
+    file_name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scan_plans (
+    bucket_id TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    key_ranges TEXT NOT NULL,
+    PRIMARY KEY (bucket_id, scope)
+);
+CREATE TABLE IF NOT EXISTS key_ranges (
+    bucket_id TEXT NOT NULL,
+    key_range TEXT NOT NULL,
+    version_count INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    scan_id INTEGER NOT NULL,
+    PRIMARY KEY (bucket_id, key_range)
+);
+'''
+
+VERSION_COLUMNS = 'file_id, bucket_id, file_name, action, digest_flags, ' \
+                  'md5, sha1, content_length, upload_timestamp'
+
+# The versions of the bucket inside a key range, see
+# B2Connector.get_shard_boundaries.
+
+RANGE_CONDITION = '''
+    bucket_id = :bucket_id
+    AND file_name >= :start_file_name
+    AND (:end_file_name IS NULL OR file_name < :end_file_name)
+    AND substr(file_name, 1, length(:prefix)) = :prefix
+    AND (:delimiter = ''
+         OR instr(substr(file_name, length(:prefix) + 1), :delimiter) = 0)
+'''
+
+INSERT_BATCH_SIZE = 10000
+
+
+class VersionIndex:
+    '''
+    SQLite index of the versions of one or more buckets, updated by
+    incremental scans. See B2Connector.update_version_index.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: SQLite database file, created if it doesn't exist
+        '''
+
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS seen ('
+            'file_id TEXT PRIMARY KEY, bucket_id TEXT, file_name TEXT, '
+            'action TEXT, digest_flags INTEGER, md5 BLOB, sha1 BLOB, '
+            'content_length INTEGER, upload_timestamp INTEGER)')
+
+    def close(self):
+        self.connection.close()
+
+    def begin_scan(self, bucket_id, bucket_name):
+        '''
+        :return: id of the new scan
+        '''
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO buckets VALUES (?, ?)',
+                (bucket_id, bucket_name))
+            cursor = self.connection.execute(
+                'INSERT INTO scans (bucket_id, started) VALUES (?, ?)',
+                (bucket_id, time.time()))
+        return cursor.lastrowid
+
+    def finish_scan(self, scan_id):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE scans SET finished = ? WHERE scan_id = ?',
+                (time.time(), scan_id))
+
+    def previous_scan(self, bucket_id, scan_id):
+        '''
+        :return: id of the last finished scan of the bucket before scan_id,
+        or None for the first one
+        '''
+
+        row = self.connection.execute(
+            'SELECT max(scan_id) FROM scans WHERE bucket_id = ? AND '
+            'scan_id < ? AND finished IS NOT NULL',
+            (bucket_id, scan_id)).fetchone()
+        return row[0]
+
+    def saved_key_ranges(self, bucket_id, prefixes, delimiter):
+        '''
+        :return: the key ranges the last scan of these prefixes used, or
+        None
+        '''
+
+        row = self.connection.execute(
+            'SELECT key_ranges FROM scan_plans WHERE bucket_id = ? AND '
+            'scope = ?',
+            (bucket_id, _scope(prefixes, delimiter))).fetchone()
+        if row is None:
+            return None
+        return [tuple(key_range) for key_range in json.loads(row[0])]
+
+    def save_key_ranges(self, bucket_id, prefixes, delimiter, key_ranges):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO scan_plans VALUES (?, ?, ?)',
+                (bucket_id, _scope(prefixes, delimiter),
+                 json.dumps(key_ranges)))
+
+    def update_range(self, scan_id, bucket_id, key_range, store):
+        '''
+        Brings the index up to date with a freshly listed key range.
+        :param scan_id: id from begin_scan
+        :param key_range: (start_file_name, end_file_name, prefix,
+        delimiter)
+        :param store: VersionStore with every version in the range
+        :return: False if the range hadn't changed since the last scan and
+        was skipped, True if it was updated
+        '''
+
+        range_key = json.dumps(list(key_range))
+        digest = store.digest()
+
+        row = self.connection.execute(
+            'SELECT version_count, digest FROM key_ranges WHERE '
+            'bucket_id = ? AND key_range = ?',
+            (bucket_id, range_key)).fetchone()
+        if row is not None and row[0] == len(store) and row[1] == digest:
+            with self.connection:
+                self.connection.execute(
+                    'UPDATE key_ranges SET scan_id = ? WHERE bucket_id = ? '
+                    'AND key_range = ?', (scan_id, bucket_id, range_key))
+            return False
+
+        start_file_name, end_file_name, prefix, delimiter = key_range
+        params = {}
+        params['bucket_id'] = bucket_id
+        params['start_file_name'] = start_file_name
+        params['end_file_name'] = end_file_name
+        params['prefix'] = prefix
+        params['delimiter'] = delimiter
+        params['scan_id'] = scan_id
+
+        connection = self.connection
+        with connection:
+            connection.execute('DELETE FROM temp.seen')
+
+            rows = []
+            for row in _version_rows(bucket_id, store):
+                rows.append(row)
+                if len(rows) >= INSERT_BATCH_SIZE:
+                    connection.executemany(
+                        'INSERT OR IGNORE INTO temp.seen VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                    rows = []
+            connection.executemany(
+                'INSERT OR IGNORE INTO temp.seen VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+            # The names whose versions change, with their version count
+            # before the change.
+
+            connection.execute('DROP TABLE IF EXISTS temp.touched')
+            connection.execute(
+                'CREATE TEMP TABLE touched AS '
+                'SELECT file_name, (SELECT count(*) FROM versions v '
+                '    WHERE v.bucket_id = :bucket_id AND '
+                '    v.file_name = names.file_name) AS before '
+                'FROM (SELECT file_name FROM temp.seen s WHERE NOT EXISTS '
+                '      (SELECT 1 FROM versions v WHERE v.file_id = s.file_id) '
+                '      UNION '
+                '      SELECT file_name FROM versions v WHERE ' +
+                RANGE_CONDITION + ' AND NOT EXISTS '
+                '      (SELECT 1 FROM temp.seen s '
+                '       WHERE s.file_id = v.file_id)) names', params)
+
+            connection.execute(
+                'INSERT INTO removed_versions SELECT ' + VERSION_COLUMNS +
+                ', first_seen, :scan_id FROM versions v WHERE ' +
+                RANGE_CONDITION + ' AND NOT EXISTS '
+                '(SELECT 1 FROM temp.seen s WHERE s.file_id = v.file_id)',
+                params)
+            connection.execute(
+                'DELETE FROM versions WHERE ' + RANGE_CONDITION +
+                ' AND NOT EXISTS (SELECT 1 FROM temp.seen s '
+                'WHERE s.file_id = versions.file_id)', params)
+
+            connection.execute(
+                'INSERT OR IGNORE INTO versions SELECT ' + VERSION_COLUMNS +
+                ', :scan_id FROM temp.seen', params)
+
+            connection.execute(
+                'INSERT INTO newly_multi_versioned '
+                'SELECT :scan_id, :bucket_id, file_name FROM temp.touched t '
+                'WHERE before <= 1 AND (SELECT count(*) FROM versions v '
+                '    WHERE v.bucket_id = :bucket_id AND '
+                '    v.file_name = t.file_name) > 1', params)
+
+            connection.execute(
+                'INSERT OR REPLACE INTO key_ranges VALUES (?, ?, ?, ?, ?)',
+                (bucket_id, range_key, len(store), digest, scan_id))
+            connection.execute('DELETE FROM temp.seen')
+
+        return True
+
+    def new_versions(self, scan_id):
+        '''
+        :return: list of (file name, file id, upload timestamp) first seen
+        by the scan
+        '''
+
+        return self.connection.execute(
+            'SELECT file_name, file_id, upload_timestamp FROM versions '
+            'WHERE first_seen = ? ORDER BY file_name, upload_timestamp DESC',
+            (scan_id,)).fetchall()
+
+    def removed_versions(self, scan_id):
+        '''
+        :return: list of (file name, file id, upload timestamp) that the scan
+        no longer found
+        '''
+
+        return self.connection.execute(
+            'SELECT file_name, file_id, upload_timestamp FROM '
+            'removed_versions WHERE removed_in = ? '
+            'ORDER BY file_name, upload_timestamp DESC',
+            (scan_id,)).fetchall()
+
+    def newly_multi_versioned(self, scan_id):
+        '''
+        :return: list of (file name, version count) for the files that had
+        at most one version before the scan and more than one after it
+        '''
+
+        return self.connection.execute(
+            'SELECT n.file_name, (SELECT count(*) FROM versions v '
+            '    WHERE v.bucket_id = n.bucket_id AND '
+            '    v.file_name = n.file_name) '
+            'FROM newly_multi_versioned n WHERE scan_id = ? '
+            'ORDER BY n.file_name', (scan_id,)).fetchall()
+
+    def totals(self, bucket_id, prefixes=None, delimiter=''):
+        '''
+        :param prefixes: Only count the names under these prefixes
+        (optional)
+        :param delimiter: Only count the files directly under each prefix
+        (optional)
+        :return: files with more than one version, files with one version,
+        file versions, as the version report of the same scan counts them
+        '''
+
+        # A name is in scope if it starts with one of the prefixes and, with
+        # a delimiter, has none in the rest of the name.
+
+        clauses = []
+        params = [bucket_id]
+        for prefix in sorted(set(prefixes or [''])):
+            clause = 'substr(file_name, 1, length(?)) = ?'
+            params.extend([prefix, prefix])
+            if delimiter:
+                clause = clause + ' AND instr(substr(file_name, ' \
+                    'length(?) + 1), ?) = 0'
+                params.extend([prefix, delimiter])
+            clauses.append('(' + clause + ')')
+
+        row = self.connection.execute(
+            'SELECT sum(versions > 1), sum(versions = 1), sum(versions) '
+            'FROM (SELECT count(*) AS versions FROM versions '
+            '      WHERE bucket_id = ? AND (' + ' OR '.join(clauses) + ') '
+            '      GROUP BY file_name)',
+            params).fetchone()
+        return tuple(value or 0 for value in row)
+
+    def versions_uploaded_since(self, since_ms, prefix='', bucket_name=None):
+        '''
+        Answers "which versions were uploaded after since_ms under prefix"
+        from the index alone.
+        :param since_ms: upload timestamp, in milliseconds
+        :param prefix: Only names starting with this (optional)
+        :param bucket_name: Only this bucket (optional)
+        :return: list of (bucket name, file name, file id, action, md5, sha1,
+        content length, upload timestamp), newest first
+        '''
+
+        rows = self.connection.execute(
+            'SELECT b.bucket_name, v.file_name, v.file_id, v.action, '
+            'v.digest_flags, v.md5, v.sha1, v.content_length, '
+            'v.upload_timestamp FROM versions v JOIN buckets b '
+            'ON b.bucket_id = v.bucket_id '
+            'WHERE v.upload_timestamp >= ? '
+            'AND substr(v.file_name, 1, length(?)) = ? '
+            'AND (? IS NULL OR b.bucket_name = ?) '
+            'ORDER BY v.upload_timestamp DESC',
+            (since_ms, prefix, prefix, bucket_name, bucket_name))
+
+        results = []
+        for bucket, name, file_id, action, flags, md5, sha1, length, ts in \
+                rows:
+            md5, sha1 = unpack_digests(flags, md5, sha1)
+            results.append((bucket, name, file_id, action, md5, sha1, length,
+                            ts))
+        return results
+
+    def query(self, sql, params=()):
+        '''
+        Runs an ad-hoc SQL query against the index.
+        :return: column names, list of rows
+        '''
+
+        cursor = self.connection.execute(sql, params)
+        columns = [column[0] for column in cursor.description or []]
+        return columns, cursor.fetchall()
+
+
+def _scope(prefixes, delimiter):
+    return json.dumps([sorted(set(prefixes or [''])), delimiter])
+
+
+def _version_rows(bucket_id, store):
+    for file_name, file_id, action, flags, md5, sha1, length, timestamp in \
+            store.iter_versions():
+        if not flags & MD5_PRESENT:
+            md5 = None
+        if not flags & SHA1_PRESENT:
+            sha1 = None
+        yield (file_id, bucket_id, file_name, action, flags, md5, sha1,
+               length, timestamp)
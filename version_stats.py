@@ -0,0 +1,353 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+# Tools Imports
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Project Imports
+
+from version_store import ACTIONS
+
+# The statistics are computed from the columns of a VersionStore, which are
+# already flat arrays: a group end per file name, and a timestamp, length
+# and action per version, newest first within a group. With numpy they are
+# wrapped without copying and every statistic is a vectorized pass over
+# them; without it the same passes run in Python, which is fine for a few
+# million versions.
+#
+# Per prefix rollups need the file names, which are front-coded against the
+# previous name's folder. A name that shares at least its whole first
+# folder with the previous one is in the same folder, so only the names
+# where the shared part is shorter have to be decoded.
+
+_HIDE = ACTIONS.index('hide')
+
+# Buckets for the time between consecutive versions of a file name, with
+# the upper bound of each in milliseconds.
+
+_DAY = 24 * 3600 * 1000
+
+GAP_BUCKETS = (('< 1 minute', 60 * 1000),
+               ('< 1 hour', 3600 * 1000),
+               ('< 1 day', _DAY),
+               ('< 1 week', 7 * _DAY),
+               ('< 30 days', 30 * _DAY),
+               ('< 1 year', 365 * _DAY),
+               ('1 year or more', None))
+
+GAP_PERCENTILES = (50, 90, 99, 100)
+
+PrefixStats = namedtuple('PrefixStats', ['prefix', 'files', 'versions',
+                                         'bytes', 'old_version_bytes',
+                                         'hide_markers'])
+
+
+def _next_below(shared, g, bound):
+    '''
+    :return: index of the first group from g whose name shares fewer than
+    bound bytes with the previous one, or the number of groups
+    '''
+
+    if numpy is not None and not isinstance(shared, array):
+        # Blocks that double in size, so long runs are skipped in a few
+        # calls and short ones don't search far.
+        block = 64
+        while g < len(shared):
+            below = numpy.flatnonzero(shared[g:g + block] < bound)
+            if len(below):
+                return g + int(below[0])
+            g = g + block
+            block = min(block * 2, 1 << 20)
+        return len(shared)
+
+    for i in range(g, len(shared)):
+        if shared[i] < bound:
+            return i
+    return len(shared)
+
+
+def _prefix_runs(store, prefix_length, use_numpy=True):
+    '''
+    Splits the file names of store into runs that share their first folder
+    after prefix_length bytes.
+    :return: list of (index of the first group of the run, folder). Names
+    with no folder of their own are under their first prefix_length bytes.
+    '''
+
+    shared = store.name_shared
+    name_ends = store.name_ends
+    suffixes = store.name_suffixes
+    if numpy is not None and use_numpy:
+        shared = numpy.frombuffer(shared, dtype=numpy.uint16)
+
+    runs = []
+    key = None
+    head = b''
+    g = 0
+    while g < len(shared):
+        # The previous name starts with head, and the shared part is no
+        # longer than it.
+
+        name_shared = int(shared[g])
+        suffix_start = name_ends[g - 1] if g else 0
+        name = head[:name_shared] + bytes(suffixes[suffix_start:name_ends[g]])
+        slash = name.find(b'/', prefix_length)
+        if slash < 0:
+            head = name
+            name_key = name[:prefix_length]
+        else:
+            head = name[:slash + 1]
+            name_key = head
+        if name_key != key:
+            key = name_key
+            runs.append((g, key.decode('utf-8', 'replace')))
+
+        # The names after it that share all of its first folder are in the
+        # same one. One with no folder has to be followed by a decoded name.
+
+        if slash < 0:
+            g = g + 1
+        else:
+            g = _next_below(shared, g + 1, len(head))
+    return runs
+
+
+def _percentile_ranks(count):
+    # Nearest rank, so the percentiles are values that occur.
+
+    return [max((count * p + 99) // 100 - 1, 0) for p in GAP_PERCENTILES]
+
+
+def _numpy_pass(store, runs):
+    '''
+    :return: totals dictionary, version counts dictionary, sorted gap
+    bucket counts, gap percentiles and per run rows, with numpy
+    '''
+
+    ends = numpy.frombuffer(store.group_ends, dtype=numpy.uint64).astype(
+        numpy.int64)
+    timestamps = numpy.frombuffer(store.timestamps, dtype=numpy.int64)
+    lengths = numpy.frombuffer(store.lengths, dtype=numpy.int64)
+    actions = numpy.frombuffer(store.actions, dtype=numpy.uint8)
+
+    starts = numpy.concatenate(([0], ends[:-1]))
+    counts = ends - starts
+
+    # Every version but the first (newest) of its group is an older one,
+    # and its gap is to the version listed before it.
+
+    old = numpy.ones(len(timestamps), dtype=bool)
+    old[starts] = False
+    old_lengths = numpy.where(old, lengths, 0)
+    gaps = (timestamps[:-1] - timestamps[1:])[old[1:]]
+    hides = actions == _HIDE
+
+    totals = {}
+    totals['files'] = len(ends)
+    totals['versions'] = len(timestamps)
+    totals['bytes'] = int(lengths.sum())
+    totals['old_version_bytes'] = int(old_lengths.sum())
+    totals['hide_markers'] = int(numpy.count_nonzero(hides))
+    totals['hidden_files'] = int(numpy.count_nonzero(hides[starts]))
+
+    version_histogram = numpy.bincount(counts)
+    version_counts = {}
+    for count in numpy.flatnonzero(version_histogram):
+        version_counts[int(count)] = int(version_histogram[count])
+
+    edges = numpy.array([bound for label, bound in GAP_BUCKETS[:-1]],
+                        dtype=numpy.int64)
+    gap_counts = [int(c) for c in numpy.bincount(
+        numpy.searchsorted(edges, gaps, side='right'),
+        minlength=len(GAP_BUCKETS))]
+
+    percentiles = []
+    if len(gaps):
+        ranks = _percentile_ranks(len(gaps))
+        partitioned = numpy.partition(gaps, sorted(set(ranks)))
+        percentiles = [int(partitioned[rank]) for rank in ranks]
+
+    run_groups = numpy.array([g for g, key in runs], dtype=numpy.int64)
+    run_versions = starts[run_groups]
+    files = numpy.diff(numpy.append(run_groups, len(ends)))
+    versions = numpy.diff(numpy.append(run_versions, len(timestamps)))
+    run_bytes = numpy.add.reduceat(lengths, run_versions)
+    run_old_bytes = numpy.add.reduceat(old_lengths, run_versions)
+    run_hides = numpy.add.reduceat(hides.astype(numpy.int64), run_versions)
+    rows = [PrefixStats(key, int(files[i]), int(versions[i]),
+                        int(run_bytes[i]), int(run_old_bytes[i]),
+                        int(run_hides[i]))
+            for i, (g, key) in enumerate(runs)]
+
+    return totals, version_counts, gap_counts, percentiles, rows
+
+
+def _python_pass(store, runs):
+    '''
+    Same as _numpy_pass, without numpy.
+    '''
+
+    timestamps = store.timestamps
+    lengths = store.lengths
+    actions = store.actions
+
+    version_counts = {}
+    gaps = array('q')
+    hidden_files = 0
+    run_current_bytes = [0] * len(runs)
+    run_bounds = []
+
+    run = -1
+    next_run = runs[0][0] if runs else None
+    start = 0
+    for g, end in enumerate(store.group_ends):
+        if g == next_run:
+            run = run + 1
+            run_bounds.append((g, start))
+            next_run = runs[run + 1][0] if run + 1 < len(runs) else None
+
+        count = end - start
+        version_counts[count] = version_counts.get(count, 0) + 1
+        if actions[start] == _HIDE:
+            hidden_files = hidden_files + 1
+        run_current_bytes[run] = run_current_bytes[run] + lengths[start]
+        for i in range(start + 1, end):
+            gaps.append(timestamps[i - 1] - timestamps[i])
+        start = end
+
+    totals = {}
+    totals['files'] = len(store.group_ends)
+    totals['versions'] = len(timestamps)
+    totals['bytes'] = sum(lengths)
+    totals['old_version_bytes'] = totals['bytes'] - sum(run_current_bytes)
+    totals['hide_markers'] = actions.count(_HIDE)
+    totals['hidden_files'] = hidden_files
+
+    gaps = sorted(gaps)
+    gap_counts = []
+    below = 0
+    for label, bound in GAP_BUCKETS:
+        up_to = len(gaps) if bound is None else bisect_right(gaps, bound - 1)
+        gap_counts.append(up_to - below)
+        below = up_to
+
+    percentiles = []
+    if gaps:
+        percentiles = [gaps[rank] for rank in _percentile_ranks(len(gaps))]
+
+    rows = []
+    run_bounds.append((len(store.group_ends), len(timestamps)))
+    for i, (g, key) in enumerate(runs):
+        group_end, version_end = run_bounds[i + 1]
+        version_start = run_bounds[i][1]
+        run_bytes = sum(lengths[version_start:version_end])
+        rows.append(PrefixStats(key, group_end - g,
+                                version_end - version_start, run_bytes,
+                                run_bytes - run_current_bytes[i],
+                                actions.count(_HIDE, version_start,
+                                              version_end)))
+
+    return totals, version_counts, gap_counts, percentiles, rows
+
+
+def _version_count_buckets(version_counts):
+    '''
+    :param version_counts: dictionary of number of versions to number of
+    file names with that many
+    :return: list of (lowest, highest, file names) for the buckets 1, 2,
+    3 - 4, 5 - 8 and so on, up to the highest count seen
+    '''
+
+    buckets = {}
+    for count, names in version_counts.items():
+        bucket = (count - 1).bit_length()
+        buckets[bucket] = buckets.get(bucket, 0) + names
+
+    rows = []
+    for bucket in range(max(buckets) + 1 if buckets else 0):
+        low = (1 << (bucket - 1)) + 1 if bucket else 1
+        rows.append((low, 1 << bucket, buckets.get(bucket, 0)))
+    return rows
+
+
+def version_stats(store, prefix_length=0, use_numpy=True):
+    '''
+    Computes statistics about the versions in a VersionStore.
+    :param store: VersionStore
+    :param prefix_length: length in bytes of the prefix every name starts
+    with; names are rolled up by their first folder after it
+    :param use_numpy: use numpy when it is installed
+    :return: dictionary with the totals (files, versions, bytes,
+    old_version_bytes, hide_markers and hidden_files), version_counts (list
+    of (lowest, highest, file names)), gap_counts (file versions per
+    GAP_BUCKETS entry), gap_percentiles (milliseconds for each
+    GAP_PERCENTILES entry, empty with no older versions) and prefixes (list
+    of PrefixStats, most bytes in older versions first)
+    '''
+
+    runs = _prefix_runs(store, prefix_length, use_numpy)
+    if numpy is not None and use_numpy and len(store):
+        passes = _numpy_pass(store, runs)
+    else:
+        passes = _python_pass(store, runs)
+    totals, version_counts, gap_counts, percentiles, rows = passes
+
+    # A prefix split by names with no folder of their own comes up in more
+    # than one run.
+
+    merged = {}
+    for row in rows:
+        if row.prefix in merged:
+            row = PrefixStats(row.prefix,
+                              *[a + b for a, b in zip(merged[row.prefix][1:],
+                                                      row[1:])])
+        merged[row.prefix] = row
+
+    stats = dict(totals)
+    stats['version_counts'] = _version_count_buckets(version_counts)
+    stats['gap_counts'] = gap_counts
+    stats['gap_percentiles'] = percentiles
+    stats['prefixes'] = sorted(merged.values(),
+                               key=lambda r: (-r.old_version_bytes, r.prefix))
+    return stats
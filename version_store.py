@@ -0,0 +1,464 @@
+'''
+Backblaze wants developers and organization to copy and re-use our
+code examples, so we make the samples available by several different
+licenses.  One option is the MIT license (below).  Other options are
+available here:
+
+    https://www.backblaze.com/using_b2_code.html
+
+
+The MIT License (MIT)
+
+Copyright (c) 2020 Backblaze
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from __future__ import print_function
+
+# Python Imports
+
+import binascii
+import hashlib
+from array import array
+from binascii import unhexlify
+
+# Project Imports
+
+# Digest flags, shared with the binary report format. B2 reports the sha1 of
+# hide markers and large files as 'none', which SHA1_NONE keeps apart from a
+# sha1 that wasn't listed at all, so both come back as they were listed.
+
+MD5_PRESENT = 1
+SHA1_PRESENT = 2
+SHA1_UNVERIFIED = 4
+SHA1_NONE = 8
+
+_NO_MD5 = bytes(16)
+_NO_SHA1 = bytes(20)
+
+# Version actions, stored as their index in this tuple.
+
+ACTIONS = ('upload', 'hide', 'start', 'folder')
+
+_ACTION_CODES = dict((action, i) for i, action in enumerate(ACTIONS))
+
+
+def _unhex(text, size):
+    '''
+    :return: the raw digest for a hex string of the right size, else None
+    '''
+
+    if not text or len(text) != size * 2:
+        return None
+    try:
+        return binascii.unhexlify(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def pack_digests(md5, sha1):
+    '''
+    Converts the hex digests of a file version to raw bytes.
+    :param md5: contentMd5, may be None
+    :param sha1: contentSha1, may be None, 'none' or 'unverified:<hex>'
+    :return: flags, 16 byte md5, 20 byte sha1. Missing digests are zeros.
+    '''
+
+    # The usual case, both digests present.
+
+    if md5 and sha1 and len(md5) == 32 and len(sha1) == 40:
+        try:
+            return MD5_PRESENT | SHA1_PRESENT, unhexlify(md5), unhexlify(sha1)
+        except (TypeError, ValueError):
+            pass
+
+    flags = 0
+
+    md5_bytes = _unhex(md5, 16)
+    if md5_bytes is not None:
+        flags = flags | MD5_PRESENT
+    else:
+        md5_bytes = _NO_MD5
+
+    sha1 = sha1 or ''
+    if sha1.startswith('unverified:'):
+        flags = flags | SHA1_UNVERIFIED
+        sha1 = sha1[len('unverified:'):]
+    sha1_bytes = _unhex(sha1, 20)
+    if sha1_bytes is not None:
+        flags = flags | SHA1_PRESENT
+    else:
+        if sha1 == 'none':
+            flags = flags | SHA1_NONE
+        sha1_bytes = _NO_SHA1
+
+    return flags, md5_bytes, sha1_bytes
+
+
+def unpack_digests(flags, md5_bytes, sha1_bytes):
+    '''
+    Reverses pack_digests.
+    :return: md5 hex string or None, sha1 hex string, 'none' or None
+    '''
+
+    md5 = None
+    if flags & MD5_PRESENT:
+        md5 = binascii.hexlify(md5_bytes).decode('ascii')
+
+    sha1 = 'none' if flags & SHA1_NONE else None
+    if flags & SHA1_PRESENT:
+        sha1 = binascii.hexlify(sha1_bytes).decode('ascii')
+        if flags & SHA1_UNVERIFIED:
+            sha1 = 'unverified:' + sha1
+
+    return md5, sha1
+
+
+def _shared_prefix(a, b, limit):
+    '''
+    :return: length of the common prefix of a and b, at most limit
+    '''
+
+    # Binary search with startswith, so the comparing happens in C.
+
+    low = 0
+    high = min(len(a), len(b), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if b.startswith(a[:middle]):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class VersionStore:
+    '''
+    Column store for the file versions of a scan, in listing order. Versions
+    of the same file name are contiguous in a listing, so each file name is
+    kept once per group, front-coded against the previous one's folder, and
+    each version only holds its int64 timestamp and length, its action, raw
+    digests and its file id, front-coded against the first file id stored
+    (they all start with the bucket's part). That is well under 200 bytes
+    per version, where a files_map entry of dictionaries and hex strings
+    takes around 700.
+    '''
+
+    def __init__(self):
+        # Per file name group.
+        self.name_shared = array('H')
+        self.name_ends = array('Q')
+        self.name_suffixes = bytearray()
+        self.group_ends = array('Q')
+        self._last_name = None
+        self._last_folder = b''
+
+        # Per version.
+        self.timestamps = array('q')
+        self.lengths = array('q')
+        self.actions = bytearray()
+        self.flags = bytearray()
+        self.md5s = bytearray()
+        self.sha1s = bytearray()
+        self.file_id_shared = bytearray()
+        self.file_id_ends = array('Q')
+        self.file_id_suffixes = bytearray()
+        self._file_id_reference = None
+        self._file_id_prefix = b''
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def add(self, file_name, file_id, action, md5, sha1, length, timestamp):
+        '''
+        Appends a file version. Versions must be added in listing order, so
+        all the versions of a file name are added one after the other.
+        '''
+
+        if file_name != self._last_name:
+            self._add_group(file_name)
+
+        self._add_file_id(file_id)
+
+        flags, md5_bytes, sha1_bytes = pack_digests(md5, sha1)
+        self.flags.append(flags)
+        self.md5s += md5_bytes
+        self.sha1s += sha1_bytes
+
+        self.timestamps.append(timestamp or 0)
+        self.lengths.append(length or 0)
+        self.actions.append(_ACTION_CODES.get(action, 0))
+
+        self.group_ends[-1] = len(self.timestamps)
+
+    def _add_file_id(self, file_id):
+        # Almost every file id shares the same prefix with the reference, so
+        # try the last shared length before searching.
+
+        file_id_bytes = (file_id or '').encode('ascii')
+        if self._file_id_reference is None:
+            self._file_id_reference = file_id_bytes[:0xff]
+        prefix = self._file_id_prefix
+        shared = len(prefix)
+        if not file_id_bytes.startswith(prefix) or \
+                file_id_bytes[shared:shared + 1] == \
+                self._file_id_reference[shared:shared + 1]:
+            shared = _shared_prefix(self._file_id_reference, file_id_bytes,
+                                    0xff)
+            self._file_id_prefix = self._file_id_reference[:shared]
+        self.file_id_shared.append(shared)
+        self.file_id_suffixes.extend(file_id_bytes[shared:])
+        self.file_id_ends.append(len(self.file_id_suffixes))
+
+    def _add_group(self, file_name):
+        # Names are front-coded against the previous name's folder, which is
+        # where nearly all of the shared part of sorted names is.
+
+        name_bytes = file_name.encode('utf-8')
+        folder = self._last_folder
+        if name_bytes.startswith(folder):
+            shared = len(folder)
+        else:
+            shared = _shared_prefix(folder, name_bytes, 0xffff)
+        self.name_shared.append(shared)
+        self.name_suffixes.extend(name_bytes[shared:])
+        self.name_ends.append(len(self.name_suffixes))
+        self.group_ends.append(len(self.timestamps))
+        self._last_name = file_name
+        self._last_folder = name_bytes[:name_bytes.rfind(b'/') + 1][:0xffff]
+
+    def add_entry(self, item):
+        '''
+        Appends a ListEntry from decode_list_page.
+        '''
+
+        self.add(item.fileName, item.fileId, item.action, item.contentMd5,
+                 item.contentSha1, item.contentLength, item.uploadTimestamp)
+
+    def add_entries(self, items):
+        '''
+        Appends a page of ListEntry. The number columns are extended a page
+        at a time, which is quicker than add_entry for each of them.
+        '''
+
+        if not items:
+            return
+
+        try:
+            timestamps = array('q', [item.uploadTimestamp for item in items])
+            lengths = array('q', [item.contentLength for item in items])
+        except TypeError:
+            # A missing timestamp or length, let add() store it as zero.
+            for item in items:
+                self.add_entry(item)
+            return
+
+        group_ends = self.group_ends
+        add_file_id = self._add_file_id
+        flags = self.flags
+        md5s = self.md5s
+        sha1s = self.sha1s
+        actions = self.actions
+        versions = len(self.timestamps)
+
+        # group_ends[-1] is the end of the open group, moved along as its
+        # versions are added.
+
+        for item in items:
+            if item.fileName != self._last_name:
+                if group_ends:
+                    group_ends[-1] = versions
+                self._add_group(item.fileName)
+            versions = versions + 1
+
+            add_file_id(item.fileId)
+
+            version_flags, md5_bytes, sha1_bytes = pack_digests(
+                item.contentMd5, item.contentSha1)
+            flags.append(version_flags)
+            md5s += md5_bytes
+            sha1s += sha1_bytes
+            actions.append(_ACTION_CODES.get(item.action, 0))
+
+        self.timestamps.extend(timestamps)
+        self.lengths.extend(lengths)
+        group_ends[-1] = versions
+
+    def extend(self, other):
+        '''
+        Appends every version of another store, e.g. the next key range of
+        a sharded scan. other's first file name must sort after this store's
+        last one.
+        '''
+
+        if not len(other):
+            return
+
+        # The columns are appended as they are. The first name of other is
+        # stored whole, since it was front-coded against an empty folder.
+
+        versions = len(self.timestamps)
+        name_bytes = len(self.name_suffixes)
+        file_id_bytes = len(self.file_id_suffixes)
+
+        self.name_shared.extend(other.name_shared)
+        self.name_ends.extend(array('Q', [end + name_bytes
+                                          for end in other.name_ends]))
+        self.name_suffixes.extend(other.name_suffixes)
+        self.group_ends.extend(array('Q', [end + versions
+                                           for end in other.group_ends]))
+        self._last_name = other._last_name
+        self._last_folder = other._last_folder
+
+        self.timestamps.extend(other.timestamps)
+        self.lengths.extend(other.lengths)
+        self.actions.extend(other.actions)
+        self.flags.extend(other.flags)
+        self.md5s.extend(other.md5s)
+        self.sha1s.extend(other.sha1s)
+
+        # other's file ids can be copied too if they decode the same against
+        # this store's reference, otherwise they are front-coded again.
+
+        if self._file_id_reference is None:
+            self._file_id_reference = other._file_id_reference
+        common = _shared_prefix(self._file_id_reference,
+                                other._file_id_reference, 0xff)
+        if max(other.file_id_shared) <= common:
+            self.file_id_shared.extend(other.file_id_shared)
+            self.file_id_ends.extend(array('Q', [end + file_id_bytes
+                                                 for end in
+                                                 other.file_id_ends]))
+            self.file_id_suffixes.extend(other.file_id_suffixes)
+        else:
+            for i in range(len(other)):
+                self._add_file_id(other.file_id(i))
+
+    def _columns(self):
+        return (self.name_shared, self.name_ends, self.name_suffixes,
+                self.group_ends, self.timestamps, self.lengths, self.actions,
+                self.flags, self.md5s, self.sha1s, self.file_id_shared,
+                self.file_id_ends, self.file_id_suffixes)
+
+    def file_id(self, i):
+        start = self.file_id_ends[i - 1] if i else 0
+        return (self._file_id_reference[:self.file_id_shared[i]] +
+                self.file_id_suffixes[start:self.file_id_ends[i]]
+                ).decode('ascii')
+
+    def _digests(self, i):
+        return unpack_digests(self.flags[i],
+                              bytes(self.md5s[i * 16:i * 16 + 16]),
+                              bytes(self.sha1s[i * 20:i * 20 + 20]))
+
+    def fileinfo(self, i):
+        '''
+        :return: fileinfo dictionary for version i, as make_fileinfo builds
+        it
+        '''
+
+        md5, sha1 = self._digests(i)
+
+        fileinfo = {}
+        fileinfo['md5'] = md5
+        fileinfo['sha1'] = sha1
+        fileinfo['uploadtimestamp'] = self.timestamps[i]
+        fileinfo['fileId'] = self.file_id(i)
+        return fileinfo
+
+    def iter_group_bounds(self):
+        '''
+        :return: generator of (file name, index of its first version, index
+        past its last version), in listing order
+        '''
+
+        name = b''
+        start = 0
+        suffix_start = 0
+        for g in range(len(self.group_ends)):
+            suffix_end = self.name_ends[g]
+            name = name[:self.name_shared[g]] + \
+                bytes(self.name_suffixes[suffix_start:suffix_end])
+            suffix_start = suffix_end
+
+            end = self.group_ends[g]
+            yield name.decode('utf-8'), start, end
+            start = end
+
+    def iter_versions(self):
+        '''
+        :return: generator of (file name, file id, action, digest flags, raw
+        md5, raw sha1, content length, upload timestamp) for every version,
+        in listing order. The raw digests are zeros where the flags say
+        they are missing.
+        '''
+
+        md5s = bytes(self.md5s)
+        sha1s = bytes(self.sha1s)
+        for file_name, start, end in self.iter_group_bounds():
+            for i in range(start, end):
+                yield (file_name, self.file_id(i), ACTIONS[self.actions[i]],
+                       self.flags[i], md5s[i * 16:i * 16 + 16],
+                       sha1s[i * 20:i * 20 + 20], self.lengths[i],
+                       self.timestamps[i])
+
+    def digest(self):
+        '''
+        :return: hex digest of the stored versions. Two stores holding the
+        same versions have the same digest.
+        '''
+
+        digest = hashlib.sha1()
+        for column in self._columns():
+            digest.update(column)
+        digest.update(self._file_id_reference or b'')
+        return digest.hexdigest()
+
+    def iter_groups(self, min_versions=1):
+        '''
+        :param min_versions: skip file names with fewer versions
+        :return: generator of (file name, list of fileinfo dictionaries,
+        newest first), in listing order
+        '''
+
+        for file_name, start, end in self.iter_group_bounds():
+            if end - start >= min_versions:
+                yield file_name, [self.fileinfo(i) for i in range(start, end)]
+
+    def iter_multi_version_groups(self):
+        '''
+        :return: generator of (file name, versions) for the file names with
+        more than one version
+        '''
+
+        return self.iter_groups(min_versions=2)
+
+    def single_version_count(self):
+        '''
+        :return: number of file names with exactly one version
+        '''
+
+        count = 0
+        start = 0
+        for end in self.group_ends:
+            if end - start == 1:
+                count = count + 1
+            start = end
+        return count